@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+
+# Per-guild admission control shared by the Discord commands (bot loop) and the
+# FastAPI routes (uvicorn thread), so all state is guarded by one lock.
+ADMISSION_RATE = float(os.getenv('SONIX_ADMISSION_RATE', '1.0'))  # tokens refilled per second
+ADMISSION_BURST = int(os.getenv('SONIX_ADMISSION_BURST', '10'))  # bucket capacity
+MAX_CONCURRENT_RESOLUTIONS = int(os.getenv('SONIX_MAX_RESOLUTIONS', '2'))  # per guild
+
+
+class AdmissionRejected(Exception):
+    """Raised when a guild is over its request rate or resolution cap."""
+
+    def __init__(self, guild_id, reason, retry_after):
+        self.guild_id = guild_id
+        self.reason = reason  # 'rate' or 'busy'
+        self.retry_after = retry_after
+        super().__init__(f"guild {guild_id} rejected ({reason}), retry after {retry_after:.1f}s")
+
+
+class _GuildState:
+    __slots__ = ('tokens', 'updated', 'active', 'admitted', 'rate_limited', 'busy_rejected')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+        self.active = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.busy_rejected = 0
+
+
+class GuildAdmission:
+    def __init__(self, rate=ADMISSION_RATE, burst=ADMISSION_BURST, max_concurrent=MAX_CONCURRENT_RESOLUTIONS):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self._guilds = {}
+        self._lock = threading.Lock()
+
+    def _state(self, guild_id, now):
+        state = self._guilds.get(guild_id)
+        if state is None:
+            state = self._guilds[guild_id] = _GuildState(self.burst, now)
+        else:
+            # Refill lazily; no background task is needed per guild
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+        return state
+
+    def check_rate(self, guild_id, cost=1.0):
+        """
+        Take `cost` tokens from the guild's bucket or raise AdmissionRejected.
+        """
+        guild_id = int(guild_id)
+        with self._lock:
+            state = self._state(guild_id, time.monotonic())
+            if state.tokens < cost:
+                state.rate_limited += 1
+                retry_after = (cost - state.tokens) / self.rate if self.rate > 0 else 60.0
+                raise AdmissionRejected(guild_id, 'rate', retry_after)
+            state.tokens -= cost
+            state.admitted += 1
+
+    def acquire_resolution(self, guild_id):
+        """
+        Reserve one of the guild's concurrent resolution slots or raise AdmissionRejected.
+        """
+        guild_id = int(guild_id)
+        with self._lock:
+            state = self._state(guild_id, time.monotonic())
+            if state.active >= self.max_concurrent:
+                state.busy_rejected += 1
+                raise AdmissionRejected(guild_id, 'busy', 1.0)
+            state.active += 1
+
+    def release_resolution(self, guild_id):
+        with self._lock:
+            state = self._guilds.get(int(guild_id))
+            if state and state.active > 0:
+                state.active -= 1
+
+    def stats(self, guild_id):
+        """
+        Return the counters for a single guild as a plain dict. Read-only: a
+        guild that has never been seen gets defaults and no bucket.
+        """
+        guild_id = int(guild_id)
+        with self._lock:
+            state = self._guilds.get(guild_id)
+            if state is None:
+                state = _GuildState(self.burst, time.monotonic())
+            tokens = min(float(self.burst), state.tokens + (time.monotonic() - state.updated) * self.rate)
+            return {
+                'guild_id': str(guild_id),
+                'tokens': round(tokens, 2),
+                'burst': self.burst,
+                'rate_per_sec': self.rate,
+                'active_resolutions': state.active,
+                'max_concurrent_resolutions': self.max_concurrent,
+                'admitted': state.admitted,
+                'rate_limited': state.rate_limited,
+                'busy_rejected': state.busy_rejected,
+            }
+
+
+# Shared instance used by main.py and api.py
+admission = GuildAdmission()
@@ -1,8 +1,15 @@
 from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
+from typing import List, Optional, Tuple
 import os
+import time
 import asyncio
 from key_utils import get_guild_key
+from log_setup import setup_logging
+from admission import admission, AdmissionRejected
+from queue_view import API_QUEUE_MAX_LIMIT
+from api_bridge import LocalBridge, RemoteBridge, CommandError, API_WORKERS
+from loop_watchdog import MAX_SITES
 
 app = FastAPI()
 from fastapi.middleware.cors import CORSMiddleware
@@ -21,35 +28,51 @@ app.add_middleware(
 
 @app.get("/api/channels")
 async def get_channels(server_key: str):
-    import logging
-    logging.warning(f"get_channels called with server_key={server_key}")
     from key_utils import get_guild_id_from_key
     guild_id = get_guild_id_from_key(server_key)
-    logging.warning(f"guild_id from key: {guild_id}")
     if not guild_id:
-        logging.error("Invalid server key")
+        logger.info("get_channels: invalid server key")
         raise HTTPException(status_code=404, detail="Invalid server key")
-    if not bot_instance:
-        logging.error("Bot not initialized")
+    enforce_admission(guild_id)
+    if not bridge:
+        logger.error("Bot not initialized")
         raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(int(guild_id))
-    logging.warning(f"guild from bot_instance: {guild}")
+    guild = bridge.guild(int(guild_id))
     if not guild:
-        logging.error("Guild not found")
+        logger.info(f"get_channels: guild {guild_id} not found")
         raise HTTPException(status_code=404, detail="Guild not found")
     channels = [
-        {"id": str(ch.id), "name": ch.name}
-        for ch in getattr(guild, "voice_channels", [])
+        {"id": str(ch["id"]), "name": ch["name"]}
+        for ch in guild["voice_channels"]
     ]
-    logging.warning(f"channels: {channels}")
+    logger.debug(f"get_channels: {len(channels)} voice channels for guild {guild_id}")
     return {"channels": channels, "guild_id": str(guild_id)}
 
-# Reference to the bot instance (set from main.py)
+# Reference to the bot instance (set from main.py in thread mode)
 bot_instance = None
+# Where routes read guild state and send commands: LocalBridge in the bot
+# process (thread mode), RemoteBridge in a separate API worker (process mode)
+bridge = None
 
 def set_bot(bot):
-    global bot_instance
+    global bot_instance, bridge
     bot_instance = bot
+    bridge = LocalBridge(bot)
+
+@app.on_event("startup")
+def connect_bridge():
+    global bridge
+    # Set by main.start_api_process() for the worker processes it launches
+    if os.getenv('SONIX_API_MODE') != 'process' or not os.getenv('SONIX_API_IPC_KEY'):
+        return
+    # A worker process of its own: same queued JSON logging, redaction and sampling as the bot
+    setup_logging()
+    bridge = RemoteBridge(os.environ['SONIX_API_IPC'], bytes.fromhex(os.environ['SONIX_API_IPC_KEY']))
+    bridge.connect()
+    bridge.ready.wait(5)
+    # Buckets are per worker process; split the configured rate between the workers
+    admission.rate /= API_WORKERS
+    admission.burst = max(1, admission.burst // API_WORKERS)
 
 class PlayRequest(BaseModel):
     guild_id: int
@@ -57,7 +80,8 @@ class PlayRequest(BaseModel):
     query: str
 
 import logging
-logging.basicConfig(level=logging.WARNING)
+# Handlers are configured once by log_setup.setup_logging() in the hosting process
+logger = logging.getLogger("sonix_api")
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -65,206 +89,250 @@ from fastapi.middleware.cors import CORSMiddleware
 
 import asyncio
 
-def run_in_bot_loop(coro):
-    future = asyncio.run_coroutine_threadsafe(coro, bot_instance.loop)
-    return future.result()
+async def bot_call(name, *args):
+    """Run a bot-side command (see main.py) and turn its CommandError into an HTTP error."""
+    try:
+        return await bridge.call(name, *args)
+    except CommandError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Bot did not answer in time")
+
+def enforce_admission(guild_id):
+    # Per-guild token bucket; reject with 429 instead of queueing more work
+    try:
+        admission.check_rate(guild_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests for this guild",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
+
+def check_guild_key(request, guild_id):
+    guild_key = request.headers.get("x-guild-key")
+    expected_key = get_guild_key(guild_id)
+    if not guild_key or guild_key != expected_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
 
-def ensure_bot_in_voice(channel):
-    voice_client = channel.guild.voice_client
-    if not voice_client or voice_client.channel != channel:
-        coro = channel.connect()
-        future = asyncio.run_coroutine_threadsafe(coro, bot_instance.loop)
-        return future.result()
-    return voice_client
+def require_bridge():
+    if not bridge:
+        raise HTTPException(status_code=500, detail="Bot not initialized")
 
 @app.post("/play")
 async def play_song(req: PlayRequest, request: Request):
-    print("DEBUG: /play endpoint called")
-    logging.warning(f"/play called with guild_id={req.guild_id}, channel_id={req.channel_id}, query={req.query}")
+    logger.info(f"/play called with guild_id={req.guild_id}, channel_id={req.channel_id}, query={req.query}")
     guild_key = request.headers.get("x-guild-key")
     expected_key = get_guild_key(str(req.guild_id))
-    logging.warning(f"Provided key: {guild_key}, Expected key: {expected_key}")
     if not guild_key or guild_key != expected_key:
-        logging.error("Invalid or missing guild key")
+        # Never log the keys themselves
+        logger.warning(f"/play rejected for guild {req.guild_id}: invalid or missing guild key")
         raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        logging.error("Bot not initialized")
+    enforce_admission(req.guild_id)
+    if not bridge:
+        logger.error("Bot not initialized")
         raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(req.guild_id)
-    if not guild:
-        logging.error(f"Guild not found for id {req.guild_id}")
-    channel = guild.get_channel(req.channel_id) if guild else None
-    if not channel:
-        logging.error(f"Channel not found for id {req.channel_id} in guild {req.guild_id}")
-    if not guild or not channel:
-        raise HTTPException(status_code=404, detail="Guild or channel not found")
-    logging.warning(f"Found guild: {guild}, channel: {channel}")
-    # Ensure bot joins the voice channel before sending the play command
-    ensure_bot_in_voice(channel)
-    message = run_in_bot_loop(channel.send(f"Web: Play command received! {req.query}"))
-    ctx = run_in_bot_loop(bot_instance.get_context(message))
-    # Directly call play_song to play the requested music
-    from main import play_song as internal_play_song
-    run_in_bot_loop(internal_play_song(ctx, req.query))
-    logging.warning(f"Play command invoked for {req.query}")
-    return {"status": "queued", "query": req.query}
+    # Joins the channel if needed, then plays or queues; traced as 'POST /play' on the bot side
+    result = await bot_call('play', req.guild_id, req.channel_id, req.query)
+    logger.info(f"/play queued {req.query} for guild {req.guild_id}")
+    return result
 
 
 @app.post("/pause")
 async def pause_song(request: Request):
     data = await request.json()
     guild_id = int(data.get("guild_id"))
-    channel_id = int(data.get("channel_id"))
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(guild_id)
-    voice = None
-    if guild:
-        voice = next((vc for vc in bot_instance.voice_clients if vc.guild.id == guild_id), None)
-    if voice and voice.is_playing():
-        voice.pause()
-        return {"status": "paused"}
-    return {"status": "not_playing"}
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    return await bot_call('pause', guild_id)
 
 @app.post("/unpause")
 async def unpause_song(request: Request):
     data = await request.json()
     guild_id = int(data.get("guild_id"))
-    channel_id = int(data.get("channel_id"))
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(guild_id)
-    voice = None
-    if guild:
-        voice = next((vc for vc in bot_instance.voice_clients if vc.guild.id == guild_id), None)
-    if voice and voice.is_paused():
-        voice.resume()
-        return {"status": "resumed"}
-    return {"status": "not_paused"}
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    return await bot_call('unpause', guild_id)
 
 @app.post("/replay")
 async def replay_song(request: Request):
     data = await request.json()
     guild_id = int(data.get("guild_id"))
     channel_id = int(data.get("channel_id"))
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(guild_id)
-    channel = guild.get_channel(channel_id) if guild else None
-    if not guild or not channel:
-        raise HTTPException(status_code=404, detail="Guild or channel not found")
-    from main import replay
-    message = run_in_bot_loop(channel.send("Web: Replay command received!"))
-    ctx = run_in_bot_loop(bot_instance.get_context(message))
-    run_in_bot_loop(replay(ctx))
-    return {"status": "replayed"}
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    return await bot_call('replay', guild_id, channel_id)
 
 @app.post("/skip")
 async def skip_song(request: Request):
     data = await request.json()
     guild_id = int(data.get("guild_id"))
-    channel_id = int(data.get("channel_id"))
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(guild_id)
-    voice = None
-    if guild:
-        voice = next((vc for vc in bot_instance.voice_clients if vc.guild.id == guild_id), None)
-    if voice and voice.is_playing():
-        voice.stop()
-        return {"status": "skipped"}
-    return {"status": "not_playing"}
-
-def get_song_queue(guild_id):
-    try:
-        from main import song_queues
-        queue = song_queues.get(guild_id, [])
-        # Only return song dicts with expected metadata
-        return [song for song in queue if isinstance(song, dict) and song.get('title')]
-    except Exception:
-        return []
-
-def get_now_playing(guild_id):
-    try:
-        from main import now_playing
-        song = now_playing.get(guild_id)
-        if song and isinstance(song, dict) and song.get('title'):
-            return song
-        return None
-    except Exception:
-        return None
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    return await bot_call('skip', guild_id)
 
 @app.get("/now_playing")
 async def now_playing(request: Request, guild_id: int):
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    guild = bot_instance.get_guild(guild_id)
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    guild = bridge.guild(guild_id)
     if not guild:
         raise HTTPException(status_code=404, detail="Guild not found")
-    song = get_now_playing(guild_id)
     # Return only relevant fields for frontend
-    if song:
-        return {"now_playing": {
-            "title": song.get("title"),
-            "url": song.get("webpage_url"),
-            "thumbnail": song.get("thumbnail")
-        }}
-    return {"now_playing": None}
+    song = guild["now_playing"]
+    if song is None:
+        return {"now_playing": None}
+    return {"now_playing": {**song, "position": current_position(guild)}}
+
+def current_position(guild):
+    """Seconds into the current track, from the bot's frame-counted position (see main.api_position)."""
+    position = guild.get("position")
+    if not position:
+        return None
+    if "seconds" in position:
+        return position["seconds"]
+    seconds = time.time() - position["started_at"]
+    duration = guild["now_playing"].get("duration")
+    return round(max(0.0, min(seconds, duration) if duration else seconds), 2)
+
+class SeekRequest(BaseModel):
+    guild_id: int
+    # Absolute position in seconds, or `delta` seconds relative to the current one
+    position: Optional[float] = None
+    delta: Optional[float] = None
+
+@app.post("/seek")
+async def seek(req: SeekRequest, request: Request):
+    check_guild_key(request, req.guild_id)
+    enforce_admission(req.guild_id)
+    require_bridge()
+    if req.position is None and req.delta is None:
+        raise HTTPException(status_code=400, detail="position or delta is required")
+    # Reopens the cached stream at the new position; no extraction
+    return await bot_call('seek', req.guild_id, req.position, req.delta)
 
 @app.get("/queue")
-async def get_queue(request: Request, guild_id: int):
-    guild_key = request.headers.get("x-guild-key")
-    expected_key = get_guild_key(guild_id)
-    if not guild_key or guild_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid or missing guild key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
-    queue = get_song_queue(guild_id)
-    # Exclude the first song if it's now playing
-    queue_out = [
-        {"title": song.get("title"), "url": song.get("webpage_url"), "thumbnail": song.get("thumbnail")}
-        for song in queue[1:]
-        if song.get("title")
-    ] if queue else []
-    return {"queue": queue_out}
+async def get_queue(request: Request, guild_id: int, offset: int = 0, limit: int = 25):
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    limit = min(limit, API_QUEUE_MAX_LIMIT)
+    # Upcoming songs only; the playing song is popped off the queue and served by /now_playing
+    queue_out, total = bridge.queue(guild_id, offset, limit)
+    return {"queue": queue_out, "total": total, "offset": offset, "limit": limit}
 
 @app.get("/guilds")
 async def get_guilds(request: Request):
     if request.headers.get("x-api-key") != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
-    if not bot_instance:
-        raise HTTPException(status_code=500, detail="Bot not initialized")
+    require_bridge()
     guilds = []
-    for guild in bot_instance.guilds:
+    for guild in bridge.guilds():
         guild_info = {
-            "id": guild.id,
-            "name": guild.name,
-            "text_channels": [
-                {"id": c.id, "name": c.name} for c in guild.text_channels
-            ],
-            "voice_channels": [
-                {"id": c.id, "name": c.name} for c in guild.voice_channels
-            ]
+            "id": guild["id"],
+            "name": guild["name"],
+            "text_channels": guild["text_channels"],
+            "voice_channels": guild["voice_channels"],
         }
         guilds.append(guild_info)
     return {"guilds": guilds}
+
+
+@app.post("/volume")
+async def set_volume(request: Request):
+    data = await request.json()
+    guild_id = int(data.get("guild_id"))
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    # Validated against MAX_VOLUME on the bot side
+    return await bot_call('volume', guild_id, data.get("volume"), data.get("normalize"))
+
+@app.get("/admission")
+async def get_admission(request: Request, guild_id: int):
+    check_guild_key(request, guild_id)
+    # Counters are read-only and must stay reachable while the guild is limited.
+    # In process mode they are this worker's rate buckets only.
+    return {"admission": admission.stats(guild_id)}
+
+@app.get("/resolver")
+async def get_resolver(request: Request, guild_id: int):
+    check_guild_key(request, guild_id)
+    require_bridge()
+    # Process-wide: hedge win rates and latency percentiles, Invidious instance health, SoundCloud cache hit rates
+    return await bot_call('resolver_stats')
+
+@app.get("/loop_lag")
+async def get_loop_lag(request: Request, guild_id: int, sites: int = 5):
+    check_guild_key(request, guild_id)
+    require_bridge()
+    # Process-wide: the bot loop's lag percentiles and the call sites that held it longest
+    return await bot_call('loop_lag', max(0, min(sites, MAX_SITES)))
+
+
+# --- Bulk queue editing: one request per dashboard edit ---
+
+class QueueAddRequest(BaseModel):
+    guild_id: int
+    queries: List[str]
+    # Voice channel to join if the bot is not connected yet
+    channel_id: Optional[int] = None
+    allow_duplicates: bool = False
+
+class QueueRemoveRequest(BaseModel):
+    guild_id: int
+    # 0-based, matching /queue offsets
+    indexes: List[int] = []
+    # Video IDs or URLs
+    ids: List[str] = []
+
+class QueueMoveRequest(BaseModel):
+    guild_id: int
+    # (from, to) pairs of 0-based indexes, applied in order
+    moves: List[Tuple[int, int]]
+
+class QueueGuildRequest(BaseModel):
+    guild_id: int
+
+def require_guild(request, guild_id):
+    check_guild_key(request, guild_id)
+    enforce_admission(guild_id)
+    require_bridge()
+    guild = bridge.guild(guild_id)
+    if not guild:
+        raise HTTPException(status_code=404, detail="Guild not found")
+    return guild
+
+@app.post("/queue/add")
+async def queue_add(req: QueueAddRequest, request: Request):
+    require_guild(request, req.guild_id)
+    queries = [q.strip() for q in req.queries if q.strip()]
+    return await bot_call('queue_add', req.guild_id, queries, req.channel_id, req.allow_duplicates)
+
+@app.post("/queue/remove")
+async def queue_remove(req: QueueRemoveRequest, request: Request):
+    require_guild(request, req.guild_id)
+    return await bot_call('queue_remove', req.guild_id, req.indexes, req.ids)
+
+@app.post("/queue/move")
+async def queue_move(req: QueueMoveRequest, request: Request):
+    require_guild(request, req.guild_id)
+    return await bot_call('queue_move', req.guild_id, [tuple(move) for move in req.moves])
+
+@app.post("/queue/shuffle")
+async def queue_shuffle(req: QueueGuildRequest, request: Request):
+    require_guild(request, req.guild_id)
+    return await bot_call('queue_shuffle', req.guild_id)
+
+@app.post("/queue/clear")
+async def queue_clear(req: QueueGuildRequest, request: Request):
+    require_guild(request, req.guild_id)
+    return await bot_call('queue_clear', req.guild_id)
@@ -0,0 +1,407 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import secrets
+import itertools
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from queue_view import queue_slice, song_summary
+
+# 'thread': uvicorn runs inside the bot process (the default).
+# 'process': a separate multi-worker uvicorn that talks to the bot over a local socket.
+API_MODE = os.getenv('SONIX_API_MODE', 'thread')
+API_WORKERS = int(os.getenv('SONIX_API_WORKERS', '4'))
+API_IPC_ADDRESS = os.getenv('SONIX_API_IPC', os.path.join('sonix_state', 'api.sock'))
+# How often the bot publishes changed guild state to API workers
+SNAPSHOT_INTERVAL = float(os.getenv('SONIX_API_SNAPSHOT_INTERVAL', '0.25'))
+# Every guild is re-read this often, for state that changes without a mark_changed() call
+SNAPSHOT_SWEEP_INTERVAL = float(os.getenv('SONIX_API_SNAPSHOT_SWEEP', '30'))
+# An API worker that lost the bot retries with this backoff (seconds)
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10
+COMMAND_TIMEOUT = float(os.getenv('SONIX_API_COMMAND_TIMEOUT', '60'))
+
+logger = logging.getLogger("sonix_api")
+
+
+class CommandError(Exception):
+    """Raised by bot-side commands; the API turns it into an HTTP error response."""
+
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(status_code, detail, retry_after)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+# Bot-side commands by name: coroutine functions that run on the bot loop
+commands = {}
+# Bot-side read accessors, registered by the bot process with provide_state()
+_state = {}
+# The running BridgeServer (process mode only); change marks are dropped without one
+_server = None
+
+
+def command(name):
+    def register(fn):
+        commands[name] = fn
+        return fn
+    return register
+
+
+def provide_state(snapshot, queue_of, guild_ids):
+    """
+    snapshot(guild_id) -> small dict of guild info (or None); queue_of(guild_id)
+    -> the guild's queue; guild_ids() -> every guild the bot is in. All three
+    read bot state and are called from the bot loop, except in thread mode
+    where the API thread reads them directly as it always has.
+    """
+    _state.update(snapshot=snapshot, queue_of=queue_of, guild_ids=guild_ids)
+
+
+def mark_changed(guild_id):
+    """Publish this guild's info (now playing, voice, volume, channels...) with the next snapshot."""
+    if _server is not None:
+        _server.changed.add(guild_id)
+
+
+def queue_changed(guild_id, op, fields):
+    """GuildQueue listener: note a mutation so only the difference is published."""
+    if _server is not None:
+        _server.note_queue(guild_id, op, fields)
+
+
+def queue_summaries(songs):
+    return [dict(zip(('title', 'url', 'thumbnail'), song_summary(song))) for song in songs]
+
+
+class LocalBridge:
+    """Thread mode: reads go straight to bot state, commands hop onto the bot loop."""
+
+    def __init__(self, bot):
+        # bot.loop is only usable once the bot is running, so it is looked up per call
+        self.bot = bot
+
+    async def call(self, name, *args):
+        future = asyncio.run_coroutine_threadsafe(commands[name](*args), self.bot.loop)
+        # Awaited rather than blocking on .result(), so uvicorn keeps serving meanwhile
+        return await asyncio.wait_for(asyncio.wrap_future(future), COMMAND_TIMEOUT)
+
+    def guild(self, guild_id):
+        return _state['snapshot'](guild_id)
+
+    def guilds(self):
+        return [info for info in map(_state['snapshot'], _state['guild_ids']()) if info]
+
+    def queue(self, guild_id, offset, limit):
+        songs = _state['queue_of'](guild_id)
+        return queue_summaries(queue_slice(songs, offset, limit)), len(songs)
+
+
+class BridgeServer:
+    """
+    Bot side of process mode. Listens on a Unix socket for API workers; each
+    worker gets the full guild state on connect and then, every
+    SNAPSHOT_INTERVAL, only the guilds marked as changed. Guild info is
+    marked by mark_changed() from the bot's mutation points; queues report
+    their own mutations through queue_changed(), and appends plus pops from
+    the front (playlist ingests, track changes) go out as a delta instead of
+    the whole queue. Every SNAPSHOT_SWEEP_INTERVAL all guilds are re-read to
+    pick up anything unmarked. Commands from workers run on the bot loop and
+    their results are sent back. Connections are authenticated with a
+    per-run key passed to the workers.
+    """
+
+    def __init__(self, loop, address=API_IPC_ADDRESS, authkey=None):
+        self.loop = loop
+        self.address = address
+        self.authkey = authkey or secrets.token_bytes(32)
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._infos = {}
+        self._queue_versions = {}
+        self._queues = {}
+        self.changed = set()
+        self._queue_changes = {}  # guild_id -> {'head': popped from the front, 'tail': appended, 'full': bool}
+        self.published = 0
+        self.calls = 0
+
+    def note_queue(self, guild_id, op, fields):
+        change = self._queue_changes.get(guild_id)
+        if change is None:
+            change = self._queue_changes[guild_id] = {'head': 0, 'tail': 0, 'full': False}
+        if change['full']:
+            return
+        if op == 'append':
+            change['tail'] += 1
+        elif op == 'extend':
+            change['tail'] += len(fields['tracks'])
+        elif op == 'pop' and fields.get('index') == 0:
+            change['head'] += 1
+        else:
+            change['full'] = True
+
+    def start(self):
+        global _server
+        _server = self
+        os.makedirs(os.path.dirname(self.address) or '.', exist_ok=True)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        threading.Thread(target=self._accept, name='api-bridge-accept', daemon=True).start()
+        self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self._publish()))
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                logger.warning(f"[API bridge] Rejected a connection: {e}")
+                continue
+            outbox = queue.Queue()
+            with self._conns_lock:
+                # Current state first; under the lock so no published change falls in between
+                outbox.put(('state', dict(self._infos), dict(self._queues), True))
+                self._conns.append(outbox)
+            threading.Thread(target=self._send, args=(conn, outbox), name='api-bridge-send', daemon=True).start()
+            threading.Thread(target=self._receive, args=(conn, outbox), name='api-bridge-recv', daemon=True).start()
+
+    def _drop(self, outbox):
+        with self._conns_lock:
+            if outbox in self._conns:
+                self._conns.remove(outbox)
+
+    def _send(self, conn, outbox):
+        while True:
+            message = outbox.get()
+            if message is None:
+                break
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                break
+        self._drop(outbox)
+        conn.close()
+
+    def _receive(self, conn, outbox):
+        while True:
+            try:
+                kind, call_id, name, args = conn.recv()
+            except (OSError, EOFError):
+                break
+            if kind != 'call' or name not in commands:
+                outbox.put(('result', call_id, False, CommandError(400, f"unknown command {name!r}")))
+                continue
+            self.calls += 1
+            future = asyncio.run_coroutine_threadsafe(commands[name](*args), self.loop)
+            future.add_done_callback(lambda f, call_id=call_id: outbox.put(self._result(call_id, f)))
+        self._drop(outbox)
+        outbox.put(None)
+
+    @staticmethod
+    def _result(call_id, future):
+        error = future.exception()
+        if error is None:
+            return ('result', call_id, True, future.result())
+        if not isinstance(error, CommandError):
+            logger.error(f"[API bridge] Command failed: {error!r}")
+            error = CommandError(500, str(error) or type(error).__name__)
+        return ('result', call_id, False, error)
+
+    def _collect(self, sweep):
+        """
+        Guild infos and queues that changed since the last publish. A queue
+        goes out as ('full', summaries) or ('delta', popped_from_front,
+        appended_summaries); None for either means the guild is gone.
+        """
+        infos, queues = {}, {}
+        changed, self.changed = self.changed, set()
+        queue_changes, self._queue_changes = self._queue_changes, {}
+        if sweep:
+            current = set(_state['guild_ids']())
+            for guild_id in set(self._infos) - current:
+                infos[guild_id] = None
+                queues[guild_id] = None
+                del self._infos[guild_id]
+                self._queues.pop(guild_id, None)
+                self._queue_versions.pop(guild_id, None)
+                queue_changes.pop(guild_id, None)
+            changed |= current
+        for guild_id in changed:
+            info = _state['snapshot'](guild_id)
+            if info is None:
+                # Left the guild since it was marked
+                if self._infos.pop(guild_id, None) is not None:
+                    infos[guild_id] = queues[guild_id] = None
+                    self._queues.pop(guild_id, None)
+                    self._queue_versions.pop(guild_id, None)
+                queue_changes.pop(guild_id, None)
+                continue
+            if info != self._infos.get(guild_id):
+                infos[guild_id] = self._infos[guild_id] = info
+            if sweep and guild_id not in queue_changes:
+                songs = _state['queue_of'](guild_id)
+                # GuildQueue.version moves on every mutation; plain lists are compared by length
+                if getattr(songs, 'version', len(songs)) != self._queue_versions.get(guild_id):
+                    queue_changes[guild_id] = {'head': 0, 'tail': 0, 'full': True}
+        for guild_id, change in queue_changes.items():
+            songs = _state['queue_of'](guild_id)
+            self._queue_versions[guild_id] = getattr(songs, 'version', len(songs))
+            shipped = self._queues.get(guild_id)
+            if change['full'] or shipped is None or change['head'] > len(shipped) or change['tail'] > len(songs):
+                summaries = self._queues[guild_id] = queue_summaries(songs)
+                queues[guild_id] = ('full', summaries)
+                continue
+            tail = queue_summaries(queue_slice(songs, len(songs) - change['tail'], change['tail'])) if change['tail'] else []
+            # A new list rather than an edit in place: the send threads may still be pickling the old one
+            self._queues[guild_id] = shipped[change['head']:] + tail
+            queues[guild_id] = ('delta', change['head'], tail)
+        return infos, queues
+
+    async def _publish(self):
+        swept_at = None
+        while True:
+            sweep = swept_at is None or self.loop.time() - swept_at >= SNAPSHOT_SWEEP_INTERVAL
+            if sweep:
+                swept_at = self.loop.time()
+            with self._conns_lock:
+                try:
+                    infos, queues = self._collect(sweep)
+                except Exception:
+                    logger.exception("[API bridge] Could not build the state snapshot")
+                    infos, queues = {}, {}
+                if infos or queues:
+                    self.published += 1
+                    for outbox in self._conns:
+                        outbox.put(('state', infos, queues, False))
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+
+class RemoteBridge:
+    """
+    API worker side of process mode. A reader thread applies state updates
+    from the bot to local dicts that the routes read without any round trip;
+    commands are sent as messages and awaited on the worker's own loop. If
+    the bot goes away (restart, bridge error) commands fail with 503 while
+    the thread reconnects with backoff; the bot sends its full state again
+    on every new connection.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._infos = {}
+        self._queues = {}
+        self._pending = {}
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._conn = None
+        self.ready = threading.Event()
+        self.reconnects = 0
+
+    def connect(self):
+        threading.Thread(target=self._run, name='api-bridge-recv', daemon=True).start()
+
+    def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        connected_before = False
+        while True:
+            try:
+                conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            except (OSError, EOFError, AuthenticationError) as e:
+                logger.warning(f"[API bridge] Could not reach the bot, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(RECONNECT_MAX_DELAY, delay * 2)
+                continue
+            if connected_before:
+                self.reconnects += 1
+                logger.info("[API bridge] Reconnected to the bot")
+            connected_before = True
+            delay = RECONNECT_MIN_DELAY
+            self._conn = conn
+            self._receive(conn)
+            self._conn = None
+            self.ready.clear()
+            conn.close()
+            for call_id in list(self._pending):
+                waiter = self._pending.pop(call_id, None)
+                if waiter is not None:
+                    loop, future = waiter
+                    loop.call_soon_threadsafe(self._settle, future, False, CommandError(503, "Bot unavailable"))
+
+    def _receive(self, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] == 'state':
+                _, infos, queues, full = message
+                if full:
+                    # Sent first on every connection
+                    self._infos, self._queues = dict(infos), dict(queues)
+                else:
+                    self._apply(infos, queues)
+                self.ready.set()
+            elif message[0] == 'result':
+                _, call_id, ok, value = message
+                waiter = self._pending.pop(call_id, None)
+                if waiter is not None:
+                    loop, future = waiter
+                    loop.call_soon_threadsafe(self._settle, future, ok, value)
+        logger.error("[API bridge] Lost the connection to the bot")
+
+    def _apply(self, infos, queues):
+        for guild_id, info in infos.items():
+            if info is None:
+                self._infos.pop(guild_id, None)
+            else:
+                self._infos[guild_id] = info
+        for guild_id, change in queues.items():
+            if change is None:
+                self._queues.pop(guild_id, None)
+            elif change[0] == 'full':
+                self._queues[guild_id] = change[1]
+            else:
+                _, head, tail = change
+                # Replaced, not edited in place, so a route slicing the old list is unaffected
+                self._queues[guild_id] = self._queues.get(guild_id, [])[head:] + tail
+
+    @staticmethod
+    def _settle(future, ok, value):
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    async def call(self, name, *args):
+        if self._conn is None:
+            raise CommandError(503, "Bot unavailable")
+        loop = asyncio.get_running_loop()
+        call_id = next(self._ids)
+        future = loop.create_future()
+        self._pending[call_id] = (loop, future)
+        try:
+            with self._send_lock:
+                self._conn.send(('call', call_id, name, args))
+            return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+        except (OSError, EOFError):
+            raise CommandError(503, "Bot unavailable")
+        finally:
+            self._pending.pop(call_id, None)
+
+    def guild(self, guild_id):
+        return self._infos.get(guild_id)
+
+    def guilds(self):
+        return list(self._infos.values())
+
+    def queue(self, guild_id, offset, limit):
+        songs = self._queues.get(guild_id) or []
+        return queue_slice(songs, offset, limit), len(songs)
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import logging
+import threading
+import subprocess
+
+from local_library import LibrarySource, probe_opus, is_library_track
+
+AUDIO_CACHE_DIR = os.getenv('SONIX_AUDIO_CACHE_DIR', os.path.join('sonix_state', 'audio'))
+AUDIO_CACHE_MAX_BYTES = int(float(os.getenv('SONIX_AUDIO_CACHE_MB', '2048')) * 1024 * 1024)
+# Plays of a track before its audio is downloaded; 0 turns the cache off
+AUDIO_CACHE_THRESHOLD = int(os.getenv('SONIX_AUDIO_CACHE_THRESHOLD', '3'))
+# Bitrate for sources that are not opus already and have to be transcoded
+AUDIO_CACHE_BITRATE = os.getenv('SONIX_AUDIO_CACHE_BITRATE', '128k')
+# Play counts are kept for this many uncached tracks; the least played are forgotten first
+PLAY_COUNTS_MAX = 20000
+DOWNLOAD_TIMEOUT = 600
+# Downloads running at once; they have their own workers and never take extraction slots
+AUDIO_CACHE_DOWNLOADS = int(os.getenv('SONIX_AUDIO_CACHE_DOWNLOADS', '1'))
+# Hit counts are written back at most this often; downloads and evictions are written at once
+SAVE_INTERVAL = 60
+
+logger = logging.getLogger("sonix_playback")
+
+
+class AudioCache:
+    """
+    On-disk Ogg Opus copies of the tracks played most often. Each play is
+    counted per track ID; once a track reaches AUDIO_CACHE_THRESHOLD plays
+    its audio is fetched in the background with ffmpeg (opus is remuxed,
+    anything else transcoded) and later plays read the local file. When
+    the total size passes the budget, the least frequently used files are
+    evicted, least recently used first among equals.
+
+    The index (files, hits, last use and play counts) is kept in
+    AUDIO_CACHE_DIR/index.json. Methods are thread-safe; download() blocks.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, threshold=AUDIO_CACHE_THRESHOLD):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = {}  # track id -> {'file', 'size', 'hits', 'last_used', 'pre_skip', 'direct'}
+        self.play_counts = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+        self.stats_counters = {'hits': 0, 'misses': 0, 'downloads': 0, 'download_failures': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.threshold > 0 and self.max_bytes > 0
+
+    # --- index ---
+
+    def load(self):
+        if not self.enabled or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[AudioCache] Could not read {self.index_path}: {e}")
+            return
+        with self._lock:
+            # Files removed behind our back are dropped from the index
+            self.entries = {
+                track_id: entry for track_id, entry in data.get('entries', {}).items()
+                if os.path.exists(os.path.join(self.directory, entry['file']))
+            }
+            self.play_counts = data.get('play_counts', {})
+        logger.info(f"[AudioCache] {len(self.entries)} cached tracks, {self.total_bytes() / 1048576:.0f} MB")
+
+    def save(self, force=False):
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved_at < SAVE_INTERVAL):
+                return
+            data = {'entries': dict(self.entries), 'play_counts': dict(self.play_counts)}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self.index_path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            logger.warning(f"[AudioCache] Could not write {self.index_path}: {e}")
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def path(self, track_id):
+        entry = self.entries.get(str(track_id))
+        return os.path.join(self.directory, entry['file']) if entry else None
+
+    # --- playback side ---
+
+    def attach(self, song):
+        """
+        Point `song` at its cached file if there is one. A song still pointing
+        at a file that was evicted since loses that stale stream. Returns True
+        if the song now plays from the cache.
+        """
+        if not self.enabled or not song.id or is_library_track(song):
+            return False
+        path = self.path(song.id)
+        if path is None:
+            if song.stream_url and song.stream_url.startswith(self.directory):
+                song.stream_url = None
+            return False
+        song.stream_url = path
+        song.stream_expires = None
+        song.codec = 'opus' if self.entries[str(song.id)]['direct'] else None
+        return True
+
+    def is_direct(self, song):
+        entry = self.entries.get(str(song.id))
+        return bool(entry and entry['direct'] and song.stream_url == self.path(song.id))
+
+    def open(self, song, start=0.0):
+        """A LibrarySource for a cached track whose file holds 20 ms Opus frames."""
+        entry = self.entries.get(str(song.id))
+        return LibrarySource(song.stream_url, start, entry['pre_skip'] if entry else 0)
+
+    def record_play(self, song):
+        """
+        Count a play of `song`. Returns True when its audio should be
+        downloaded now (threshold reached, not cached, not already pending).
+        """
+        if not self.enabled or not song.id or is_library_track(song):
+            return False
+        track_id = str(song.id)
+        with self._lock:
+            self._dirty = True
+            entry = self.entries.get(track_id)
+            if entry is not None:
+                entry['hits'] += 1
+                entry['last_used'] = time.time()
+                self.stats_counters['hits'] += 1
+                return False
+            self.stats_counters['misses'] += 1
+            count = self.play_counts[track_id] = self.play_counts.get(track_id, 0) + 1
+            if len(self.play_counts) > PLAY_COUNTS_MAX:
+                for stale in sorted(self.play_counts, key=self.play_counts.get)[:len(self.play_counts) - PLAY_COUNTS_MAX]:
+                    del self.play_counts[stale]
+            if count < self.threshold or track_id in self._pending:
+                return False
+            if not (song.stream_url or '').startswith('http'):
+                return False
+            self._pending.add(track_id)
+            return True
+
+    def abandon(self, track_id):
+        """Forget a download that did not finish, so a later play can ask again."""
+        with self._lock:
+            self._pending.discard(str(track_id))
+
+    # --- download and eviction ---
+
+    def download(self, track_id, stream_url, codec=None):
+        """Fetch one track's audio into the cache. Blocking; run it on the download executor."""
+        track_id = str(track_id)
+        name = f"{track_id.replace(':', '_').replace('/', '_')}.opus"
+        target = os.path.join(self.directory, name)
+        tmp = f"{target}.part"
+        # Opus is remuxed without touching the packets; anything else is transcoded once
+        audio = ['-c:a', 'copy'] if codec == 'opus' else ['-c:a', 'libopus', '-b:a', AUDIO_CACHE_BITRATE, '-frame_duration', '20']
+        command = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error',
+            '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+            '-i', stream_url, '-vn', '-map', '0:a:0', *audio, '-f', 'ogg', '-y', tmp,
+        ]
+        started = time.perf_counter()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            subprocess.run(command, check=True, timeout=DOWNLOAD_TIMEOUT, capture_output=True)
+            info = probe_opus(tmp)
+            if info is None:
+                raise ValueError("ffmpeg did not produce Ogg Opus")
+            os.replace(tmp, target)
+            size = os.path.getsize(target)
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            logger.warning(f"[AudioCache] Could not cache {track_id}: {e}")
+            self.stats_counters['download_failures'] += 1
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with self._lock:
+                self._pending.discard(track_id)
+            return False
+        with self._lock:
+            self._pending.discard(track_id)
+            self.entries[track_id] = {
+                'file': name, 'size': size, 'hits': self.play_counts.pop(track_id, 0),
+                'last_used': time.time(), 'pre_skip': info['pre_skip'], 'direct': info['direct'],
+            }
+            self._dirty = True
+            self.stats_counters['downloads'] += 1
+        logger.info(f"[AudioCache] Cached {track_id} ({size / 1048576:.1f} MB) in {time.perf_counter() - started:.1f}s")
+        self.evict()
+        self.save(force=True)
+        return True
+
+    def evict(self):
+        """Remove the least frequently (then least recently) used files until the cache fits its budget."""
+        removed = []
+        with self._lock:
+            total = self.total_bytes()
+            for track_id in sorted(self.entries, key=lambda t: (self.entries[t]['hits'], self.entries[t]['last_used'])):
+                if total <= self.max_bytes:
+                    break
+                entry = self.entries.pop(track_id)
+                total -= entry['size']
+                removed.append(entry['file'])
+                self.stats_counters['evictions'] += 1
+                self._dirty = True
+        for name in removed:
+            # A track playing from the file keeps reading it; the space is freed when it closes
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        return len(removed)
+
+    def stats(self):
+        return {
+            'tracks': len(self.entries),
+            'bytes': self.total_bytes(),
+            'max_bytes': self.max_bytes,
+            'pending': len(self._pending),
+            **self.stats_counters,
+        }
+
+
+# One cache per bot process
+audio_cache = AudioCache()
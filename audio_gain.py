@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import math
+import subprocess
+import numpy as np
+import discord
+
+# Loudness normalization target (integrated LUFS) and the most we will boost/cut
+TARGET_LUFS = float(os.getenv('SONIX_TARGET_LUFS', '-14'))
+MAX_GAIN_DB = float(os.getenv('SONIX_MAX_GAIN_DB', '12'))
+# Seconds of audio analysed per track; loudness rarely changes much after this
+ANALYSIS_SECONDS = int(os.getenv('SONIX_ANALYSIS_SECONDS', '30'))
+# Analyses running at once; each is an ffmpeg reading ANALYSIS_SECONDS of network audio
+GAIN_ANALYSIS_WORKERS = int(os.getenv('SONIX_GAIN_ANALYSIS_WORKERS', '2'))
+MAX_VOLUME = 200  # percent
+
+_LOUDNORM_JSON = re.compile(r'\{[^{}]*"input_i"[^{}]*\}', re.S)
+
+
+def volume_factor(volume_percent, gain_db=0.0):
+    """Linear amplitude factor for a guild volume (percent) plus a track gain in dB."""
+    return (volume_percent / 100.0) * (10 ** (gain_db / 20.0))
+
+
+def ffmpeg_gain_options(factor):
+    """
+    ffmpeg output options that apply `factor` inside the filter chain, or ''
+    when no gain is needed (so opus streams can still be passed through).
+    """
+    if abs(factor - 1.0) < 1e-3:
+        return ''
+    return f"-af volume={factor:.4f}"
+
+
+def analyze_track_gain(stream_url, seconds=ANALYSIS_SECONDS):
+    """
+    Measure integrated loudness of the first `seconds` of a stream with
+    ffmpeg's loudnorm analysis and return the gain in dB that brings it to
+    TARGET_LUFS, or None if it could not be measured. Blocking; run it in an
+    executor.
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostats', '-t', str(seconds), '-i', stream_url,
+        '-vn', '-af', f'loudnorm=I={TARGET_LUFS}:print_format=json', '-f', 'null', '-',
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=seconds + 30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    m = _LOUDNORM_JSON.search(proc.stderr)
+    if not m:
+        return None
+    try:
+        measured = float(json.loads(m.group(0))['input_i'])
+    except (ValueError, KeyError):
+        return None
+    if not math.isfinite(measured):
+        # Silence measures as -inf
+        return None
+    return max(-MAX_GAIN_DB, min(MAX_GAIN_DB, TARGET_LUFS - measured))
+
+
+class NumpyVolumeTransformer(discord.AudioSource):
+    """
+    Drop-in replacement for discord.PCMVolumeTransformer that scales each
+    20 ms s16le frame with one vectorized NumPy multiply instead of per-sample
+    Python work. Volume changes are ramped across one frame to avoid clicks.
+    """
+
+    def __init__(self, original, volume=1.0):
+        if original.is_opus():
+            raise discord.ClientException('AudioSource must not be Opus encoded.')
+        self.original = original
+        self._volume = max(0.0, float(volume))
+        self._applied = self._volume
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(0.0, float(value))
+
+    def cleanup(self):
+        self.original.cleanup()
+
+    def read(self):
+        data = self.original.read()
+        if not data:
+            return data
+        start, self._applied = self._applied, self._volume
+        return scale_pcm(data, start, self._volume)
+
+
+def scale_pcm(data, start, end):
+    """
+    Scale interleaved s16le stereo PCM from gain `start` to `end` (a linear
+    ramp across the frame, or a constant when they match).
+    """
+    if start == end == 1.0:
+        return data
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    if start == end:
+        samples *= end
+    else:
+        frames = samples.size // 2
+        ramp = np.linspace(start, end, frames, dtype=np.float32)
+        samples = (samples.reshape(frames, 2) * ramp[:, None]).ravel()
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype(np.int16).tobytes()
@@ -0,0 +1,201 @@
+import threading
+import numpy as np
+import discord
+
+FRAME_BYTES = discord.opus.Encoder.FRAME_SIZE  # 20 ms of 48 kHz stereo s16le
+FRAME_SAMPLES = FRAME_BYTES // 2
+FRAMES_PER_SECOND = 50
+# Ask for the next track this long before the current one is expected to end
+PREOPEN_SECONDS = 15
+# While no next track is available, ask again at most this often
+RETRY_NEXT_FRAMES = 5 * FRAMES_PER_SECOND
+
+
+def _samples(data):
+    """s16le bytes -> float32 samples, zero-padded to a full frame."""
+    samples = np.zeros(FRAME_SAMPLES, dtype=np.float32)
+    if data:
+        pcm = np.frombuffer(data, dtype=np.int16)
+        samples[:pcm.size] = pcm
+    return samples
+
+
+def _ramp(start, end):
+    """Per-sample gain across one stereo frame, going from `start` to `end`."""
+    if start == end:
+        return start
+    return np.repeat(np.linspace(start, end, FRAME_SAMPLES // 2, dtype=np.float32), 2)
+
+
+class MixingSource(discord.AudioSource):
+    """
+    PCM AudioSource that plays a chain of tracks without stopping the player.
+    The next track's source is opened ahead of time (on_need_next asks for it),
+    then either butted directly against the end of the current one (gapless)
+    or overlapped with an equal-gain crossfade. All mixing is vectorized NumPy
+    on 20 ms frames.
+
+    read() runs on the voice thread; queue_next/skip/volume are called from the
+    event loop, so state changes happen under a lock. Callbacks are invoked
+    from the voice thread and must only hand work to the loop.
+    """
+
+    def __init__(self, source, track, crossfade_seconds=0.0, volume=1.0, gain=1.0,
+                 on_need_next=None, on_track_change=None):
+        self._lock = threading.Lock()
+        self.current = source
+        self.current_track = track
+        self.current_gain = gain
+        self.incoming = None
+        self.incoming_track = None
+        self.incoming_gain = 1.0
+        self.crossfade_frames = int(crossfade_seconds * FRAMES_PER_SECOND)
+        self.volume = volume
+        self._applied_volume = volume
+        self.on_need_next = on_need_next
+        self.on_track_change = on_track_change
+        self.frames = 0  # frames read from the current track
+        self.offset = 0.0  # seconds into the current track where its source started (after a seek)
+        self._fade_pos = None
+        self._next_requested_at = None
+
+    def is_opus(self):
+        return False
+
+    @property
+    def position(self):
+        """Seconds into the current track, counted from the frames actually played."""
+        return self.offset + self.frames / FRAMES_PER_SECOND
+
+    def seek(self, source, offset):
+        """Replace the current track's source with one opened `offset` seconds in."""
+        with self._lock:
+            self.current.cleanup()
+            self.current = source
+            self.offset = offset
+            self.frames = 0
+            # A crossfade in progress is abandoned; the next track is still pre-opened
+            self._fade_pos = None
+            self._next_requested_at = None
+
+    def queue_next(self, source, track, gain=1.0):
+        with self._lock:
+            if self.incoming is not None:
+                self.incoming.cleanup()
+            self.incoming = source
+            self.incoming_track = track
+            self.incoming_gain = gain
+
+    def skip(self):
+        """Jump straight to the pre-opened next track. Returns False if there is none."""
+        with self._lock:
+            if self.incoming is None:
+                return False
+            self._switch(0)
+            return True
+
+    def _remaining_frames(self):
+        duration = getattr(self.current_track, 'duration', None)
+        if not duration:
+            return None
+        return (duration - self.offset) * FRAMES_PER_SECOND - self.frames
+
+    def _maybe_request_next(self):
+        if self.incoming is not None or self.on_need_next is None:
+            return
+        remaining = self._remaining_frames()
+        # Unknown duration: open the next source straight away
+        if remaining is not None and remaining > (PREOPEN_SECONDS * FRAMES_PER_SECOND + self.crossfade_frames):
+            return
+        if self._next_requested_at is not None and self.frames - self._next_requested_at < RETRY_NEXT_FRAMES:
+            return
+        self._next_requested_at = self.frames
+        self.on_need_next()
+
+    def _switch(self, frames_already_read):
+        self.current.cleanup()
+        self.current = self.incoming
+        self.current_track = self.incoming_track
+        self.current_gain = self.incoming_gain
+        self.incoming = None
+        self.incoming_track = None
+        self.frames = frames_already_read
+        self.offset = 0.0
+        self._fade_pos = None
+        self._next_requested_at = None
+        if self.on_track_change:
+            self.on_track_change(self.current_track)
+
+    def _output(self, samples, gain):
+        start, self._applied_volume = self._applied_volume, self.volume
+        samples *= _ramp(start * gain, self.volume * gain)
+        np.clip(samples, -32768, 32767, out=samples)
+        return samples.astype(np.int16).tobytes()
+
+    def read(self):
+        with self._lock:
+            self._maybe_request_next()
+            if self._fade_pos is None and self.incoming is not None and self.crossfade_frames:
+                remaining = self._remaining_frames()
+                if remaining is not None and remaining <= self.crossfade_frames:
+                    self._fade_pos = 0
+            if self._fade_pos is None:
+                data = self.current.read()
+                if not data:
+                    if self.incoming is None:
+                        return b''
+                    # Gapless: the next track's first frame follows immediately
+                    self._switch(0)
+                    data = self.current.read()
+                    if not data:
+                        return b''
+                self.frames += 1
+                return self._output(_samples(data), float(self.current_gain))
+            # Crossfade: outgoing ramps down while incoming ramps up
+            t0 = self._fade_pos / self.crossfade_frames
+            t1 = (self._fade_pos + 1) / self.crossfade_frames
+            outgoing = self.current.read()
+            incoming = self.incoming.read()
+            self._fade_pos += 1
+            self.frames += 1
+            mixed = _samples(outgoing) * (_ramp(1.0 - t0, 1.0 - t1) * self.current_gain)
+            mixed += _samples(incoming) * (_ramp(t0, t1) * self.incoming_gain)
+            if self._fade_pos >= self.crossfade_frames or not incoming:
+                self._switch(self._fade_pos)
+            return self._output(mixed, 1.0)
+
+    def cleanup(self):
+        with self._lock:
+            self.current.cleanup()
+            if self.incoming is not None:
+                self.incoming.cleanup()
+                self.incoming = None
+
+
+class PositionedSource(discord.AudioSource):
+    """
+    Passes another source through and counts the 20 ms frames the player
+    reads from it, so the position is what was actually sent (pauses and
+    player stalls included) rather than wall-clock time.
+    """
+
+    def __init__(self, source, offset=0.0):
+        self.source = source
+        self.offset = offset
+        self.frames = 0
+
+    @property
+    def position(self):
+        return self.offset + self.frames / FRAMES_PER_SECOND
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def read(self):
+        data = self.source.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def cleanup(self):
+        self.source.cleanup()
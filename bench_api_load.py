@@ -0,0 +1,369 @@
+"""
+Load generator for the FastAPI control plane (api.app) against a fake bot.
+
+Usage: python bench_api_load.py [--duration 10] [--concurrency 64] [--guilds 20]
+                                [--queue-size 500] [--mix now_playing=60,queue=30,play=10]
+                                [--mode thread|process] [--workers 4]
+                                [--play-latency 0.05] [--max-p99-ms N] [--json FILE]
+
+Serves api.app on a loopback port against a fake bot whose event loop runs in
+its own thread: guilds with voice and text channels, connected voice
+clients, GuildQueues and now-playing Tracks, registered with api_bridge the
+way main.py registers the real ones. In thread mode uvicorn runs in this
+process like start_api(); in process mode a multi-worker uvicorn reads state
+over the bridge socket like start_api_process(). /play round-trips to the
+fake bot loop like the real command and "resolves" songs with a fixed delay.
+Many keep-alive connections then drive an authenticated request mix and the
+throughput and p50/p95/p99 latency of every route are reported.
+
+No Discord connection or external network is used, and guild keys come from
+a temporary file. Admission limits are lifted unless --keep-admission is
+given, so the numbers show the API itself.
+With --max-p99-ms the exit status is 1 if any route's p99 is over the limit,
+so the run can gate API changes.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import aiohttp
+import uvicorn
+
+import api_bridge
+from track import Track
+from guild_queue import GuildQueue
+from log_setup import write_uvicorn_log_config
+
+
+def fake_track(i):
+    video_id = f"{i:011d}"[-11:]
+    return Track(
+        id=video_id,
+        title=f"Load test song {i}",
+        webpage_url=f"https://www.youtube.com/watch?v={video_id}",
+        thumbnail=f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        duration=180 + i % 120,
+    )
+
+
+class FakeVoiceClient:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self._playing = True
+        self._paused = False
+
+    def is_playing(self):
+        return self._playing and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        # Keep "playing" so /skip and /pause stay meaningful for the next request
+        self._paused = False
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(self, content)
+
+
+class FakeGuild:
+    def __init__(self, guild_id, name):
+        self.id = guild_id
+        self.name = name
+        self.voice_channels = [FakeChannel(self, guild_id * 10 + 1, 'General'), FakeChannel(self, guild_id * 10 + 2, 'Music')]
+        self.text_channels = [FakeChannel(self, guild_id * 10 + 3, 'general')]
+        self.voice_client = FakeVoiceClient(self, self.voice_channels[0])
+
+    def get_channel(self, channel_id):
+        return next((c for c in self.voice_channels + self.text_channels if c.id == channel_id), None)
+
+
+class FakeContext:
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.guild = message.guild
+        self.channel = message.channel
+        self.voice_client = message.guild.voice_client
+
+
+class FakeBot:
+    """Just enough of discord.ext.commands.Bot for api.py, with its loop on a thread like the real bot."""
+
+    def __init__(self, guilds):
+        self.guilds = guilds
+        self._by_id = {g.id: g for g in guilds}
+        self.voice_clients = [g.voice_client for g in guilds]
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='fake-bot-loop', daemon=True).start()
+
+    def get_guild(self, guild_id):
+        return self._by_id.get(int(guild_id))
+
+    async def get_context(self, message):
+        return FakeContext(self, message)
+
+
+def register_fake_bot(bot, guilds, queue_size, play_latency):
+    """
+    Bot-side state and commands for api_bridge, shaped like main.py's but
+    backed by the fake guilds; /play "resolves" with a fixed delay.
+    """
+    song_queues = {}
+    now_playing = {}
+    counter = iter(range(10 ** 9))
+    for guild in guilds:
+        song_queues[guild.id] = GuildQueue(guild.id, None, [fake_track(next(counter)) for _ in range(queue_size)], listener=api_bridge.queue_changed)
+        now_playing[guild.id] = fake_track(next(counter))
+
+    def snapshot(guild_id):
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            return None
+        voice = guild.voice_client
+        song = now_playing[guild_id]
+        return {
+            'id': guild.id,
+            'name': guild.name,
+            'voice_channels': [{'id': c.id, 'name': c.name} for c in guild.voice_channels],
+            'text_channels': [{'id': c.id, 'name': c.name} for c in guild.text_channels],
+            'voice': {'channel_id': voice.channel.id, 'playing': voice.is_playing(), 'paused': voice.is_paused()},
+            'now_playing': {'title': song.title, 'url': song.webpage_url, 'thumbnail': song.thumbnail},
+            'volume': 100,
+            'normalize': False,
+        }
+
+    api_bridge.provide_state(snapshot, lambda guild_id: song_queues.get(guild_id, []), lambda: [g.id for g in guilds])
+
+    @api_bridge.command('play')
+    async def play(guild_id, channel_id, query):
+        guild = bot.get_guild(guild_id)
+        channel = guild.get_channel(channel_id) if guild else None
+        if not channel:
+            raise api_bridge.CommandError(404, "Guild or channel not found")
+        message = await channel.send(f"Web: Play command received! {query}")
+        await bot.get_context(message)
+        # Stands in for resolution; the real one waits on extraction workers
+        await asyncio.sleep(play_latency)
+        queue = song_queues[guild_id]
+        queue.append(fake_track(next(counter)))
+        # Keep queues from growing without bound over a long run
+        if len(queue) > queue_size * 2:
+            queue.popleft()
+        return {"status": "queued", "query": query}
+
+    @api_bridge.command('skip')
+    async def skip(guild_id):
+        voice = bot.get_guild(guild_id).voice_client
+        voice.stop()
+        now_playing[guild_id] = song_queues[guild_id].popleft() if song_queues[guild_id] else now_playing[guild_id]
+        api_bridge.mark_changed(guild_id)
+        return {"status": "skipped"}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_thread_api(bot, port):
+    """Thread mode: uvicorn in this process, as start_api() does."""
+    import api
+    api.set_bot(bot)
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=port, log_level='warning', log_config=None))
+    threading.Thread(target=server.run, name='api', daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    def stop():
+        server.should_exit = True
+    return stop
+
+
+def start_process_api(bot, port, workers, state_dir):
+    """Process mode: bridge server on the fake bot's loop plus a multi-worker uvicorn, as start_api_process() does."""
+    server = api_bridge.BridgeServer(bot.loop, address=os.path.join(state_dir, 'api.sock'))
+    server.start()
+    env = dict(os.environ, SONIX_API_MODE='process', SONIX_API_WORKERS=str(workers),
+               SONIX_API_IPC=server.address, SONIX_API_IPC_KEY=server.authkey.hex())
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning',
+         '--log-config', write_uvicorn_log_config(os.path.join(state_dir, 'uvicorn_log.json'))],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline or proc.poll() is not None:
+                proc.kill()
+                raise SystemExit("API workers did not start")
+            time.sleep(0.1)
+    return proc.terminate
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def build_request(route, guild, key, query_id):
+    headers = {'x-guild-key': key}
+    if route == 'now_playing':
+        return 'GET', '/now_playing', {'guild_id': guild.id}, None, headers
+    if route == 'queue':
+        return 'GET', '/queue', {'guild_id': guild.id, 'offset': random.randint(0, 100), 'limit': 25}, None, headers
+    if route == 'play':
+        body = {'guild_id': guild.id, 'channel_id': guild.voice_channels[0].id, 'query': f"load test query {query_id}"}
+        return 'POST', '/play', None, body, headers
+    if route == 'skip':
+        return 'POST', '/skip', None, {'guild_id': guild.id, 'channel_id': guild.voice_channels[0].id}, headers
+    if route == 'admission':
+        return 'GET', '/admission', {'guild_id': guild.id}, None, headers
+    raise SystemExit(f"unknown route in --mix: {route}")
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+async def drive(base_url, guilds, keys, mix, concurrency, duration):
+    routes, weights = list(mix), list(mix.values())
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    deadline = time.perf_counter() + duration
+    query_ids = iter(range(10 ** 9))
+
+    async def worker(session):
+        while time.perf_counter() < deadline:
+            route = random.choices(routes, weights)[0]
+            guild = random.choice(guilds)
+            method, path, params, body, headers = build_request(route, guild, keys[guild.id], next(query_ids))
+            start = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, params=params, json=body, headers=headers) as resp:
+                    await resp.read()
+                    status = resp.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies[route].append((time.perf_counter() - start) * 1000)
+            statuses[route][status] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+def report(latencies, statuses, elapsed):
+    results = {}
+    print(f"{'route':<14}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for route in sorted(latencies):
+        ordered = sorted(latencies[route])
+        row = {
+            'requests': len(ordered),
+            'rps': len(ordered) / elapsed,
+            'p50_ms': percentile(ordered, 0.50),
+            'p95_ms': percentile(ordered, 0.95),
+            'p99_ms': percentile(ordered, 0.99),
+            'max_ms': ordered[-1],
+            'statuses': {str(k): v for k, v in statuses[route].items()},
+        }
+        results[route] = row
+        print(f"{route:<14}{row['requests']:>10}{row['rps']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}  {row['statuses']}")
+    total = sum(len(v) for v in latencies.values())
+    print(f"{'total':<14}{total:>10}{total / elapsed:>10.1f}   over {elapsed:.1f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--queue-size', type=int, default=500)
+    parser.add_argument('--mix', default='now_playing=60,queue=30,play=10')
+    parser.add_argument('--play-latency', type=float, default=0.05, help='seconds the fake /play resolution takes')
+    parser.add_argument('--keep-admission', action='store_true', help='keep the per-guild rate limits')
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread', help='API in this process, or in separate workers over the bridge')
+    parser.add_argument('--workers', type=int, default=4, help='uvicorn workers in process mode')
+    parser.add_argument('--max-p99-ms', type=float, help='exit 1 if any route p99 exceeds this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    guilds = [FakeGuild(900000000000000000 + i, f"Load guild {i}") for i in range(args.guilds)]
+    keys = {g.id: f"load-test-key-{g.id}" for g in guilds}
+    state_dir = tempfile.mkdtemp(prefix='sonix-bench-')
+    # A throwaway keys file that the API workers also read; guild_keys.json is not touched
+    keys_path = os.path.join(state_dir, 'guild_keys.json')
+    with open(keys_path, 'w') as f:
+        json.dump({str(gid): key for gid, key in keys.items()}, f)
+    os.environ['SONIX_GUILD_KEYS'] = keys_path
+    if not args.keep_admission:
+        # Read at import by admission.py, here and in the API workers
+        os.environ['SONIX_ADMISSION_RATE'] = os.environ['SONIX_ADMISSION_BURST'] = os.environ['SONIX_MAX_RESOLUTIONS'] = '1000000000'
+    bot = FakeBot(guilds)
+    register_fake_bot(bot, guilds, args.queue_size, args.play_latency)
+
+    port = free_port()
+    if args.mode == 'process':
+        stop = start_process_api(bot, port, args.workers, state_dir)
+    else:
+        stop = start_thread_api(bot, port)
+    print(f"Driving api.app ({args.mode} mode) on 127.0.0.1:{port}: {args.concurrency} connections, {args.guilds} guilds, "
+          f"{args.queue_size} queued songs each, mix {args.mix}, {args.duration:.0f} s")
+    latencies, statuses, elapsed = asyncio.run(drive(
+        f"http://127.0.0.1:{port}", guilds, keys, parse_mix(args.mix), args.concurrency, args.duration,
+    ))
+    stop()
+    results = report(latencies, statuses, elapsed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'elapsed_s': elapsed, 'routes': results}, f, indent=2)
+    if args.max_p99_ms is not None:
+        over = [route for route, row in results.items() if row['p99_ms'] > args.max_p99_ms]
+        if over:
+            print(f"p99 over {args.max_p99_ms} ms: {', '.join(over)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
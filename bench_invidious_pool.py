@@ -0,0 +1,98 @@
+"""
+Failover benchmark for the Invidious pool against local stub servers.
+
+Usage: python bench_invidious_pool.py [lookups_per_phase]
+
+Starts three stub Invidious instances with different base latencies, runs
+lookups through InvidiousPool, then degrades the fastest instance (first
+slow responses, then 500s, then a dead port) and shows that lookup latency
+stays close to the next-fastest instance instead of hitting the full timeout.
+"""
+import sys
+import json
+import time
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from invidious_helper import InvidiousPool, get_invidious_audio_url
+
+
+class StubInvidious:
+    """Minimal /api/v1/videos and /api/v1/stats endpoints with adjustable behaviour."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.mode = 'ok'  # 'ok', 'slow', 'error'
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if stub.mode == 'error':
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                time.sleep(stub.delay * (50 if stub.mode == 'slow' else 1))
+                if self.path.startswith('/api/v1/stats'):
+                    body = {'software': {'name': 'invidious'}}
+                else:
+                    video_id = self.path.rsplit('/', 1)[-1]
+                    body = {
+                        'title': f"Stub {video_id}",
+                        'lengthSeconds': 200,
+                        'videoThumbnails': [{'url': 'https://example.invalid/t.jpg'}],
+                        'adaptiveFormats': [
+                            {'type': 'audio/webm; codecs="opus"', 'bitrate': '130000', 'url': f"http://stub/{video_id}.webm"},
+                            {'type': 'audio/mp4; codecs="mp4a.40.2"', 'bitrate': '128000', 'url': f"http://stub/{video_id}.m4a"},
+                        ],
+                    }
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def run_phase(name, pool, count):
+    latencies = []
+    misses = 0
+    for i in range(count):
+        start = time.perf_counter()
+        if not get_invidious_audio_url(f"vid{i:08d}", pool=pool):
+            misses += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<28} p50 {statistics.median(latencies):7.1f} ms   p95 {p95:7.1f} ms   max {latencies[-1]:7.1f} ms   misses {misses}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    fast, medium, slow = StubInvidious(0.005), StubInvidious(0.02), StubInvidious(0.06)
+    pool = InvidiousPool([slow.url, medium.url, fast.url])
+    pool.check_health()
+    # Much faster than the default interval so each phase sees a few probes
+    pool.start_health_checks(interval=0.2)
+    run_phase("all healthy", pool, count)
+    fast.mode = 'slow'
+    run_phase("fastest instance slow", pool, count)
+    fast.mode = 'error'
+    run_phase("fastest instance 500s", pool, count)
+    fast.server.shutdown()
+    fast.server.server_close()
+    run_phase("fastest instance down", pool, count)
+    pool.stop_health_checks()
+    for inst in pool.stats():
+        print(inst)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Memory benchmark: bytes per queued track with the old song dicts (which kept
+yt-dlp's full info dict) versus compact Track records.
+
+Usage: python bench_track_memory.py [tracks]
+
+The info dicts are synthetic but shaped like real yt-dlp output for a YouTube
+video: ~25 formats with signed URLs and HTTP headers, ~40 thumbnails,
+automatic captions in many languages, a heatmap and a description.
+"""
+import sys
+import copy
+import random
+import string
+import tracemalloc
+
+from track import Track
+
+
+def _rand(n):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=n))
+
+
+def fake_info(video_id):
+    expire = 1760000000 + random.randint(0, 20000)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+        'Sec-Fetch-Mode': 'navigate',
+    }
+    formats = []
+    for i in range(25):
+        formats.append({
+            'format_id': str(100 + i),
+            'url': f"https://rr1---sn-{_rand(8)}.googlevideo.com/videoplayback?expire={expire}&ei={_rand(20)}&ip=0.0.0.0&id=o-{_rand(40)}&itag={100 + i}&source=youtube&requiressl=yes&sig={_rand(120)}&lsig={_rand(80)}",
+            'ext': random.choice(['webm', 'm4a', 'mp4']),
+            'acodec': random.choice(['opus', 'mp4a.40.2', 'none']),
+            'vcodec': random.choice(['none', 'avc1.4d401e', 'vp9']),
+            'abr': random.choice([48, 64, 128, 160]),
+            'tbr': random.uniform(50, 3000),
+            'filesize': random.randint(10 ** 6, 10 ** 8),
+            'http_headers': dict(headers),
+            'downloader_options': {'http_chunk_size': 10485760},
+            'protocol': 'https',
+            'format_note': 'medium',
+        })
+    info = {
+        'id': video_id,
+        'title': f"Artist {_rand(6)} - Song {_rand(10)} (Official Video)",
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        'thumbnails': [{'url': f"https://i.ytimg.com/vi/{video_id}/{i}.jpg?sqp={_rand(40)}", 'height': 90 + i, 'width': 120 + i, 'preference': -i, 'id': str(i)} for i in range(40)],
+        'description': _rand(3000),
+        'duration': random.randint(120, 600),
+        'tags': [_rand(8) for _ in range(30)],
+        'formats': formats,
+        'automatic_captions': {
+            f"l{i}": [{'ext': ext, 'url': f"https://www.youtube.com/api/timedtext?v={video_id}&lang=l{i}&fmt={ext}&sig={_rand(60)}", 'name': f"Lang {i}"} for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+            for i in range(100)
+        },
+        'heatmap': [{'start_time': i * 2.5, 'end_time': (i + 1) * 2.5, 'value': random.random()} for i in range(100)],
+        'http_headers': dict(headers),
+        'url': formats[0]['url'],
+        'acodec': 'opus',
+    }
+    return info
+
+
+def measure(build, count):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    items = [build(i) for i in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / count, items
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    random.seed(0)
+    infos = [fake_info(_rand(11)) for _ in range(count)]
+
+    def old_song(i):
+        # What play/fetch_song_metadata used to queue: the dict plus the whole info dict
+        info = copy.deepcopy(infos[i])
+        return {
+            'title': info.get('title'),
+            'webpage_url': info.get('webpage_url'),
+            'thumbnail': info.get('thumbnail'),
+            'audio_url': info.get('url'),
+            'info': info,
+            'query': info.get('webpage_url'),
+        }
+
+    def new_song(i):
+        # Copy the info first so both sides pay for fresh strings, then keep only the Track
+        return Track.from_info(copy.deepcopy(infos[i]), infos[i]['webpage_url'])
+
+    old_per_track, old_items = measure(old_song, count)
+    del old_items
+    new_per_track, new_items = measure(new_song, count)
+    print(f"tracks measured:        {count}")
+    print(f"song dict + info dict:  {old_per_track / 1024:10.1f} KiB per track")
+    print(f"Track record:           {new_per_track / 1024:10.1f} KiB per track")
+    print(f"reduction:              {old_per_track / new_per_track:10.1f}x")
+    print(f"500-track playlist:     {old_per_track * 500 / 2 ** 20:.1f} MiB -> {new_per_track * 500 / 2 ** 20:.2f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+COOKIE_FILE = os.getenv('SONIX_COOKIE_FILE', 'youtube_cookies.txt')
+# How often the bot process looks for an edited/rotated cookie file
+COOKIE_CHECK_SECONDS = float(os.getenv('SONIX_COOKIE_CHECK_SECONDS', '30'))
+# Cookies refreshed by YouTube during extractions are written back at most this often
+COOKIE_FLUSH_SECONDS = float(os.getenv('SONIX_COOKIE_FLUSH_SECONDS', '300'))
+
+logger = logging.getLogger("sonix_debug")
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _load(path):
+    from yt_dlp.cookies import YoutubeDLCookieJar
+    jar = YoutubeDLCookieJar(path)
+    if os.path.exists(path):
+        jar.load(ignore_discard=True, ignore_expires=True)
+    return jar
+
+
+def _fingerprint(cookie):
+    return (cookie.domain, cookie.path, cookie.name, cookie.value, cookie.expires)
+
+
+class CookieManager:
+    """
+    Parses the Netscape cookie file once per process and hands the parsed jar
+    to every YoutubeDL instead of a `cookiefile`, so extractions do no cookie
+    file I/O and never write the file themselves.
+
+    The bot process owns the file. It re-parses it when it changes on disk,
+    swaps the new jar in whole, and bumps a version stamp in shared memory;
+    process-pool workers compare that stamp before each extraction and reload
+    only when it moved, so a rotated cookie reaches every worker at once.
+    Cookies that YouTube refreshes during an extraction are sent back to the
+    bot process (over a queue from workers), merged into its jar, and written
+    to the file in one atomic batch every COOKIE_FLUSH_SECONDS.
+    """
+
+    def __init__(self, path=COOKIE_FILE):
+        self.path = path
+        self._version = multiprocessing.Value('L', 0, lock=False)
+        self._updates = multiprocessing.SimpleQueue()
+        self._lock = threading.Lock()
+        self._owner = True
+        self._jar = None
+        self._loaded_version = -1
+        self._loaded_stamp = None
+        self._baseline = {}
+        self._pending = {}
+        self._checked = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.flushes = 0
+
+    # --- process-pool plumbing ---
+
+    def worker_args(self):
+        """initargs for a ProcessPoolExecutor using init_worker as its initializer."""
+        return (self.path, self._version, self._updates)
+
+    def _adopt(self, path, version, updates):
+        self.path = path
+        self._version = version
+        self._updates = updates
+        self._owner = False
+        # A lock inherited through fork may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self._jar = None
+        self._loaded_version = -1
+
+    # --- loading ---
+
+    def _swap(self, jar, stamp):
+        self._jar = jar
+        self._loaded_stamp = stamp
+        self._baseline = {(c.domain, c.path, c.name): _fingerprint(c) for c in jar}
+        self.reloads += 1
+
+    def check(self):
+        """In the bot process: reload and bump the version if the file changed on disk."""
+        stamp = _stamp(self.path)
+        with self._lock:
+            self._checked = time.monotonic()
+            if self._jar is not None and stamp == self._loaded_stamp:
+                return False
+            try:
+                jar = _load(self.path)
+            except Exception as e:
+                # Keep serving the previous jar; a half-written file is retried on the next check
+                logger.warning(f"[Cookies] Could not parse {self.path}: {e}")
+                if self._jar is None:
+                    from yt_dlp.cookies import YoutubeDLCookieJar
+                    self._swap(YoutubeDLCookieJar(self.path), None)
+                return False
+            self._swap(jar, stamp)
+            # Refreshes that were not flushed yet still apply on top of the new file
+            for cookie in self._pending.values():
+                jar.set_cookie(cookie)
+            self._version.value += 1
+            self._loaded_version = self._version.value
+        logger.info(f"[Cookies] Loaded {len(jar)} cookies from {self.path} (version {self._loaded_version})")
+        return True
+
+    def jar(self):
+        """This process's parsed jar, reloaded only if the file (bot) or version stamp (worker) moved."""
+        if self._owner:
+            if self._jar is None or time.monotonic() - self._checked >= COOKIE_CHECK_SECONDS:
+                self.check()
+            return self._jar
+        version = self._version.value
+        if version != self._loaded_version:
+            with self._lock:
+                if version != self._loaded_version:
+                    try:
+                        self._swap(_load(self.path), None)
+                    except Exception as e:
+                        logger.warning(f"[Cookies] Worker could not parse {self.path}: {e}")
+                        if self._jar is None:
+                            from yt_dlp.cookies import YoutubeDLCookieJar
+                            self._swap(YoutubeDLCookieJar(self.path), None)
+                    self._loaded_version = version
+        return self._jar
+
+    # --- write-back ---
+
+    def collect(self):
+        """Pick up cookies the server set or changed since the last collect."""
+        jar = self._jar
+        if jar is None:
+            return
+        changed = []
+        with self._lock:
+            for cookie in jar:
+                key = (cookie.domain, cookie.path, cookie.name)
+                fingerprint = _fingerprint(cookie)
+                if self._baseline.get(key) != fingerprint:
+                    self._baseline[key] = fingerprint
+                    changed.append(cookie)
+            if changed and self._owner:
+                for cookie in changed:
+                    self._pending[(cookie.domain, cookie.path, cookie.name)] = cookie
+        if changed and not self._owner:
+            self._updates.put(changed)
+
+    def flush(self):
+        """In the bot process: merge refreshed cookies and write the file once, atomically."""
+        self.collect()
+        while not self._updates.empty():
+            for cookie in self._updates.get():
+                self._pending[(cookie.domain, cookie.path, cookie.name)] = cookie
+        with self._lock:
+            if not self._pending or self._jar is None:
+                return False
+            jar = self._jar
+            for cookie in self._pending.values():
+                jar.set_cookie(cookie)
+            tmp = f"{self.path}.tmp"
+            try:
+                jar.save(tmp, ignore_discard=True, ignore_expires=True)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.warning(f"[Cookies] Could not write {self.path}: {e}")
+                return False
+            count = len(self._pending)
+            self._pending.clear()
+            self._baseline = {(c.domain, c.path, c.name): _fingerprint(c) for c in jar}
+            # Our own write is not an external change, but workers must pick up the merged file
+            self._loaded_stamp = _stamp(self.path)
+            self._version.value += 1
+            self._loaded_version = self._version.value
+            self.flushes += 1
+        logger.info(f"[Cookies] Wrote {count} refreshed cookies to {self.path}")
+        return True
+
+    def start(self, check_interval=COOKIE_CHECK_SECONDS, flush_interval=COOKIE_FLUSH_SECONDS):
+        """Background thread in the bot process that watches the file and flushes refreshes."""
+        if self._thread is not None:
+            return
+        def run():
+            last_flush = time.monotonic()
+            while not self._stop.wait(check_interval):
+                self.check()
+                if time.monotonic() - last_flush >= flush_interval:
+                    self.flush()
+                    last_flush = time.monotonic()
+        self._thread = threading.Thread(target=run, name='cookie-jar', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+# One manager per process; workers adopt the bot process's stamp and queue in init_worker
+cookies = CookieManager()
+
+
+def init_worker(path, version, updates):
+    """ProcessPoolExecutor initializer: share the version stamp and update queue with this worker."""
+    cookies._adopt(path, version, updates)
+
+
+@contextmanager
+def youtube_dl(ydl_opts):
+    """
+    YoutubeDL using this process's shared cookie jar. Any `cookiefile` in the
+    options is ignored so yt-dlp neither reads nor writes the file itself.
+    """
+    from yt_dlp import YoutubeDL
+    opts = {key: value for key, value in ydl_opts.items() if key != 'cookiefile'}
+    with YoutubeDL(opts) as ydl:
+        # cookiejar is a cached property; setting it before the first request replaces the empty default
+        ydl.cookiejar = cookies.jar()
+        try:
+            yield ydl
+        finally:
+            cookies.collect()
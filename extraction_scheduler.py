@@ -0,0 +1,145 @@
+import os
+import asyncio
+import functools
+from collections import OrderedDict, deque
+
+import tracing
+
+# Priority classes, lowest value runs first
+INTERACTIVE = 0  # a user is waiting on !play / POST /play
+PRELOAD = 1      # the next track in the queue
+BULK = 2         # Spotify expansion and other lookahead work
+DISPLAY = 3      # metadata that is only used for rendering
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', PRELOAD: 'preload', BULK: 'bulk', DISPLAY: 'display'}
+
+EXTRACTION_WORKERS = int(os.getenv('SONIX_EXTRACTION_WORKERS', '4'))
+# Slots that only interactive jobs may use, so background work never fills the pool
+RESERVED_INTERACTIVE_SLOTS = int(os.getenv('SONIX_RESERVED_INTERACTIVE_SLOTS', '1'))
+
+
+class ExtractionCancelled(Exception):
+    """Raised to waiters whose job was dropped by ExtractionScheduler.cancel()."""
+
+
+class _Job:
+    __slots__ = ('priority', 'guild_id', 'fn', 'executor', 'future', 'span', 'submitted', 'started')
+
+    def __init__(self, priority, guild_id, fn, executor, future):
+        self.priority = priority
+        self.guild_id = guild_id
+        self.fn = fn
+        self.executor = executor
+        self.future = future
+        # Request span the job was submitted under, if any, for queue-wait and run spans
+        self.span = tracing.current_span()
+        self.submitted = tracing.now_us()
+        self.started = None
+
+
+class ExtractionScheduler:
+    """
+    Dispatches blocking extraction calls to an executor by priority class.
+    Within a class, guilds are served round-robin so one guild's bulk import
+    cannot delay another guild's jobs of the same class.
+    Must be used from the bot's event loop thread.
+    """
+
+    def __init__(self, max_workers=EXTRACTION_WORKERS, reserved_interactive=RESERVED_INTERACTIVE_SLOTS):
+        self.max_workers = max_workers
+        self.reserved_interactive = min(reserved_interactive, max_workers - 1)
+        # One OrderedDict per class: {guild_id: deque[_Job]}; order is the round-robin order
+        self._classes = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._running = 0
+        self._running_background = 0
+        self.completed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.cancelled = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    def submit(self, priority, guild_id, fn, executor=None):
+        """
+        Queue `fn()` to run in `executor` (None = default thread pool).
+        Returns an asyncio.Future; cancelling it before dispatch drops the job.
+        Jobs dropped by cancel() fail with ExtractionCancelled instead, so callers
+        can tell them apart from their own task being cancelled.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if executor is None:
+            # Thread pool jobs keep the caller's trace context; process pool jobs cannot carry it
+            fn = tracing.bind(fn)
+        queues = self._classes[priority]
+        queues.setdefault(guild_id, deque()).append(_Job(priority, guild_id, fn, executor, future))
+        self._dispatch()
+        return future
+
+    async def run(self, priority, guild_id, fn, executor=None):
+        return await self.submit(priority, guild_id, fn, executor)
+
+    def cancel(self, guild_id, priorities=(PRELOAD, BULK, DISPLAY)):
+        """
+        Drop a guild's pending jobs in the given classes. Jobs already running
+        in a worker finish, but their results are discarded.
+        """
+        for priority in priorities:
+            jobs = self._classes[priority].pop(guild_id, None)
+            for job in jobs or ():
+                if not job.future.done():
+                    job.future.set_exception(ExtractionCancelled(f"{PRIORITY_NAMES[priority]} job for guild {guild_id} cancelled"))
+                    self.cancelled[PRIORITY_NAMES[priority]] += 1
+
+    def pending(self):
+        return {
+            PRIORITY_NAMES[priority]: sum(len(jobs) for jobs in queues.values())
+            for priority, queues in enumerate(self._classes)
+        }
+
+    def _next_job(self):
+        background_full = self._running_background >= self.max_workers - self.reserved_interactive
+        for priority, queues in enumerate(self._classes):
+            if priority != INTERACTIVE and background_full:
+                return None
+            while queues:
+                guild_id, jobs = next(iter(queues.items()))
+                job = jobs.popleft()
+                if jobs:
+                    queues.move_to_end(guild_id)
+                else:
+                    del queues[guild_id]
+                if job.future.done():
+                    self.cancelled[PRIORITY_NAMES[priority]] += 1
+                    continue
+                return job
+        return None
+
+    def _dispatch(self):
+        while self._running < self.max_workers:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running += 1
+            if job.priority != INTERACTIVE:
+                self._running_background += 1
+            job.started = tracing.now_us()
+            tracing.record('extraction queued', job.span, job.submitted, job.started, priority=PRIORITY_NAMES[job.priority])
+            inner = asyncio.get_running_loop().run_in_executor(job.executor, job.fn)
+            inner.add_done_callback(functools.partial(self._finished, job))
+
+    def _finished(self, job, inner):
+        self._running -= 1
+        if job.priority != INTERACTIVE:
+            self._running_background -= 1
+        self.completed[PRIORITY_NAMES[job.priority]] += 1
+        tracing.record(
+            'extraction run', job.span, job.started, tracing.now_us(),
+            priority=PRIORITY_NAMES[job.priority], executor='thread' if job.executor is None else 'process',
+        )
+        if not job.future.done():
+            if inner.cancelled():
+                job.future.cancel()
+            elif inner.exception() is not None:
+                job.future.set_exception(inner.exception())
+            else:
+                job.future.set_result(inner.result())
+        self._dispatch()
+
+
+# Shared scheduler for every yt-dlp call made by the bot
+extraction_scheduler = ExtractionScheduler()
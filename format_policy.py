@@ -0,0 +1,65 @@
+import os
+
+# Which source format to stream:
+#   'channel' - the smallest audio-only format that meets the voice channel's bitrate (default)
+#   'best'    - the highest-quality audio-only format
+#   <kbps>    - like 'channel', but with a fixed target bitrate
+FORMAT_POLICY = os.getenv('SONIX_FORMAT_POLICY', 'channel')
+# Target used while the guild has no voice connection yet (Discord's default channel bitrate)
+DEFAULT_CHANNEL_KBPS = int(os.getenv('SONIX_DEFAULT_CHANNEL_KBPS', '64'))
+# Discord voice channels range from 8 kbps to 384 kbps (boosted servers)
+MIN_KBPS = 8
+MAX_KBPS = 384
+
+
+def parse_policy(value):
+    """'channel', 'best' or a bitrate in kbps; raises ValueError otherwise."""
+    value = str(value).strip().lower().removesuffix('kbps').strip()
+    if value in ('channel', 'auto'):
+        return 'channel'
+    if value == 'best':
+        return 'best'
+    kbps = int(value)
+    if not MIN_KBPS <= kbps <= MAX_KBPS:
+        raise ValueError(f"bitrate must be between {MIN_KBPS} and {MAX_KBPS} kbps")
+    return kbps
+
+
+def target_kbps(policy, channel_bitrate=None):
+    """Bitrate a stream should meet under `policy`, or None for the best available."""
+    if policy == 'best':
+        return None
+    if policy == 'channel':
+        # VoiceChannel.bitrate is in bits per second
+        return channel_bitrate // 1000 if channel_bitrate else DEFAULT_CHANNEL_KBPS
+    return int(policy)
+
+
+def format_selector(kbps):
+    """
+    yt-dlp format string for a target bitrate: the smallest audio-only format
+    at or above it, opus first (it is passed through to Discord without a
+    transcode), else the best audio-only format below it. Muxed video
+    formats are never selected.
+    """
+    if kbps is None:
+        return 'bestaudio'
+    return f'worstaudio[acodec=opus][abr>={kbps}]/worstaudio[abr>={kbps}]/bestaudio'
+
+
+def pick_stream(streams, kbps, bitrate_of, is_opus):
+    """
+    The same choice as format_selector() for a list of audio-only streams
+    described by another API (e.g. Invidious adaptiveFormats). `bitrate_of`
+    returns a stream's bitrate in kbps.
+    """
+    if not streams:
+        return None
+    if kbps is None:
+        return max(streams, key=lambda s: (is_opus(s), bitrate_of(s)))
+    enough = [s for s in streams if bitrate_of(s) >= kbps]
+    if enough:
+        # Opus first, then the smallest that is still enough
+        return min(enough, key=lambda s: (not is_opus(s), bitrate_of(s)))
+    # Nothing meets the target: the closest below it
+    return max(streams, key=lambda s: (bitrate_of(s), is_opus(s)))
@@ -0,0 +1,254 @@
+import random
+from bisect import bisect_right
+from itertools import accumulate
+
+# Target entries per block of a BlockList. Positional inserts/removes touch one
+# block (O(BLOCK_SIZE)) plus the block index (O(n / BLOCK_SIZE)).
+BLOCK_SIZE = 256
+
+
+def track_key(song):
+    """
+    Identity used for duplicate detection: the video ID for Tracks, falling
+    back to the URL or query; plain query strings are their own key.
+    """
+    if song is None or isinstance(song, str):
+        return song
+    return song.id or song.webpage_url or song.query
+
+
+class BlockList:
+    """
+    List split into blocks of about BLOCK_SIZE entries, with a prefix index
+    over block lengths. Gives cheap popleft, positional insert/remove and
+    slicing on long queues, where a plain list shifts every entry.
+    """
+
+    def __init__(self, items=()):
+        self._build(list(items))
+
+    def _build(self, items):
+        self._blocks = [items[i:i + BLOCK_SIZE] for i in range(0, len(items), BLOCK_SIZE)]
+        self._reindex()
+
+    def _reindex(self):
+        # _starts[b] is the position of block b's first entry
+        self._starts = [0] + list(accumulate(len(block) for block in self._blocks))[:-1] if self._blocks else []
+        self._len = sum(len(block) for block in self._blocks)
+
+    def _locate(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+        b = bisect_right(self._starts, index) - 1
+        return b, index - self._starts[b]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            out = []
+            if start >= stop:
+                return out
+            b, i = self._locate(start)
+            while len(out) < stop - start and b < len(self._blocks):
+                block = self._blocks[b]
+                out.extend(block[i:i + (stop - start - len(out))])
+                b, i = b + 1, 0
+            return out
+        b, i = self._locate(index)
+        return self._blocks[b][i]
+
+    def append(self, item):
+        if not self._blocks or len(self._blocks[-1]) >= BLOCK_SIZE:
+            self._starts.append(self._len)
+            self._blocks.append([])
+        self._blocks[-1].append(item)
+        self._len += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def insert(self, index, item):
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            self.append(item)
+            return
+        b, i = self._locate(index)
+        block = self._blocks[b]
+        block.insert(i, item)
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[b:b + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+        self._reindex()
+
+    def pop(self, index=-1):
+        b, i = self._locate(index)
+        block = self._blocks[b]
+        item = block.pop(i)
+        if b == len(self._blocks) - 1:
+            # Last block: no later block start moves
+            self._len -= 1
+            if not block:
+                self._blocks.pop()
+                self._starts.pop()
+        else:
+            if not block:
+                del self._blocks[b]
+            self._reindex()
+        return item
+
+    def clear(self):
+        self._blocks = []
+        self._starts = []
+        self._len = 0
+
+    def replace(self, items):
+        self._build(list(items))
+
+
+class GuildQueue:
+    """
+    Per-guild song queue. Every mutation goes through a method here so it can be
+    recorded in the queue journal; reads behave like a list. Entries are kept in
+    a BlockList, and a count per track_key() makes duplicate checks O(1).
+    """
+
+    def __init__(self, guild_id, journal=None, items=None, listener=None):
+        self.guild_id = guild_id
+        self.journal = journal
+        # listener(guild_id, op, fields) is told about every mutation, e.g. api_bridge.queue_changed
+        self.listener = listener
+        self._items = BlockList(items or ())
+        self._keys = {}
+        # Bumped on every mutation so readers (e.g. the API bridge) can skip unchanged queues
+        self.version = 0
+        for song in self._items:
+            self._add_key(song)
+
+    def _record(self, op, **fields):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.record(op, self.guild_id, **fields)
+        if self.listener is not None:
+            self.listener(self.guild_id, op, fields)
+
+    def _add_key(self, song):
+        key = track_key(song)
+        self._keys[key] = self._keys.get(key, 0) + 1
+
+    def _drop_key(self, song):
+        key = track_key(song)
+        count = self._keys.get(key, 0) - 1
+        if count > 0:
+            self._keys[key] = count
+        else:
+            self._keys.pop(key, None)
+
+    def append(self, song):
+        self._items.append(song)
+        self._add_key(song)
+        self._record('append', track=song)
+
+    def extend(self, songs):
+        songs = list(songs)
+        if songs:
+            self._items.extend(songs)
+            for song in songs:
+                self._add_key(song)
+            self._record('extend', tracks=songs)
+
+    def insert(self, index, song):
+        self._items.insert(index, song)
+        self._add_key(song)
+        self._record('insert', index=index, track=song)
+
+    def pop(self, index=-1):
+        song = self._items.pop(index)
+        self._drop_key(song)
+        self._record('pop', index=index)
+        return song
+
+    def popleft(self):
+        return self.pop(0)
+
+    def clear(self):
+        if self._items:
+            self._items.clear()
+            self._keys.clear()
+            self._record('clear')
+
+    def remove_at(self, indexes):
+        """
+        Remove the entries at the given 0-based indexes (out-of-range ones are
+        ignored) as one journaled mutation. Returns the removed songs in queue order.
+        """
+        valid = sorted({i for i in indexes if 0 <= i < len(self._items)}, reverse=True)
+        if not valid:
+            return []
+        removed = []
+        for i in valid:
+            song = self._items.pop(i)
+            self._drop_key(song)
+            removed.append(song)
+        self._record('remove', indexes=valid)
+        removed.reverse()
+        return removed
+
+    def remove_keys(self, keys):
+        """Remove every entry whose track_key() is in `keys` (e.g. video IDs)."""
+        keys = {key for key in keys if key in self._keys}
+        if not keys:
+            return []
+        return self.remove_at([i for i, song in enumerate(self._items) if track_key(song) in keys])
+
+    def move(self, src, dst):
+        """Move the entry at index `src` so it ends up at index `dst`."""
+        if not (0 <= src < len(self._items) and 0 <= dst < len(self._items)):
+            raise IndexError('queue index out of range')
+        if src != dst:
+            self._items.insert(dst, self._items.pop(src))
+            self._record('move', index=src, to=dst)
+
+    def shuffle(self, rng=random):
+        if len(self._items) < 2:
+            return
+        order = list(range(len(self._items)))
+        rng.shuffle(order)
+        self._reorder(order)
+        self._record('shuffle', order=order)
+
+    def _reorder(self, order):
+        items = list(self._items)
+        self._items.replace(items[i] for i in order)
+
+    def has_track(self, song):
+        return track_key(song) in self._keys
+
+    def has_key(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return len(self._items) > 0
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __contains__(self, song):
+        return self.has_track(song)
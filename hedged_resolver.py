@@ -0,0 +1,147 @@
+import os
+import asyncio
+import functools
+from collections import deque
+
+# Hedge delay bounds; the delay itself is the primary backend's recent p95
+HEDGE_MIN_DELAY = float(os.getenv('SONIX_HEDGE_MIN_DELAY', '0.3'))
+HEDGE_MAX_DELAY = float(os.getenv('SONIX_HEDGE_MAX_DELAY', '5'))
+# Used until a backend has enough samples for a percentile
+HEDGE_DEFAULT_DELAY = float(os.getenv('SONIX_HEDGE_DEFAULT_DELAY', '1.5'))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class LatencyWindow:
+    """
+    The last LATENCY_WINDOW successful latencies of one backend, in seconds,
+    whether or not the attempt won its race.
+    """
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class HedgedResolver:
+    """
+    Races resolution backends. The backend with the lower median latency
+    starts first; if it has not produced a valid result by its own p95 (or
+    fails early), the next one starts in parallel. The first valid result
+    wins; an attempt that lost keeps running in the background so its
+    latency is recorded too, otherwise the percentiles (and the hedge delay
+    taken from them) would only ever see the faster of the two. Must be
+    used from the event loop.
+    """
+
+    def __init__(self):
+        self.latency = {}
+        self.counters = {}
+        self.requests = 0
+        self.hedged = 0
+
+    def _backend(self, name):
+        if name not in self.latency:
+            self.latency[name] = LatencyWindow()
+            self.counters[name] = {'started': 0, 'wins': 0, 'failures': 0, 'late': 0, 'cancelled': 0}
+        return self.counters[name]
+
+    def hedge_delay(self, name):
+        window = self.latency.get(name)
+        if window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, window.percentile(0.95)))
+
+    def _order(self, backends):
+        """Keep the given preference unless every backend has enough samples to compare medians."""
+        windows = [self.latency.get(name) for name, _ in backends]
+        if all(w is not None and len(w) >= HEDGE_MIN_SAMPLES for w in windows):
+            return sorted(backends, key=lambda b: self.latency[b[0]].percentile(0.5))
+        return list(backends)
+
+    async def resolve(self, backends, is_valid=bool):
+        """
+        `backends` is a list of (name, factory) in preference order, where
+        factory() returns a coroutine producing a result or None. Returns the
+        first result that passes `is_valid`, or None if every backend failed.
+        """
+        loop = asyncio.get_running_loop()
+        self.requests += 1
+        queue = deque(self._order(backends))
+        running = {}
+        won = False
+
+        def launch():
+            name, factory = queue.popleft()
+            self._backend(name)['started'] += 1
+            task = loop.create_task(factory())
+            running[task] = (name, loop.time())
+            return name
+
+        deadline = loop.time() + self.hedge_delay(launch())
+        try:
+            while running:
+                timeout = max(0.0, deadline - loop.time()) if queue else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name, started = running.pop(task)
+                    result = None if task.cancelled() or task.exception() else task.result()
+                    if is_valid(result):
+                        self.latency[name].add(loop.time() - started)
+                        self.counters[name]['wins'] += 1
+                        won = True
+                        return result
+                    self.counters[name]['failures'] += 1
+                # Hedge when the primary is past its deadline, or start the next one at once when all failed
+                if queue and (not running or loop.time() >= deadline):
+                    if running:
+                        self.hedged += 1
+                    deadline = loop.time() + self.hedge_delay(launch())
+            return None
+        finally:
+            for task, (name, started) in running.items():
+                if won:
+                    task.add_done_callback(functools.partial(self._finish_late, name, started, is_valid))
+                else:
+                    # The caller gave up (e.g. its guild's jobs were cancelled); nobody wants the result
+                    task.cancel()
+                    self.counters[name]['cancelled'] += 1
+
+    def _finish_late(self, name, started, is_valid, task):
+        """Record an attempt that lost its race once it finishes."""
+        result = None if task.cancelled() or task.exception() else task.result()
+        if is_valid(result):
+            self.latency[name].add(task.get_loop().time() - started)
+            self.counters[name]['late'] += 1
+        else:
+            self.counters[name]['failures'] += 1
+
+    def stats(self):
+        out = {'requests': self.requests, 'hedged': self.hedged, 'backends': {}}
+        for name, counters in self.counters.items():
+            window = self.latency[name]
+            p50, p95, p99 = (window.percentile(p) for p in (0.5, 0.95, 0.99))
+            out['backends'][name] = dict(
+                counters,
+                win_rate=round(counters['wins'] / self.requests, 3) if self.requests else 0.0,
+                p50_ms=None if p50 is None else round(p50 * 1000, 1),
+                p95_ms=None if p95 is None else round(p95 * 1000, 1),
+                p99_ms=None if p99 is None else round(p99 * 1000, 1),
+                hedge_delay_ms=round(self.hedge_delay(name) * 1000, 1),
+            )
+        return out
+
+
+# Shared by every !play / POST /play resolution
+hedged_resolver = HedgedResolver()
@@ -1,7 +1,183 @@
-import requests
+import os
 import re
+import time
+import logging
+import threading
+import requests
+
+from format_policy import pick_stream
 
 INVIDIOUS_URL = "http://localhost:3000"  # Change if your Invidious is on a different host/port
+# Comma-separated pool of instances; falls back to INVIDIOUS_URL
+INVIDIOUS_URLS = [u.strip().rstrip('/') for u in os.getenv('INVIDIOUS_URLS', INVIDIOUS_URL).split(',') if u.strip()]
+
+# Per-attempt timeout is a multiple of the instance's EWMA latency, clamped to this range
+INVIDIOUS_TIMEOUT_FACTOR = 4.0
+INVIDIOUS_MIN_TIMEOUT = float(os.getenv('INVIDIOUS_MIN_TIMEOUT', '0.5'))
+INVIDIOUS_MAX_TIMEOUT = float(os.getenv('INVIDIOUS_MAX_TIMEOUT', '10'))
+# Weight of the newest sample in the latency average
+INVIDIOUS_EWMA_ALPHA = 0.3
+# Circuit breaker: open after this many consecutive failures, for a cooldown that doubles up to the max
+INVIDIOUS_FAILURE_THRESHOLD = int(os.getenv('INVIDIOUS_FAILURE_THRESHOLD', '3'))
+INVIDIOUS_COOLDOWN = float(os.getenv('INVIDIOUS_COOLDOWN', '5'))
+INVIDIOUS_MAX_COOLDOWN = float(os.getenv('INVIDIOUS_MAX_COOLDOWN', '120'))
+INVIDIOUS_HEALTH_INTERVAL = float(os.getenv('INVIDIOUS_HEALTH_INTERVAL', '15'))
+
+logger = logging.getLogger("sonix_debug")
+
+
+class InvidiousUnavailable(Exception):
+    """No instance in the pool could answer."""
+
+
+class InvidiousInstance:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # EWMA seconds; None until the first sample
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = INVIDIOUS_COOLDOWN
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.successes = 0
+        self.failures = 0
+
+    def timeout(self):
+        if self.latency is None:
+            return INVIDIOUS_MAX_TIMEOUT
+        return min(INVIDIOUS_MAX_TIMEOUT, max(INVIDIOUS_MIN_TIMEOUT, self.latency * INVIDIOUS_TIMEOUT_FACTOR))
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'state': self.state,
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 1),
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+
+class InvidiousPool:
+    """
+    Routes Invidious API calls to the fastest healthy instance. Each instance
+    has an EWMA of its response time and a circuit breaker; a failed or slow
+    attempt moves straight on to the next instance with a timeout sized to
+    that instance's own latency, so one degraded instance costs little.
+    A background thread probes every instance, which is also how open
+    breakers get their half-open trial. Thread-safe.
+    """
+
+    def __init__(self, urls=None):
+        self.instances = [InvidiousInstance(url) for url in (urls or INVIDIOUS_URLS)]
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def _candidates(self):
+        """Instances worth trying now, fastest first; unmeasured ones after measured ones."""
+        now = time.monotonic()
+        with self._lock:
+            ready = [i for i in self.instances if i.state != i.OPEN or now >= i.open_until]
+        return sorted(ready, key=lambda i: (i.latency is None, i.latency or 0.0))
+
+    def _acquire(self, inst):
+        """May a request go to `inst` now? Half-open instances get one trial at a time."""
+        with self._lock:
+            if inst.state == inst.OPEN:
+                if time.monotonic() < inst.open_until:
+                    return False
+                inst.state = inst.HALF_OPEN
+                inst.trial_in_flight = False
+            if inst.state == inst.HALF_OPEN:
+                if inst.trial_in_flight:
+                    return False
+                inst.trial_in_flight = True
+            return True
+
+    def _record(self, inst, ok, elapsed):
+        with self._lock:
+            inst.trial_in_flight = False
+            if ok:
+                inst.successes += 1
+                inst.latency = elapsed if inst.latency is None else (
+                    INVIDIOUS_EWMA_ALPHA * elapsed + (1 - INVIDIOUS_EWMA_ALPHA) * inst.latency)
+                inst.consecutive_failures = 0
+                inst.cooldown = INVIDIOUS_COOLDOWN
+                inst.state = inst.CLOSED
+                return
+            inst.failures += 1
+            inst.consecutive_failures += 1
+            # A timeout is also a latency sample: push the average up so the instance ranks lower
+            inst.latency = elapsed if inst.latency is None else max(inst.latency, elapsed)
+            if inst.state == inst.HALF_OPEN or inst.consecutive_failures >= INVIDIOUS_FAILURE_THRESHOLD:
+                if inst.state != inst.OPEN:
+                    logger.warning(f"[Invidious] Circuit open for {inst.url} ({inst.consecutive_failures} failures)")
+                inst.state = inst.OPEN
+                inst.open_until = time.monotonic() + inst.cooldown
+                inst.cooldown = min(INVIDIOUS_MAX_COOLDOWN, inst.cooldown * 2)
+
+    def _attempt(self, inst, path, params=None, timeout=None):
+        start = time.monotonic()
+        try:
+            resp = self._session.get(f"{inst.url}{path}", params=params, timeout=timeout or inst.timeout())
+        except requests.RequestException as e:
+            self._record(inst, False, time.monotonic() - start)
+            logger.info(f"[Invidious] {inst.url} failed: {e}")
+            return None
+        # 4xx means the instance answered (e.g. unknown video); only 5xx counts against it
+        self._record(inst, resp.status_code < 500, time.monotonic() - start)
+        return resp
+
+    def get_json(self, path, params=None):
+        """
+        GET `path` from the best instance, failing over on errors. Returns the
+        decoded JSON, None for a definite miss (4xx), or raises
+        InvidiousUnavailable if no instance answered.
+        """
+        for inst in self._candidates():
+            if not self._acquire(inst):
+                continue
+            resp = self._attempt(inst, path, params)
+            if resp is None or resp.status_code >= 500:
+                continue
+            if resp.status_code != 200:
+                return None
+            try:
+                return resp.json()
+            except ValueError:
+                continue
+        raise InvidiousUnavailable("no healthy Invidious instance answered")
+
+    def check_health(self):
+        """Probe every instance once (open breakers only once their cooldown is over)."""
+        for inst in self.instances:
+            if not self._acquire(inst):
+                continue
+            self._attempt(inst, '/api/v1/stats', timeout=min(INVIDIOUS_MAX_TIMEOUT, inst.timeout() * 2))
+
+    def start_health_checks(self, interval=INVIDIOUS_HEALTH_INTERVAL):
+        if self._health_thread is not None:
+            return
+        def run():
+            while not self._stop.is_set():
+                self.check_health()
+                self._stop.wait(interval)
+        self._health_thread = threading.Thread(target=run, name='invidious-health', daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return [inst.stats() for inst in self.instances]
+
+
+# Shared pool used by the helpers below
+invidious_pool = InvidiousPool()
 
 
 def extract_video_id(url_or_id):
@@ -24,47 +200,51 @@ def extract_video_id(url_or_id):
     return None
 
 
-def get_invidious_audio_url(video_id):
+def get_invidious_audio_url(video_id, pool=None, kbps=None):
     """
-    Query Invidious for the best audio stream for a given video ID.
-    Returns (audio_url, title, thumbnail, original_url) or None if not found.
+    Query Invidious for an audio stream for a given video ID: the smallest one
+    meeting `kbps` (see format_policy), or the best one if kbps is None.
+    Returns a dict with id, audio_url, title, thumbnail, webpage_url, duration and codec, or None if not found.
     """
-    api_url = f"{INVIDIOUS_URL}/api/v1/videos/{video_id}"
     try:
-        resp = requests.get(api_url, timeout=10)
-        if resp.status_code != 200:
-            return None
-        data = resp.json()
-        audio_streams = [f for f in data.get('formatStreams', []) if f.get('mimeType', '').startswith('audio/')]
-        if not audio_streams:
-            return None
-        # Choose highest bitrate audio
-        best_audio = max(audio_streams, key=lambda f: f.get('bitrate', 0))
-        return {
-            'audio_url': best_audio['url'],
-            'title': data.get('title', video_id),
-            'thumbnail': data.get('videoThumbnails', [{}])[0].get('url', ''),
-            'webpage_url': f"https://youtube.com/watch?v={video_id}"
-        }
-    except Exception as e:
-        print(f"[Invidious] Error: {e}")
+        data = (pool or invidious_pool).get_json(f"/api/v1/videos/{video_id}")
+    except InvidiousUnavailable as e:
+        logger.info(f"[Invidious] Error: {e}")
         return None
+    if not data:
+        return None
+    # Audio-only streams are listed under adaptiveFormats with an audio/* type
+    audio_streams = [f for f in data.get('adaptiveFormats', []) if f.get('type', '').startswith('audio/') and f.get('url')]
+    if not audio_streams:
+        return None
+    # Opus is preferred because it can be passed through to Discord; bitrate is in bits per second
+    best_audio = pick_stream(
+        audio_streams, kbps,
+        bitrate_of=lambda f: int(f.get('bitrate') or 0) // 1000,
+        is_opus=lambda f: 'opus' in f.get('type', ''),
+    )
+    thumbnails = data.get('videoThumbnails') or [{}]
+    return {
+        'id': video_id,
+        'audio_url': best_audio['url'],
+        'title': data.get('title', video_id),
+        'thumbnail': thumbnails[0].get('url', ''),
+        'webpage_url': f"https://youtube.com/watch?v={video_id}",
+        'duration': data.get('lengthSeconds'),
+        'codec': 'opus' if 'opus' in best_audio.get('type', '') else None,
+    }
 
 
-def invidious_search(query):
+def invidious_search(query, pool=None):
     """
     Search Invidious for a video matching the query. Returns first video ID or None.
     """
-    api_url = f"{INVIDIOUS_URL}/api/v1/search?q={requests.utils.quote(query)}&type=video"
     try:
-        resp = requests.get(api_url, timeout=10)
-        if resp.status_code != 200:
-            return None
-        results = resp.json()
-        for item in results:
-            if item.get('videoId'):
-                return item['videoId']
-        return None
-    except Exception as e:
-        print(f"[Invidious] Search error: {e}")
+        results = (pool or invidious_pool).get_json("/api/v1/search", params={'q': query, 'type': 'video'})
+    except InvidiousUnavailable as e:
+        logger.info(f"[Invidious] Search error: {e}")
         return None
+    for item in results or []:
+        if item.get('videoId'):
+            return item['videoId']
+    return None
@@ -1,19 +1,54 @@
 import os
 import json
 
-guild_keys_path = os.path.join(os.path.dirname(__file__), 'guild_keys.json')
+# SONIX_GUILD_KEYS points every process (bot and API workers) at another keys file
+guild_keys_path = os.getenv('SONIX_GUILD_KEYS', os.path.join(os.path.dirname(__file__), 'guild_keys.json'))
 
-if os.path.exists(guild_keys_path):
-    with open(guild_keys_path, 'r') as f:
-        guild_keys = json.load(f)
-else:
-    guild_keys = {}
+# Shared with main.py, which issues keys; mutated in place so imported references stay current
+guild_keys = {}
+_loaded_mtime = None
+
+def _reload_if_changed():
+    """
+    Re-read the keys file when its mtime moved. The bot writes new keys to
+    it, and API worker processes only see them this way; a stat per lookup
+    is far cheaper than the request it guards.
+    """
+    global _loaded_mtime
+    try:
+        mtime = os.stat(guild_keys_path).st_mtime_ns
+    except OSError:
+        return
+    if mtime == _loaded_mtime:
+        return
+    try:
+        with open(guild_keys_path, 'r') as f:
+            keys = json.load(f)
+    except (OSError, ValueError):
+        # Caught mid-write by another process; the next lookup tries again
+        return
+    guild_keys.clear()
+    guild_keys.update(keys)
+    _loaded_mtime = mtime
+
+def save_guild_keys():
+    global _loaded_mtime
+    tmp_path = guild_keys_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(guild_keys, f)
+    # Replaced in one step so a worker never reads a half-written file
+    os.replace(tmp_path, guild_keys_path)
+    _loaded_mtime = os.stat(guild_keys_path).st_mtime_ns
 
 def get_guild_key(guild_id):
+    _reload_if_changed()
     return guild_keys.get(str(guild_id))
 
 def get_guild_id_from_key(server_key):
+    _reload_if_changed()
     for guild_id, key in guild_keys.items():
         if key == server_key:
             return guild_id
     return None
+
+_reload_if_changed()
@@ -0,0 +1,385 @@
+import os
+import re
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+
+import discord
+from discord.oggparse import OggStream, OggError
+
+from track import Track
+
+# Directory of audio files to serve locally; the library is off when unset
+LIBRARY_DIR = os.getenv('SONIX_LIBRARY_DIR')
+LIBRARY_INDEX = os.getenv('SONIX_LIBRARY_INDEX', os.path.join('sonix_state', 'library.json'))
+AUDIO_EXTENSIONS = ('.opus', '.ogg', '.oga', '.mp3', '.m4a', '.flac', '.wav', '.webm')
+# Prefix for `!play local: <query>`, which always plays the best library match
+LOCAL_PREFIX = 'local:'
+INDEX_VERSION = 1
+
+# Ogg page header: capture pattern, version, flags, granule position, serial, page number, CRC, segment count
+_PAGE = struct.Struct('<4sBBqIIIB')
+_CONTINUED = 0x01
+OPUS_RATE = 48000
+# Samples in one 20 ms packet of a direct-playable file
+FRAME_SAMPLES = OPUS_RATE // 50
+
+logger = logging.getLogger("sonix_playback")
+
+
+def normalize(text):
+    return ' '.join(re.sub(r'[^\w]+', ' ', str(text).lower()).split())
+
+
+def _trigrams(word, pad_end=True):
+    # Words are padded in front so a query word also matches as a prefix
+    padded = f" {word} " if pad_end else f" {word}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _pages(mm, offset=0):
+    """(offset, flags, granule, next offset) for each Ogg page, reading only the headers."""
+    size = len(mm)
+    while offset + _PAGE.size <= size:
+        magic, _, flags, granule, _, _, _, segments = _PAGE.unpack_from(mm, offset)
+        if magic != b'OggS':
+            offset = mm.find(b'OggS', offset + 1)
+            if offset < 0:
+                return
+            continue
+        body = offset + _PAGE.size + segments
+        end = body + sum(mm[offset + _PAGE.size:body])
+        yield offset, flags, granule, end
+        offset = end
+
+
+def _frame_ms(toc):
+    """Duration of one Opus frame from a packet's TOC byte (RFC 6716, 3.1)."""
+    config = toc >> 3
+    if config < 12:
+        return (10, 20, 40, 60)[config % 4]
+    if config < 16:
+        return (10, 20)[config % 2]
+    return (2.5, 5, 10, 20)[config % 4]
+
+
+def probe_opus(path):
+    """
+    Read an Ogg Opus file's header, tags and duration without decoding.
+    Returns None if it is not Ogg Opus. `direct` is True when every probed
+    packet is a single 20 ms frame, which is what Discord's player sends
+    once per tick, so the packets can go out untouched.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:4] != b'OggS':
+            return None
+        packets = OggStream(mm).iter_packets()
+        try:
+            head = next(packets)
+            if not head.startswith(b'OpusHead'):
+                return None
+            tags = next(packets)
+            audio = [next(packets) for _ in range(8)]
+        except (StopIteration, OggError):
+            return None
+        pre_skip = struct.unpack_from('<H', head, 10)[0]
+        comments = {}
+        if tags.startswith(b'OpusTags'):
+            vendor_len = struct.unpack_from('<I', tags, 8)[0]
+            pos = 12 + vendor_len
+            count = struct.unpack_from('<I', tags, pos)[0]
+            pos += 4
+            for _ in range(count):
+                length = struct.unpack_from('<I', tags, pos)[0]
+                key, _, value = tags[pos + 4:pos + 4 + length].decode('utf-8', 'replace').partition('=')
+                comments.setdefault(key.upper(), value)
+                pos += 4 + length
+        last = mm.rfind(b'OggS')
+        granule = _PAGE.unpack_from(mm, last)[3] if last >= 0 and last + _PAGE.size <= len(mm) else 0
+        return {
+            'title': comments.get('TITLE'),
+            'artist': comments.get('ARTIST'),
+            'duration': max(0, granule - pre_skip) // OPUS_RATE or None,
+            'pre_skip': pre_skip,
+            'direct': all(p and (p[0] & 0x03) == 0 and _frame_ms(p[0]) == 20 for p in audio),
+        }
+
+
+def names_from_path(root, path):
+    """'Artist - Title.ext' or 'Artist/Title.ext' -> (artist, title)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if ' - ' in stem:
+        artist, title = stem.split(' - ', 1)
+        return artist.strip(), title.strip()
+    parent = os.path.relpath(os.path.dirname(path), root)
+    return ('' if parent == '.' else os.path.basename(parent)), stem.strip()
+
+
+class LibrarySource(discord.AudioSource):
+    """
+    Opus packets straight out of a memory-mapped Ogg Opus file: no ffmpeg,
+    no decode, no network. `start` seeks by granule position using only the
+    page headers.
+    """
+
+    def __init__(self, path, start=0.0, pre_skip=0):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        target = int(start * OPUS_RATE) + pre_skip if start else 0
+        offset, continued, reached = self._start_offset(target)
+        self._mm.seek(offset)
+        self._packets = OggStream(self._mm).iter_packets()
+        if continued:
+            # The tail of a packet that began on the previous page
+            next(self._packets, None)
+        # Pages hold about a second; step through the rest in 20 ms packets
+        for _ in range(max(0, (target - reached) // FRAME_SAMPLES) if target else 0):
+            next(self._packets, None)
+
+    def _start_offset(self, target):
+        """
+        Offset of the first audio page, or of the page after the last one
+        ending at or before `target`, with whether it starts mid-packet and
+        the granule position reached by then.
+        """
+        start, continued, reached = None, False, 0
+        for page, flags, granule, end in _pages(self._mm):
+            if page == start:
+                continued = bool(flags & _CONTINUED)
+            # Header pages have granule 0; -1 means no packet ends on the page
+            if granule <= 0:
+                continue
+            if start is None:
+                start, continued = page, bool(flags & _CONTINUED)
+            if not target or granule > target:
+                break
+            start, reached = end, granule
+        return start or 0, continued, reached
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        try:
+            return next(self._packets, b'')
+        except (OggError, ValueError):
+            # Truncated file, or closed by cleanup() while the player was reading
+            return b''
+
+    def cleanup(self):
+        if not self._mm.closed:
+            self._mm.close()
+            self._file.close()
+
+
+class LocalLibrary:
+    """
+    Index of a directory of audio files: metadata per file plus a trigram
+    index over "artist title", persisted to LIBRARY_INDEX and refreshed
+    incrementally (files whose size and mtime are unchanged are not probed
+    again). Lookups are set intersections in memory.
+    """
+
+    def __init__(self, root=LIBRARY_DIR, index_path=LIBRARY_INDEX):
+        self.root = root
+        self.index_path = index_path
+        self.entries = {}  # id -> entry dict
+        self._trigrams = {}  # trigram -> set of ids
+        self._words = {}  # id -> normalized words of "artist title"
+        self._lock = threading.Lock()
+        self.scanned_at = None
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    # --- index ---
+
+    def load(self):
+        if not self.enabled or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Library] Could not read {self.index_path}: {e}")
+            return False
+        if data.get('version') != INDEX_VERSION or data.get('root') != os.path.abspath(self.root):
+            return False
+        entries = data.get('entries', {})
+        trigrams = {gram: set(ids) for gram, ids in data.get('trigrams', {}).items()}
+        words = {entry_id: normalize(f"{e.get('artist', '')} {e['title']}").split() for entry_id, e in entries.items()}
+        with self._lock:
+            self.entries, self._trigrams, self._words = entries, trigrams, words
+        logger.info(f"[Library] Loaded {len(entries)} tracks from {self.index_path}")
+        return True
+
+    def _probe(self, path, rel, stat):
+        artist, title = names_from_path(self.root, path)
+        entry = {'path': rel, 'size': stat.st_size, 'mtime': stat.st_mtime, 'artist': artist, 'title': title,
+                 'duration': None, 'direct': False, 'pre_skip': 0}
+        if path.lower().endswith(('.opus', '.ogg', '.oga')):
+            try:
+                info = probe_opus(path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"[Library] Could not read {path}: {e}")
+                info = None
+            if info:
+                entry.update(
+                    artist=info['artist'] or artist, title=info['title'] or title,
+                    duration=info['duration'], direct=info['direct'], pre_skip=info['pre_skip'],
+                )
+        return entry
+
+    def scan(self):
+        """Walk the library directory and rewrite the index. Blocking; run it off the event loop."""
+        if not self.enabled:
+            return 0
+        started = time.perf_counter()
+        root = os.path.abspath(self.root)
+        known = {e['path']: (entry_id, e) for entry_id, e in self.entries.items()}
+        entries = {}
+        probed = 0
+        for directory, _, files in os.walk(root):
+            for name in files:
+                if not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                rel = os.path.relpath(path, root)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry_id, entry = known.get(rel, (None, None))
+                if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                    entry_id = hashlib.sha1(rel.encode('utf-8')).hexdigest()[:12]
+                    entry = self._probe(path, rel, stat)
+                    probed += 1
+                entries[entry_id] = entry
+        trigrams, words = {}, {}
+        for entry_id, entry in entries.items():
+            words[entry_id] = normalize(f"{entry['artist']} {entry['title']}").split()
+            for word in words[entry_id]:
+                for gram in _trigrams(word):
+                    trigrams.setdefault(gram, set()).add(entry_id)
+        with self._lock:
+            self.entries, self._trigrams, self._words = entries, trigrams, words
+        self.scanned_at = time.time()
+        self._save(root)
+        logger.info(f"[Library] Indexed {len(entries)} tracks ({probed} probed) in {time.perf_counter() - started:.2f}s")
+        return len(entries)
+
+    def _save(self, root):
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        data = {
+            'version': INDEX_VERSION,
+            'root': root,
+            'entries': self.entries,
+            'trigrams': {gram: sorted(ids) for gram, ids in self._trigrams.items()},
+        }
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_path)
+
+    # --- lookup ---
+
+    def search(self, query, limit=5):
+        """
+        Entries whose words start with every query word, closest first (fewest
+        words the query did not cover). Returns [(entry_id, entry, uncovered)].
+        """
+        query_words = normalize(query).split()
+        if not query_words or not self.entries:
+            return []
+        with self._lock:
+            entries, trigrams, words = self.entries, self._trigrams, self._words
+        postings = []
+        for i, word in enumerate(query_words):
+            # The last word may still be being typed, so it only needs to be a prefix
+            for gram in _trigrams(word, pad_end=i < len(query_words) - 1):
+                postings.append(trigrams.get(gram, set()))
+        if postings:
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            # Only one- or two-letter words: check every entry
+            candidates = entries.keys()
+        results = []
+        for entry_id in candidates:
+            entry_words = words[entry_id]
+            covered = set()
+            for word in query_words:
+                hit = next((i for i, w in enumerate(entry_words) if i not in covered and w.startswith(word)), None)
+                if hit is None:
+                    break
+                covered.add(hit)
+            else:
+                results.append((len(entry_words) - len(covered), entry_id))
+        results.sort()
+        return [(entry_id, entries[entry_id], uncovered) for uncovered, entry_id in results[:limit]]
+
+    def match(self, query):
+        """
+        The library track `query` names, or None. Without the `local:` prefix
+        the query must cover the whole title, so a search for a song that is
+        not in the library is not answered with a different one that is.
+        """
+        forced = query.lower().startswith(LOCAL_PREFIX)
+        if forced:
+            query = query[len(LOCAL_PREFIX):]
+        for entry_id, entry, uncovered in self.search(query, limit=10):
+            if forced:
+                return self.track(entry_id, entry, query)
+            query_words = normalize(query).split()
+            if all(any(word.startswith(q) for q in query_words) for word in normalize(entry['title']).split()):
+                return self.track(entry_id, entry, query)
+        return None
+
+    def path(self, entry):
+        return os.path.join(os.path.abspath(self.root), entry['path'])
+
+    def entry(self, song):
+        return self.entries.get(str(song.id)[len('library:'):]) if is_library_track(song) else None
+
+    def track(self, entry_id, entry, query=None):
+        title = f"{entry['artist']} - {entry['title']}" if entry['artist'] else entry['title']
+        return Track(
+            id=f"library:{entry_id}",
+            title=title,
+            duration=entry['duration'],
+            stream_url=self.path(entry),
+            codec='opus' if entry['direct'] else None,
+            query=query,
+        )
+
+    def fill_stream(self, song):
+        """Point a restored library Track at its file again. False if it left the library."""
+        entry = self.entry(song)
+        if entry is None or not os.path.exists(self.path(entry)):
+            return False
+        song.stream_url = self.path(entry)
+        song.stream_expires = None
+        song.codec = 'opus' if entry['direct'] else None
+        return True
+
+    def open(self, song, start=0.0):
+        """A LibrarySource for a direct-playable library Track."""
+        entry = self.entry(song)
+        return LibrarySource(song.stream_url, start, entry['pre_skip'] if entry else 0)
+
+    def is_direct(self, song):
+        entry = self.entry(song)
+        return bool(entry and entry['direct'])
+
+
+def is_library_track(song):
+    return isinstance(song, Track) and str(song.id or '').startswith('library:')
+
+
+# One index per bot process
+library = LocalLibrary()
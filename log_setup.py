@@ -0,0 +1,134 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOG_LEVEL = os.getenv('SONIX_LOG_LEVEL', 'INFO')
+# Per-module overrides, e.g. "sonix_playback=DEBUG,discord=WARNING,uvicorn.access=WARNING"
+LOG_LEVELS = os.getenv('SONIX_LOG_LEVELS', 'discord=WARNING,uvicorn.access=WARNING')
+# Per call site: at most this many INFO/DEBUG records per second (bursts allowed)
+LOG_SAMPLE_RATE = float(os.getenv('SONIX_LOG_SAMPLE_RATE', '5'))
+LOG_SAMPLE_BURST = int(os.getenv('SONIX_LOG_SAMPLE_BURST', '20'))
+
+REDACTED = '[REDACTED]'
+_SECRET_PATTERNS = [
+    # key=value / key: value for anything that looks like a credential (guild keys, tokens, URL signatures)
+    re.compile(r'(?i)\b([\w-]*(?:key|token|secret|password|sig|signature))(["\']?\s*[:=]\s*["\']?)([^\s,"\'&}]+)'),
+    # Discord bot tokens
+    re.compile(r'[MNO][A-Za-z\d_-]{23,27}\.[\w-]{6}\.[\w-]{27,}'),
+]
+
+
+def redact(text):
+    for pattern in _SECRET_PATTERNS:
+        if pattern.groups:
+            text = pattern.sub(lambda m: f"{m.group(1)}{m.group(2)}{REDACTED}", text)
+        else:
+            text = pattern.sub(REDACTED, text)
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with secrets redacted. Runs on the listener thread."""
+
+    _STANDARD = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._STANDARD and not key.startswith('_'):
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else redact(str(value))
+        if record.exc_info:
+            entry['exc'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Token bucket per call site for INFO and below, so per-frame or per-request
+    logs cannot flood the queue. WARNING and above always pass. The number of
+    dropped records is attached to the next record that passes as `sampled_out`.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE, burst=LOG_SAMPLE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        site = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._sites.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._sites[site] = (tokens, now, dropped + 1)
+                return False
+            self._sites[site] = (tokens - 1, now, 0)
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Defer message formatting and traceback rendering to the listener thread;
+        # the caller (event loop, voice thread) only pays for a queue put.
+        return record
+
+
+_listener = None
+
+# uvicorn --log-config for API worker processes: installs no handlers of uvicorn's own,
+# so its loggers propagate to the root handler setup_logging() installs in each worker
+# (the CLI counterpart of uvicorn.run(log_config=None))
+UVICORN_LOG_CONFIG = {'version': 1, 'disable_existing_loggers': False}
+
+
+def write_uvicorn_log_config(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(UVICORN_LOG_CONFIG, f)
+    return path
+
+
+def setup_logging(stream=None):
+    """
+    Route all logging through a QueueHandler; a QueueListener thread does the
+    JSON formatting, redaction and I/O. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    handler = _EnqueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(','))):
+        name, _, level = item.partition('=')
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from hedged_resolver import LatencyWindow
+
+# How often the heartbeat task expects to run; its lateness is the loop lag
+LAG_INTERVAL = float(os.getenv('SONIX_LAG_INTERVAL', '0.05'))
+# A callback holding the loop longer than this is a stall: its stack is captured and its call site counted
+LAG_THRESHOLD_MS = float(os.getenv('SONIX_LAG_THRESHOLD_MS', '100'))
+# Log the slowest call sites this often (0 = only on request through the API)
+LAG_REPORT_SECONDS = float(os.getenv('SONIX_LAG_REPORT_SECONDS', '0'))
+# About five minutes of heartbeats at the default interval
+LAG_WINDOW = 6000
+STACK_DEPTH = 12
+MAX_SITES = 50
+REPORT_SITES = 5
+
+logger = logging.getLogger("sonix_debug")
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class _Site:
+    __slots__ = ('stalls', 'total_ms', 'max_ms', 'stack')
+
+    def __init__(self, stack):
+        self.stalls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.stack = stack
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and names what causes it. A heartbeat task
+    sleeps LAG_INTERVAL at a time and records how late it wakes up; a
+    daemon thread watches the heartbeat, and once it is LAG_THRESHOLD_MS
+    overdue it captures the loop thread's stack. That stack shows the
+    callback still holding the loop, so blocking calls are attributed to
+    their innermost frame in this code base (e.g. a synchronous JSON write
+    in a command) rather than to asyncio internals.
+
+    start() must be called from the loop to watch; stats() is safe from
+    any thread.
+    """
+
+    def __init__(self, interval=LAG_INTERVAL, threshold_ms=LAG_THRESHOLD_MS, report_seconds=LAG_REPORT_SECONDS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.report_seconds = report_seconds
+        self.lag = LatencyWindow(LAG_WINDOW)
+        self.sites = {}
+        self.stalls = 0
+        self.stalled_ms = 0.0
+        self._lock = threading.Lock()
+        self._beat = None
+        self._captured = None  # (beat, site, stack) of the stall in progress
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Watch the running loop. Calling it again (e.g. from a second on_ready) is a no-op."""
+        if self._task is not None and not self._task.done():
+            return
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='sonix-loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"[Watchdog] Watching the event loop every {self.interval * 1000:.0f} ms, stalls from {self.threshold * 1000:.0f} ms")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # --- loop side ---
+
+    async def _heartbeat(self):
+        reported_at = time.monotonic()
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._beat - self.interval)
+            self.lag.add(lag)
+            with self._lock:
+                captured, self._captured = self._captured, None
+            if captured is not None:
+                self._record(captured[1], captured[2], lag * 1000)
+            if self.report_seconds and now - reported_at >= self.report_seconds:
+                reported_at = now
+                self.report()
+
+    def _record(self, site, stack, ms):
+        with self._lock:
+            self.stalls += 1
+            self.stalled_ms += ms
+            entry = self.sites.get(site)
+            if entry is None:
+                if len(self.sites) >= MAX_SITES:
+                    # Make room by forgetting the site that has cost the least so far
+                    del self.sites[min(self.sites, key=lambda s: self.sites[s].total_ms)]
+                entry = self.sites[site] = _Site(stack)
+            entry.stalls += 1
+            entry.total_ms += ms
+            if ms >= entry.max_ms:
+                entry.max_ms = ms
+                entry.stack = stack
+        # INFO is sampled per call site by log_setup, so a loop that stays slow cannot flood the log
+        logger.info(f"[Watchdog] Event loop blocked for {ms:.0f} ms in {site}")
+
+    # --- watchdog thread ---
+
+    def _watch(self):
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(poll):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None and self._captured[0] == beat:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            site, stack = self._describe(frame)
+            with self._lock:
+                # The heartbeat may have run in the meantime; then this stall is already over
+                if self._beat == beat:
+                    self._captured = (beat, site, stack)
+
+    @staticmethod
+    def _describe(frame):
+        summary = traceback.extract_stack(frame, limit=None)[-STACK_DEPTH:]
+        stack = [f"{os.path.relpath(f.filename, _HERE) if f.filename.startswith(_HERE) else f.filename}:{f.lineno} {f.name}" for f in summary]
+        # The innermost frame of our own code is the call site to fix; library frames below it are how it blocks
+        for f, line in zip(reversed(summary), reversed(stack)):
+            if f.filename.startswith(_HERE) and not f.filename.endswith('loop_watchdog.py'):
+                return line, stack
+        return stack[-1], stack
+
+    # --- reporting ---
+
+    def slowest(self, limit=REPORT_SITES):
+        with self._lock:
+            ranked = sorted(self.sites.items(), key=lambda item: item[1].total_ms, reverse=True)[:limit]
+            return [
+                {
+                    'site': site,
+                    'stalls': entry.stalls,
+                    'total_ms': round(entry.total_ms, 1),
+                    'max_ms': round(entry.max_ms, 1),
+                    'stack': list(entry.stack),
+                }
+                for site, entry in ranked
+            ]
+
+    def report(self):
+        sites = self.slowest()
+        if not sites:
+            return
+        lines = [f"{s['site']}: {s['stalls']} stalls, {s['total_ms']:.0f} ms total, {s['max_ms']:.0f} ms max" for s in sites]
+        logger.warning("[Watchdog] Slowest event loop call sites:\n  " + "\n  ".join(lines))
+
+    def stats(self, sites=REPORT_SITES):
+        p50, p90, p99, top = (self.lag.percentile(p) for p in (0.5, 0.9, 0.99, 1.0))
+        return {
+            'interval_ms': round(self.interval * 1000, 1),
+            'threshold_ms': round(self.threshold * 1000, 1),
+            'samples': len(self.lag),
+            'p50_ms': None if p50 is None else round(p50 * 1000, 1),
+            'p90_ms': None if p90 is None else round(p90 * 1000, 1),
+            'p99_ms': None if p99 is None else round(p99 * 1000, 1),
+            'max_ms': None if top is None else round(top * 1000, 1),
+            'stalls': self.stalls,
+            'stalled_ms': round(self.stalled_ms, 1),
+            'slowest': self.slowest(sites),
+        }
+
+
+# Watches the bot's event loop; started from on_ready
+loop_watchdog = LoopWatchdog()
@@ -1,12 +1,32 @@
 import discord
 from discord.ext import commands
 import os
+from guild_queue import GuildQueue, track_key
+from log_setup import setup_logging, write_uvicorn_log_config
+from queue_journal import QueueJournal, restore_track
+from track import Track
+from audio_mixer import MixingSource, PositionedSource
+from voice_sessions import voice_sessions
+from timer_wheel import timer_wheel
+from hedged_resolver import hedged_resolver
+import api_bridge
+from api_bridge import CommandError
+from playlist_ingest import playlist_ingests, is_playlist_url
+from format_policy import FORMAT_POLICY, parse_policy, target_kbps, format_selector
+from local_library import library, is_library_track
+from audio_cache import audio_cache, AUDIO_CACHE_DOWNLOADS
+from loop_watchdog import loop_watchdog
+from outbox import outbox
+from soundcloud_search import soundcloud, SoundCloudUnavailable, is_soundcloud_url, is_soundcloud_set, search_query as soundcloud_search_query
+from tracing import start_trace, span, bind as bind_trace, trace_first_read, instrument_discord_http, last_trace, TRACE_FILE
+from audio_gain import NumpyVolumeTransformer, analyze_track_gain, ffmpeg_gain_options, volume_factor, MAX_VOLUME, GAIN_ANALYSIS_WORKERS
 import re
 import logging
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import json
 import secrets
+import time
 
 SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID')
 SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET')
@@ -19,18 +39,11 @@ intents = discord.Intents.default()
 intents.message_content = True
 
 bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+# Discord REST calls made while a request is traced show up as spans
+instrument_discord_http(bot.http)
 
-# Persistent per-server keys
-guild_keys_path = 'guild_keys.json'
-if os.path.exists(guild_keys_path):
-    with open(guild_keys_path, 'r') as f:
-        guild_keys = json.load(f)
-else:
-    guild_keys = {}
-
-def save_guild_keys():
-    with open(guild_keys_path, 'w') as f:
-        json.dump(guild_keys, f)
+# Persistent per-server keys, in the same file the API checks them against (see key_utils)
+from key_utils import guild_keys, save_guild_keys
 
 # Ensure every guild has a key
 def ensure_guild_key(guild_id):
@@ -43,6 +56,28 @@ def ensure_guild_key(guild_id):
 @bot.event
 async def on_guild_join(guild):
     ensure_guild_key(guild.id)
+    api_bridge.mark_changed(guild.id)
+
+# Channel lists and names are part of the API's guild info
+@bot.event
+async def on_guild_channel_create(channel):
+    api_bridge.mark_changed(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    api_bridge.mark_changed(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    api_bridge.mark_changed(after.guild.id)
+
+@bot.event
+async def on_guild_update(before, after):
+    api_bridge.mark_changed(after.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    api_bridge.mark_changed(guild.id)
 
 @bot.command()
 async def getkey(ctx):
@@ -54,13 +89,115 @@ async def getkey(ctx):
     except discord.Forbidden:
         await ctx.reply(f"Your server's control key is: `{key}`\nGuild ID: `{guild_id}`\n(Enable DMs to receive this privately)", mention_author=False)
 
-# Song queue per guild (list of dicts with metadata)
-song_queues = {}  # {guild_id: [song_dict, ...]}
+# Song queue per guild (GuildQueue of Track records)
+song_queues = {}  # {guild_id: GuildQueue[Track, ...]}
 # Track now playing and last played per guild
-now_playing = {}  # {guild_id: song_dict}
-last_played = {}  # {guild_id: song_dict}
+now_playing = {}  # {guild_id: Track}
+last_played = {}  # {guild_id: Track}
+# Queue mutations are journaled so queues survive a restart (see restore_queue_state)
+queue_journal = QueueJournal()
 # Elevator music enabled per guild
 elevator_enabled = {}
+# Playback volume (percent) and loudness normalization per guild
+guild_volume = {}
+normalize_enabled = {}
+NORMALIZE_DEFAULT = os.getenv('SONIX_NORMALIZE', '1') == '1'
+ELEVATOR_VOLUME = 0.05
+# Track transitions per guild: None = off, 0 = gapless, > 0 = crossfade seconds
+transition_mode = {}
+MAX_CROSSFADE_SECONDS = 12
+# Mixer currently on each guild's player (only while gapless/crossfade is on)
+active_mixers = {}
+# Last music source started per guild (mixer or PositionedSource); its position outlives a dropped connection
+playing_sources = {}
+# guild_id -> (Track, seconds): where the song interrupted by a voice drop picks up after the rejoin
+resume_positions = {}
+
+def parse_transition(value):
+    value = str(value).lower()
+    if value in ("off", "none", ""):
+        return None
+    if value == "gapless":
+        return 0.0
+    seconds = float(value)
+    if not 0 <= seconds <= MAX_CROSSFADE_SECONDS:
+        raise ValueError(f"crossfade must be between 0 and {MAX_CROSSFADE_SECONDS} seconds")
+    return seconds
+
+TRANSITION_DEFAULT = parse_transition(os.getenv('SONIX_TRANSITION', 'off'))
+# Source format policy per guild ('channel', 'best' or kbps); see format_policy.py
+format_policies = {}
+FORMAT_POLICY_DEFAULT = parse_policy(FORMAT_POLICY)
+
+def set_now_playing(guild_id, song, rotate=False):
+    # Optionally move the current song to last_played first
+    if rotate and now_playing.get(guild_id) is not song:
+        last_played[guild_id] = now_playing.get(guild_id)
+    now_playing[guild_id] = song
+    queue_journal.record_now(guild_id, song, last_played.get(guild_id))
+    api_bridge.mark_changed(guild_id)
+
+def get_guild_volume(guild_id):
+    return guild_volume.get(guild_id, 100)
+
+def is_normalize_enabled(guild_id):
+    return normalize_enabled.get(guild_id, NORMALIZE_DEFAULT)
+
+def track_gain_factor(guild_id, song):
+    # Normalization only; the mixer applies the guild volume itself so it can change live
+    gain_db = song.gain_db if (song.gain_db is not None and is_normalize_enabled(guild_id)) else 0.0
+    return volume_factor(100, gain_db)
+
+def playback_volume_factor(guild_id, song):
+    return get_guild_volume(guild_id) / 100 * track_gain_factor(guild_id, song)
+
+def set_guild_volume(guild, volume=None, normalize=None):
+    """
+    Update a guild's volume/normalization. PCM sources (elevator music and the
+    gapless/crossfade mixer) change immediately; ffmpeg-side gain on regular
+    tracks applies from the next track. Returns True if it applied live.
+    """
+    if volume is not None:
+        guild_volume[guild.id] = max(0, min(MAX_VOLUME, int(volume)))
+    if normalize is not None:
+        normalize_enabled[guild.id] = bool(normalize)
+    api_bridge.mark_changed(guild.id)
+    voice = guild.voice_client
+    if voice and isinstance(voice.source, NumpyVolumeTransformer):
+        voice.source.volume = ELEVATOR_VOLUME * get_guild_volume(guild.id) / 100
+        return True
+    mixer = active_mixers.get(guild.id)
+    if voice and mixer is not None and voice.source is mixer:
+        mixer.volume = get_guild_volume(guild.id) / 100
+        return True
+    return False
+
+def get_transition(guild_id):
+    return transition_mode.get(guild_id, TRANSITION_DEFAULT)
+
+def set_transition(guild_id, transition):
+    transition_mode[guild_id] = transition
+    mixer = active_mixers.get(guild_id)
+    if mixer is not None:
+        if transition is None:
+            # Let the mixer finish the current track, then fall back to per-track playback
+            mixer.on_need_next = None
+        else:
+            mixer.crossfade_frames = int(transition * 50)
+
+def get_format_policy(guild_id):
+    return format_policies.get(guild_id, FORMAT_POLICY_DEFAULT)
+
+def stream_kbps(guild_id):
+    """Bitrate the guild's streams should meet, from its policy and current voice channel; None = best."""
+    guild = bot.get_guild(guild_id) if guild_id else None
+    voice = guild.voice_client if guild else None
+    channel = voice.channel if voice else None
+    return target_kbps(get_format_policy(guild_id), getattr(channel, 'bitrate', None))
+
+def stream_format(guild_id):
+    """yt-dlp format selector for the guild's streams."""
+    return format_selector(stream_kbps(guild_id))
 
 def is_elevator_enabled(ctx):
     # Default to True if not set
@@ -68,10 +205,16 @@ def is_elevator_enabled(ctx):
 
 # Helper to get the queue for a guild
 def get_queue(ctx):
-    return song_queues.setdefault(ctx.guild.id, [])
+    return get_guild_queue(ctx.guild.id)
+
+def get_guild_queue(guild_id):
+    queue = song_queues.get(guild_id)
+    if queue is None:
+        queue = song_queues[guild_id] = GuildQueue(guild_id, queue_journal, listener=api_bridge.queue_changed)
+    return queue
 
 def add_to_queue(ctx, song):
-    # song is a dict with metadata
+    # song is a Track record
     queue = get_queue(ctx)
     queue.append(song)
 
@@ -81,90 +224,70 @@ import asyncio
 ELEVATOR_MUSIC_PATH = "elevator.mp3"
 TTS_DONE_PATH = "done.mp3"
 
-async def play_elevator_music(ctx):
-    # Only play elevator music if enabled and nothing else is playing
-    if not is_elevator_enabled(ctx):
+# Pause between elevator loops, and before the fallback starts once the queue empties
+ELEVATOR_RESTART_SECONDS = 3
+# The elevator/TTS source currently playing in each guild
+elevator_sources = {}
+
+def schedule_fallback(ctx, delay=0, announce=False):
+    """Queue the idle fallback (done TTS, then looped elevator music) on the timer wheel."""
+    timer_wheel.schedule((ctx.guild.id, 'fallback'), delay, lambda: play_elevator_music(ctx, announce))
+
+def stop_elevator(guild_id):
+    """Cancel a pending fallback and stop elevator music if it is what's playing."""
+    timer_wheel.cancel((guild_id, 'fallback'))
+    source = elevator_sources.pop(guild_id, None)
+    guild = bot.get_guild(guild_id)
+    voice = guild.voice_client if guild else None
+    if source is not None and voice and voice.source is source:
+        voice.stop()
+
+def play_elevator_music(ctx, announce=False):
+    """
+    Play one round of the fallback: the done TTS first if `announce`, otherwise
+    the elevator track at low volume. Its after-callback re-arms the timer, so
+    an idle guild holds one wheel entry instead of a polling task.
+    """
+    gid = ctx.guild.id
+    voice = ctx.voice_client
+    if (not is_elevator_enabled(ctx) or getattr(ctx.bot, 'prevent_fallback', False)
+            or get_queue(ctx) or getattr(ctx.bot, 'is_playing_flag', {}).get(gid)):
         return
-    # Play TTS message first (optional, can remove if not needed)
-    if ctx.voice_client and not ctx.voice_client.is_playing():
-        source = discord.FFmpegPCMAudio(TTS_DONE_PATH)
-        ctx.voice_client.play(source)
-        while ctx.voice_client.is_playing():
-            await asyncio.sleep(1)
-    # Play elevator music on loop at low volume ONLY if queue is empty and nothing is playing
-    while True:
-        if not is_elevator_enabled(ctx):
-            break
-        # If a song is queued, stop elevator music immediately
-        if get_queue(ctx):
-            if ctx.voice_client and ctx.voice_client.is_playing():
-                ctx.voice_client.stop()
-            break
-        # If nothing is playing, play elevator music
-        if ctx.voice_client and not ctx.voice_client.is_playing():
-            source = discord.FFmpegPCMAudio(ELEVATOR_MUSIC_PATH)
-            source = discord.PCMVolumeTransformer(source, volume=0.05)
-            ctx.voice_client.play(source)
-        await asyncio.sleep(3)
-        # If a song is queued, stop elevator music immediately
-        if get_queue(ctx):
-            if ctx.voice_client and ctx.voice_client.is_playing():
-                ctx.voice_client.stop()
-            break
-
-
-def play_next(ctx):
-    # Use a per-guild playback flag to prevent double starts
-    if not hasattr(ctx.bot, 'is_playing_flag'):
-        ctx.bot.is_playing_flag = {}
-    flag = ctx.bot.is_playing_flag.setdefault(ctx.guild.id, False)
-    if flag:
-        # Already playing, don't trigger again
+    if not voice or not voice.is_connected() or voice.is_playing() or voice.is_paused():
         return
-    queue = get_queue(ctx)
-    # Cancel elevator music if running
-    if hasattr(ctx.bot, 'elevator_task') and ctx.bot.elevator_task:
-        ctx.bot.elevator_task.cancel()
-        ctx.bot.elevator_task = None
-    if hasattr(ctx.bot, 'disconnect_task') and ctx.bot.disconnect_task:
-        ctx.bot.disconnect_task.cancel()
-        ctx.bot.disconnect_task = None
-    if queue:
-        ctx.bot.is_playing_flag[ctx.guild.id] = True
-        ctx.bot.loop.create_task(play_next_with_delay(ctx))
-        # Cancel disconnect timer if music starts
-        if hasattr(ctx.bot, 'disconnect_task') and ctx.bot.disconnect_task:
-            ctx.bot.disconnect_task.cancel()
-            ctx.bot.disconnect_task = None
+    if announce:
+        source = discord.FFmpegPCMAudio(TTS_DONE_PATH)
     else:
-        now_playing[ctx.guild.id] = None
-        ctx.bot.is_playing_flag[ctx.guild.id] = False
-        # Start elevator music fallback only if enabled
-        if is_elevator_enabled(ctx) and not getattr(ctx.bot, 'prevent_fallback', False):
-            ctx.bot.elevator_task = ctx.bot.loop.create_task(play_elevator_music(ctx))
-        else:
-            ctx.bot.disconnect_task = ctx.bot.loop.create_task(disconnect_after_timeout(ctx, 300))
+        source = discord.FFmpegPCMAudio(ELEVATOR_MUSIC_PATH)
+        source = NumpyVolumeTransformer(source, volume=ELEVATOR_VOLUME * get_guild_volume(gid) / 100)
+    elevator_sources[gid] = source
 
-# Disconnect after timeout if still idle
-async def disconnect_after_timeout(ctx, timeout):
-    await asyncio.sleep(timeout)
-    voice = discord.utils.get(ctx.bot.voice_clients, guild=ctx.guild)
-    if voice and (not get_queue(ctx)) and not is_elevator_enabled(ctx):
-        await voice.disconnect()
-        logging.getLogger("sonix_playback").info(f"[Sonix] Disconnected from {ctx.guild.name} after 5 minutes of inactivity.")
+    def after_elevator(err):
+        # Runs on the voice thread; only loop again if nothing replaced this source
+        def rearm():
+            if elevator_sources.get(gid) is source:
+                del elevator_sources[gid]
+                schedule_fallback(ctx, 0 if announce else ELEVATOR_RESTART_SECONDS)
+        ctx.bot.loop.call_soon_threadsafe(rearm)
+
+    voice.play(source, after=after_elevator)
+    api_bridge.mark_changed(gid)
 
 import asyncio
 async def play_next_with_delay(ctx):
     await asyncio.sleep(1)
+    if voice_sessions.is_reconnecting(ctx.guild.id):
+        # Leave the queue untouched; playback restarts once the voice connection is back
+        ctx.bot.is_playing_flag[ctx.guild.id] = False
+        return
     queue = get_queue(ctx)
     if queue:
-        next_song = queue.pop(0)
+        next_song = queue.popleft()
         # Track now playing and last played
-        last_played[ctx.guild.id] = now_playing.get(ctx.guild.id)
-        now_playing[ctx.guild.id] = next_song
+        set_now_playing(ctx.guild.id, next_song, rotate=True)
         await play_song(ctx, next_song)
     else:
-        now_playing[ctx.guild.id] = None
+        set_now_playing(ctx.guild.id, None)
     # Don't clear flag here; only after playback is truly finished
 
 
@@ -179,10 +302,23 @@ async def preload_next_song(ctx):
     next_query = get_next_query(ctx)
     if not next_query:
         return
+    # A newer preload supersedes any that is still waiting for a worker
+    extraction_scheduler.cancel(ctx.guild.id, (PRELOAD,))
+    if isinstance(next_query, Track):
+        try:
+            resolved = await resolve_song_stream(ctx.guild.id, next_query, PRELOAD)
+        except ExtractionCancelled:
+            return
+        if resolved:
+            logging.getLogger("sonix_playback").info(f"[Sonix] Preloaded next song: {next_query.title}")
+            await analyze_song_gain(ctx.guild.id, next_query)
+        else:
+            logging.getLogger("sonix_playback").error(f"[Sonix] Error preloading next song: {next_query.title}")
+        return
     import re
     is_search = not (isinstance(next_query, str) and re.match(r"https?://", next_query))
     ydl_opts = {
-        'format': 'bestaudio',
+        'format': stream_format(ctx.guild.id),
         'noplaylist': True,
         'quiet': True,
         'default_search': 'ytsearch' if is_search else None,
@@ -190,14 +326,15 @@ async def preload_next_song(ctx):
     }
     # Only preload if not already cached
     if not get_cached_ytdlp(next_query):
-        loop = asyncio.get_running_loop()
-        result = await loop.run_in_executor(
-            process_pool, functools.partial(ytdlp_extract, next_query, ydl_opts)
-        )
+        try:
+            result = await extraction_scheduler.run(
+                PRELOAD, ctx.guild.id, functools.partial(ytdlp_extract, next_query, ydl_opts), process_pool
+            )
+        except ExtractionCancelled:
+            return
         if result:
-            audio_url, title, info = result
-            set_cached_ytdlp(next_query, (audio_url, title, info))
-            logging.getLogger("sonix_playback").info(f"[Sonix] Preloaded next song: {title}")
+            set_cached_ytdlp(next_query, result)
+            logging.getLogger("sonix_playback").info(f"[Sonix] Preloaded next song: {result.title}")
         else:
             logging.getLogger("sonix_playback").error(f"[Sonix] Error preloading next song: {next_query}")
 
@@ -215,15 +352,99 @@ async def elevator(ctx, mode: str = None):
     elif mode.lower() in ["off", "disable"]:
         elevator_enabled[gid] = False
         await ctx.send("Elevator music **disabled** for this server!")
-        # Stop elevator music if currently playing
-        if hasattr(ctx.bot, 'elevator_task') and ctx.bot.elevator_task:
-            ctx.bot.elevator_task.cancel()
-            ctx.bot.elevator_task = None
-        if ctx.voice_client and ctx.voice_client.is_playing():
-            ctx.voice_client.stop()
+        # Stop elevator music if it is what's playing, and let an idle connection time out
+        stop_elevator(gid)
+        if ctx.voice_client and not (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()) and not get_queue(ctx):
+            voice_sessions.release(ctx.guild)
     else:
         await ctx.send("Usage: !elevator [on/off/status]")
 
+@bot.command(aliases=["vol"])
+async def volume(ctx, value: str = None, mode: str = None):
+    """Set playback volume or loudness normalization. Usage: !volume [0-200 | normalize on/off]"""
+    gid = ctx.guild.id
+    if value is None:
+        norm = "on" if is_normalize_enabled(gid) else "off"
+        await ctx.send(f"🔊 Volume is **{get_guild_volume(gid)}%**, loudness normalization is **{norm}**.")
+    elif value.lower() == "normalize" and mode and mode.lower() in ["on", "off"]:
+        set_guild_volume(ctx.guild, normalize=mode.lower() == "on")
+        await ctx.send(f"Loudness normalization **{mode.lower()}** for this server (applies from the next track).")
+    elif value.isdigit() and 0 <= int(value) <= MAX_VOLUME:
+        live = set_guild_volume(ctx.guild, volume=int(value))
+        await ctx.send(f"🔊 Volume set to **{get_guild_volume(gid)}%**" + ("." if live else " (applies from the next track)."))
+    else:
+        await ctx.send(f"Usage: !volume [0-{MAX_VOLUME} | normalize on/off]")
+
+@bot.command(aliases=["gapless"])
+async def crossfade(ctx, mode: str = None):
+    """Set track transitions. Usage: !crossfade [off | gapless | seconds]"""
+    gid = ctx.guild.id
+    if ctx.invoked_with == "gapless" and mode is None:
+        mode = "gapless"
+    if mode is None or mode.lower() == "status":
+        transition = get_transition(gid)
+        status = "off" if transition is None else ("gapless" if transition == 0 else f"{transition:g}s crossfade")
+        await ctx.send(f"Track transitions are **{status}** for this server.")
+        return
+    try:
+        transition = parse_transition(mode)
+    except ValueError:
+        await ctx.send(f"Usage: !crossfade [off | gapless | 0-{MAX_CROSSFADE_SECONDS}]")
+        return
+    set_transition(gid, transition)
+    if transition is None:
+        await ctx.send("Track transitions **off**: each track starts on its own.")
+    elif transition == 0:
+        await ctx.send("**Gapless** playback enabled: tracks follow each other with no gap.")
+    else:
+        await ctx.send(f"**{transition:g}s crossfade** enabled between tracks.")
+
+@bot.command(aliases=["bitrate"])
+async def quality(ctx, mode: str = None):
+    """Set how much audio is streamed in. Usage: !quality [channel | best | kbps]"""
+    gid = ctx.guild.id
+    if mode is None or mode.lower() == "status":
+        policy = get_format_policy(gid)
+        kbps = stream_kbps(gid)
+        if policy == 'best':
+            status = "the best available audio"
+        elif policy == 'channel':
+            status = f"matched to the voice channel (currently **{kbps} kbps**)"
+        else:
+            status = f"fixed at **{kbps} kbps**"
+        await ctx.send(f"Stream quality is {status} for this server.")
+        return
+    try:
+        policy = parse_policy(mode)
+    except ValueError:
+        await ctx.send("Usage: !quality [channel | best | 8-384]")
+        return
+    format_policies[gid] = policy
+    await ctx.send(f"Stream quality set to **{policy if isinstance(policy, str) else f'{policy} kbps'}** (applies from the next song that is resolved).")
+
+@bot.command(name="library", aliases=["lib"])
+async def library_cmd(ctx, action: str = None, *, query: str = None):
+    """Search or rescan the local music library. Usage: !library [search <query> | rescan]"""
+    if not library.enabled:
+        await ctx.send("The local library is not configured (set SONIX_LIBRARY_DIR).")
+        return
+    if action == "rescan":
+        count = await asyncio.get_running_loop().run_in_executor(None, library.scan)
+        await ctx.send(f"📚 Library rescanned: **{count}** tracks.")
+    elif action == "search" and query:
+        results = library.search(query, limit=10)
+        if not results:
+            await ctx.send(f"No library tracks match **{query}**.")
+            return
+        lines = [f"`{i}.` {library.track(entry_id, entry).title}" for i, (entry_id, entry, _) in enumerate(results, 1)]
+        embed = discord.Embed(title="📚 Library", description="\n".join(lines), color=discord.Color.blurple())
+        embed.set_footer(text="Play one with !play local: <name>")
+        await ctx.send(embed=embed)
+    elif action is None:
+        await ctx.send(f"📚 The local library has **{len(library.entries)}** tracks. Use `!library search <query>` or `!play local: <name>`.")
+    else:
+        await ctx.send("Usage: !library [search <query> | rescan]")
+
 # Custom help command for Sonix
 @bot.command(aliases=["m!help", "m!h", "?help", "?h"])
 async def sonixhelp(ctx):
@@ -232,13 +453,23 @@ async def sonixhelp(ctx):
         "**Prefix:** `!` or `m!` or `?`\n"
         "Here are the available commands and their aliases:"
     )
-    embed.add_field(name="▶️ Play", value="`!play <song/url>` or `!p` or `m!p` — Play a song or add to the queue.", inline=False)
-    embed.add_field(name="📄 Queue", value="`!queue` or `!q` or `m!q` — Show the current song queue.", inline=False)
+    embed.add_field(name="▶️ Play", value="`!play <song/url>` or `!p` or `m!p` — Play a song or add to the queue. YouTube / YouTube Music playlists and SoundCloud sets queue every track; `!play sc: <query>` searches SoundCloud.", inline=False)
+    embed.add_field(name="📚 Library", value="`!library [search <query> | rescan]` or `!lib` — Search the local library. Library songs are matched before going online; `!play local: <name>` forces one.", inline=False)
+    embed.add_field(name="📄 Queue", value="`!queue [page]` or `!q` or `m!q` — Show the current song queue.", inline=False)
+    embed.add_field(name="➕ Enqueue", value="`!enqueue <song> | <song> | ...` or `!add` — Add several songs at once.", inline=False)
+    embed.add_field(name="🗑️ Remove", value="`!remove <position|from-to|video id>...` or `!rm` — Remove songs from the queue.", inline=False)
+    embed.add_field(name="↕️ Move / Shuffle / Clear", value="`!move <from> <to>` or `!mv`, `!shuffle`, `!clear` — Reorder or empty the queue.", inline=False)
     embed.add_field(name="⏭️ Skip", value="`!skip` or `!s` or `m!s` — Skip the current song.", inline=False)
     embed.add_field(name="⏸️ Pause", value="`!pause` or `!pa` or `m!pa` — Pause playback.", inline=False)
     embed.add_field(name="▶️ Resume", value="`!resume` or `!r` or `m!r` — Resume playback.", inline=False)
+    embed.add_field(name="⏩ Seek", value="`!seek <m:ss>`, `!forward [seconds]` or `!ff`, `!rewind [seconds]` or `!rw` — Jump within the current song. `!replay` restarts it.", inline=False)
     embed.add_field(name="⏹️ Stop", value="`!stop` or `!st` or `m!st` — Stop playback and clear the queue.", inline=False)
+    embed.add_field(name="👋 Leave", value="`!leave` or `!dc` — Stop, clear the queue, and leave the voice channel.", inline=False)
     embed.add_field(name="🔊 Join", value="`!join` or `!j` or `m!j` — Make the bot join your voice channel.", inline=False)
+    embed.add_field(name="🔊 Volume", value="`!volume [0-200]` or `!vol` — Set the volume. `!volume normalize on/off` — Toggle loudness normalization.", inline=False)
+    embed.add_field(name="📶 Quality", value="`!quality [channel/best/kbps]` or `!bitrate` — Stream the smallest audio format that meets the voice channel's bitrate (default), the best one, or a fixed bitrate.", inline=False)
+    embed.add_field(name="🔀 Transitions", value="`!crossfade [off/gapless/seconds]` or `!gapless` — Gapless playback or crossfade between tracks.", inline=False)
+    embed.add_field(name="⏱️ Trace", value="`!trace [last]` — Show where the last `!play` in this server spent its time.", inline=False)
     embed.add_field(name="🎵 Elevator Music", value="`!elevator [on/off/status]` — Enable or disable elevator music fallback.", inline=False)
     embed.add_field(name="❓ Help", value="`!sonixhelp` or `!m!help` or `!m!h` or `?help` or `?h` — Show this help message.", inline=False)
     embed.set_footer(text="Thank you for using Sonix! Need help? Contact support@sonixbot.com")
@@ -248,12 +479,22 @@ async def sonixhelp(ctx):
 import functools
 import concurrent.futures
 from collections import OrderedDict
-from invidious_helper import extract_video_id, get_invidious_audio_url, invidious_search
+from cookie_jar import cookies, youtube_dl, init_worker as init_cookie_worker
+from invidious_helper import extract_video_id, get_invidious_audio_url, invidious_search, invidious_pool
+from admission import admission, AdmissionRejected
+from extraction_scheduler import extraction_scheduler, ExtractionCancelled, INTERACTIVE, PRELOAD, BULK
+from queue_view import build_queue_embed, QueuePaginator, clamp_page, page_count, song_summary
 
 # Global process pool for yt-dlp
-process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=4)
-
-# Simple LRU cache for yt-dlp results (max 128 unique queries)
+# Workers share the bot's parsed cookie jar version instead of re-reading youtube_cookies.txt
+process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=4, initializer=init_cookie_worker, initargs=cookies.worker_args())
+# Loudness analysis holds a worker for up to a minute per track; its own small pool
+# keeps it from starving preloads and playlist listing
+gain_pool = concurrent.futures.ThreadPoolExecutor(max_workers=GAIN_ANALYSIS_WORKERS, thread_name_prefix='sonix-gain')
+# Audio cache downloads can take minutes each; one or two at a time, never on an extraction slot
+download_pool = concurrent.futures.ThreadPoolExecutor(max_workers=AUDIO_CACHE_DOWNLOADS, thread_name_prefix='sonix-cache')
+
+# Simple LRU cache for yt-dlp results (max 128 unique queries), stored as Track records
 ytdlp_cache = OrderedDict()
 YTDLP_CACHE_SIZE = 128
 
@@ -272,81 +513,166 @@ def set_cached_ytdlp(query, value):
 # Move ytdlp_extract to module level so it can be pickled for ProcessPoolExecutor
 
 def ytdlp_extract(query, ydl_opts):
-    from yt_dlp import YoutubeDL
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        with youtube_dl(ydl_opts) as ydl:
             info = ydl.extract_info(query, download=False)
             if 'entries' in info:
                 info = info['entries'][0]
-            audio_url = info.get('url')
-            title = info.get('title', query)
-            return audio_url, title, info
+            # Slim the result in the worker so the full info dict is never pickled back
+            return Track.from_info(info, query)
     except Exception:
         return None
 
-async def fetch_song_metadata(q):
-    from yt_dlp import YoutubeDL
+# yt-dlp options for turning a stored song (e.g. restored from the journal) back into a stream URL;
+# 'format' is set per guild by stream_format()
+RESOLVE_YDL_OPTS = {
+    'format': 'bestaudio',
+    'noplaylist': True,
+    'quiet': True,
+    'default_search': 'ytsearch',
+}
+
+async def resolve_song_stream(guild_id, song, priority=INTERACTIVE):
+    """
+    Make sure a Track has a live stream URL, resolving it again if it was
+    restored without one or the URL has expired. Returns False if the song can
+    no longer be resolved.
+    """
+    # A cached copy beats any stream URL, live or not
+    if audio_cache.attach(song):
+        return True
+    if song.has_stream():
+        return True
+    if is_library_track(song):
+        # Restored from the journal: point it at its file again
+        return library.fill_stream(song)
+    query = song.webpage_url or song.query
+    if not query:
+        return False
+    if is_soundcloud_url(song.webpage_url):
+        try:
+            with span('soundcloud_stream', query=query):
+                if await soundcloud.fill_stream(song):
+                    return True
+        except SoundCloudUnavailable:
+            pass
+    result = get_cached_ytdlp(query)
+    if not result or not result.has_stream():
+        with span('resolve_song_stream', query=query):
+            result = await extraction_scheduler.run(
+                priority, guild_id, functools.partial(ytdlp_extract, query, {**RESOLVE_YDL_OPTS, 'format': stream_format(guild_id)}), process_pool
+            )
+        if not result:
+            return False
+        set_cached_ytdlp(query, result)
+    song.update_stream(result)
+    return True
+
+# Measured normalization gains by video ID, so repeat plays skip the analysis
+track_gains = OrderedDict()
+TRACK_GAINS_SIZE = 4096
+# Video IDs being analysed, so guilds playing the same track share one analysis
+gain_analyses = {}
+
+async def analyze_song_gain(guild_id, song):
+    """Fill in song.gain_db from the gain cache or a background loudness analysis."""
+    if song.gain_db is not None or not is_normalize_enabled(guild_id):
+        return
+    if song.id in track_gains:
+        song.gain_db = track_gains[song.id]
+        return
+    if not song.has_stream():
+        return
+    analysis = gain_analyses.get(song.id)
+    if analysis is None:
+        analysis = asyncio.get_running_loop().run_in_executor(gain_pool, bind_trace(functools.partial(analyze_track_gain, song.stream_url)))
+        if song.id:
+            gain_analyses[song.id] = analysis
+            analysis.add_done_callback(lambda _: gain_analyses.pop(song.id, None))
+    gain = await asyncio.shield(analysis)
+    if gain is None:
+        return
+    song.gain_db = gain
+    if song.id:
+        track_gains[song.id] = gain
+        if len(track_gains) > TRACK_GAINS_SIZE:
+            track_gains.popitem(last=False)
+
+async def fetch_song_metadata(q, guild_id=None, priority=INTERACTIVE):
     import re
     import logging
-    # If not a URL, prefix with ytsearch:
-    if not (isinstance(q, str) and re.match(r"https?://", q)):
-        q = f"ytsearch:{q}"
+    # Songs in the local library need no lookup online at all
+    song = library_lookup(q)
+    if song:
+        return song
+    # SoundCloud links and `sc:` searches skip yt-dlp when the API answers
+    song = await soundcloud_lookup(q)
+    if song:
+        return song
+    sc_terms = soundcloud_search_query(q)
+    is_search = not (isinstance(q, str) and re.match(r"https?://", q))
+    query = f"scsearch:{sc_terms}" if sc_terms else q
     logger = logging.getLogger("sonix_debug")
-    # Print the exact query being sent to yt-dlp
+    # Print the exact query being resolved
+    calling_ctx = None
     try:
         import inspect
-        calling_ctx = None
         for frame in inspect.stack():
             if 'ctx' in frame.frame.f_locals:
                 calling_ctx = frame.frame.f_locals['ctx']
                 break
         if calling_ctx:
-            await calling_ctx.send(f"[DEBUG] fetch_song_metadata is sending query to yt-dlp: {q}")
-        logger.info(f"[DEBUG] fetch_song_metadata is sending query to yt-dlp: {q}")
+            outbox.line(calling_ctx.channel, f"[DEBUG] fetch_song_metadata is resolving query: {query}")
+        logger.info(f"[DEBUG] fetch_song_metadata is resolving query: {query}")
     except Exception as e:
         logger.error(f"[DEBUG] Could not send debug message for query: {e}")
     ydl_opts = {
-        'format': 'bestaudio',
+        'format': stream_format(guild_id),
         'noplaylist': True,
         'quiet': True,
         'default_search': 'ytsearch',
-        'cookiefile': 'youtube_cookies.txt',
     }
-    def ytdlp_extract():
-        try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(q, download=False)
-                if 'entries' in info:
-                    info = info['entries'][0]
-                return info
-        except Exception as e:
-            logger.error(f"[DEBUG] yt-dlp exception: {e}")
-            try:
-                if calling_ctx:
-                    import asyncio
-                    asyncio.run(calling_ctx.send(f"[DEBUG] yt-dlp exception: {e}"))
-            except Exception:
-                pass
-            return None
-    info = await asyncio.to_thread(ytdlp_extract)
-    if not info:
+    try:
+        with span('fetch_song_metadata', query=query):
+            if sc_terms:
+                # The SoundCloud API is unavailable, but yt-dlp can still search it
+                song = await extraction_scheduler.run(
+                    priority, guild_id, functools.partial(ytdlp_extract, query, ydl_opts), process_pool
+                )
+            else:
+                # YouTube searches and URLs race Invidious against yt-dlp like the other play paths
+                is_ytmusic = not is_search and re.match(r"https?://music\.youtube\.com/", q)
+                song = await hedged_resolve(guild_id, q, ydl_opts, bool(is_ytmusic), is_search, priority)
+    except ExtractionCancelled:
+        return None
+    if song is None:
+        logger.error(f"[DEBUG] No playable result for: {query}")
+        if calling_ctx:
+            outbox.line(calling_ctx.channel, f"[DEBUG] No playable result for: {query}")
+    return song
+
+async def soundcloud_lookup(query):
+    """
+    Playable Track for a SoundCloud track URL or `sc: <query>` search through
+    the SoundCloud API, or None if the query is not one of those or the API
+    failed (callers then fall back to yt-dlp).
+    """
+    if not isinstance(query, str) or not (is_soundcloud_url(query) or soundcloud_search_query(query)):
+        return None
+    try:
+        with span('soundcloud', query=query):
+            return await soundcloud.track(query)
+    except SoundCloudUnavailable as e:
+        logging.getLogger("sonix_debug").info(f"[SoundCloud] Falling back to yt-dlp for {query}: {e}")
         return None
-    return {
-        'title': info.get('title', q),
-        'webpage_url': info.get('webpage_url', q),
-        'thumbnail': info.get('thumbnail', ''),
-        'audio_url': info.get('url', ''),
-        'info': info,
-        'query': q,
-    }
 
-async def fetch_multiple_song_metadata(queries):
+async def fetch_multiple_song_metadata(queries, guild_id=None, priority=BULK):
     # Helper to fetch metadata for a list of queries in parallel
-    results = await asyncio.gather(*(fetch_song_metadata(q) for q in queries))
+    results = await asyncio.gather(*(fetch_song_metadata(q, guild_id, priority) for q in queries))
     # Filter out None (failed) results
     return [song for song in results if song is not None]
 
-async def expand_spotify_url_to_queries(spotify_url):
+async def expand_spotify_url_to_queries(spotify_url, guild_id=None):
     import re
     import os
     import spotipy
@@ -382,61 +708,270 @@ async def expand_spotify_url_to_queries(spotify_url):
     # Fetch YouTube metadata for all queries
     if not queries:
         return None
-    songs = await fetch_multiple_song_metadata(queries)
+    songs = await fetch_multiple_song_metadata(queries, guild_id, BULK)
     return songs if songs else None
 
+def seek_options(start):
+    # Input-side seek: ffmpeg issues a range request at the position instead of decoding up to it
+    return f'-ss {start:.2f} ' if start else ''
+
+def open_pcm_source(song, start=0.0):
+    # Library and cached files are local paths; the reconnect options only exist for network inputs
+    network = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5' if song.stream_url.startswith(('http://', 'https://')) else ''
+    return discord.FFmpegPCMAudio(
+        song.stream_url,
+        before_options=(seek_options(start) + network) or None,
+        options='-vn'
+    )
+
+def library_direct(guild_id, song):
+    """
+    Whether a library or audio cache track's Opus packets can go straight to
+    Discord. They cannot be scaled without decoding, so loudness
+    normalization is skipped and a volume other than 100% falls back to
+    ffmpeg on the local file.
+    """
+    if get_guild_volume(guild_id) != 100:
+        return False
+    return library.is_direct(song) if is_library_track(song) else audio_cache.is_direct(song)
+
+def open_direct_source(song, start=0.0):
+    return library.open(song, start) if is_library_track(song) else audio_cache.open(song, start)
+
+def count_play(song):
+    """Count a play for the audio cache and download the track once it is played often enough."""
+    if audio_cache.record_play(song):
+        job = asyncio.get_running_loop().run_in_executor(
+            download_pool, functools.partial(audio_cache.download, song.id, song.stream_url, song.codec)
+        )
+        def failed(future):
+            # download() handles its own errors; anything else must not leave the track pending forever
+            if future.cancelled() or future.exception() is not None:
+                audio_cache.abandon(song.id)
+        job.add_done_callback(failed)
+    else:
+        asyncio.get_running_loop().run_in_executor(None, audio_cache.save)
+
+def library_lookup(query):
+    """The library track a search query names (URLs never match), or None. In memory, so it is called inline."""
+    if not library.enabled or not isinstance(query, str) or re.match(r"https?://", query):
+        return None
+    return library.match(query)
+
+def open_opus_source(song, guild_id, start=0.0):
+    """Opus source for a track that is already playing, e.g. after a seek; skips from_probe."""
+    gain_options = ffmpeg_gain_options(playback_volume_factor(guild_id, song))
+    # Without a gain filter an opus stream is passed through untouched, as from_probe would choose
+    codec = 'copy' if not gain_options and song.codec == 'opus' else None
+    return discord.FFmpegOpusAudio(
+        song.stream_url,
+        before_options=seek_options(start) or None,
+        options=f'-analyzeduration 0 -probesize 32 {gain_options}'.strip(),
+        codec=codec,
+    )
+
+def song_link(song):
+    # Library tracks have no page to link to
+    return f"**[{song.title}]({song.webpage_url})**" if song.webpage_url else f"**{song.title}**"
+
+def now_playing_embed(song):
+    if song.is_ytmusic or (song.is_search and 'music.youtube.com' in song.webpage_url):
+        embed = discord.Embed(title="🎶 Now Playing from YouTube Music", description=song_link(song), color=discord.Color.red())
+    elif is_library_track(song):
+        embed = discord.Embed(title="🎶 Now Playing from the Library", description=song_link(song), color=discord.Color.green())
+    else:
+        embed = discord.Embed(title="🎶 Now Playing", description=song_link(song), color=discord.Color.green())
+    if song.thumbnail:
+        embed.set_thumbnail(url=song.thumbnail)
+    return embed
+
+def start_mixer(ctx, song, transition, start=0.0):
+    """Wrap the first track in a MixingSource that keeps pulling from the queue."""
+    gid = ctx.guild.id
+    loop = ctx.bot.loop
+    mixer = MixingSource(
+        open_pcm_source(song, start), song,
+        crossfade_seconds=transition,
+        volume=get_guild_volume(gid) / 100,
+        gain=track_gain_factor(gid, song),
+    )
+    # Called from the voice thread; hand the work to the bot loop
+    mixer.on_need_next = lambda: asyncio.run_coroutine_threadsafe(feed_mixer(ctx, mixer), loop)
+    mixer.on_track_change = lambda track: asyncio.run_coroutine_threadsafe(mixer_track_changed(ctx, track), loop)
+    mixer.offset = start
+    active_mixers[gid] = mixer
+    return mixer
+
+async def feed_mixer(ctx, mixer):
+    """Resolve the next queued track and pre-open it in the mixer before the current one ends."""
+    queue = get_queue(ctx)
+    if not queue or not isinstance(queue[0], Track):
+        # Plain queries go through the regular play path once the mixer runs dry
+        return
+    next_song = queue[0]
+    try:
+        if not await resolve_song_stream(ctx.guild.id, next_song, PRELOAD):
+            return
+    except ExtractionCancelled:
+        return
+    # The queue may have changed, or the mixer stopped, while we were resolving
+    if not queue or queue[0] is not next_song or active_mixers.get(ctx.guild.id) is not mixer:
+        return
+    queue.popleft()
+    if next_song.gain_db is None and next_song.id in track_gains:
+        next_song.gain_db = track_gains[next_song.id]
+    mixer.queue_next(open_pcm_source(next_song), next_song, track_gain_factor(ctx.guild.id, next_song))
+
+async def mixer_track_changed(ctx, song):
+    set_now_playing(ctx.guild.id, song, rotate=True)
+    ctx.bot.loop.create_task(preload_next_song(ctx))
+    ctx.bot.loop.create_task(analyze_song_gain(ctx.guild.id, song))
+    count_play(song)
+    await ctx.send(embed=now_playing_embed(song))
+
+def invidious_lookup(query, is_ytmusic=False, is_search=False, kbps=None):
+    """Blocking Invidious resolution of a search or YouTube URL to a Track, or None."""
+    video_id = invidious_search(query) if is_search else extract_video_id(query)
+    if not video_id:
+        return None
+    info = get_invidious_audio_url(video_id, kbps=kbps)
+    return Track.from_invidious(info, query, is_ytmusic, is_search) if info else None
+
+async def hedged_resolve(guild_id, query, ydl_opts, is_ytmusic=False, is_search=False, priority=INTERACTIVE):
+    """
+    Resolve `query` to a playable Track, starting with whichever of Invidious
+    and yt-dlp has been faster lately and hedging with the other one at the
+    first backend's p95. Non-YouTube URLs go straight to yt-dlp. Only a
+    result with a live stream wins.
+    """
+    # A flat search entry has no stream and could never win; the yt-dlp side always extracts in full
+    ydl_opts = {**ydl_opts, 'extract_flat': False}
+
+    async def invidious():
+        with span('invidious_lookup', query=query):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, bind_trace(functools.partial(invidious_lookup, query, is_ytmusic, is_search, stream_kbps(guild_id)))
+            )
+
+    async def ytdlp():
+        with span('ytdlp_extract', query=query):
+            return await extraction_scheduler.run(
+                priority, guild_id, functools.partial(ytdlp_extract, query, ydl_opts), process_pool
+            )
+
+    backends = [('ytdlp', ytdlp)]
+    if is_search or extract_video_id(query):
+        backends.insert(0, ('invidious', invidious))
+    return await hedged_resolver.resolve(backends, is_valid=lambda track: track is not None and track.has_stream())
+
+async def ingest_playlist(ctx, url, pages=None):
+    """
+    Stream a YouTube / YouTube Music playlist into the queue. Entries arrive as
+    flat Tracks whose streams are resolved when each one is about to play, and
+    playback starts with the first entry while the rest is still being listed.
+    Returns once the first entry is queued; listing continues in the background.
+    `pages` replaces the yt-dlp listing, e.g. with a SoundCloud set's pages.
+    """
+    queue = get_queue(ctx)
+    first_page = ctx.bot.loop.create_future()
+    # Loading notice, running count and summary share one message
+    progress_key = f"playlist:{url}"
+    outbox.progress(ctx.channel, progress_key, "📜 Loading playlist. Songs are added to the queue as they are listed...")
+
+    def on_page(ingest, tracks):
+        # Pages already in flight when the ingest was cancelled (e.g. !stop) are dropped
+        if ingest.stopped.is_set():
+            return
+        queue.extend(tracks)
+        outbox.progress(ctx.channel, progress_key, f"📜 Loading playlist... **{ingest.queued}** songs queued so far.")
+        if not first_page.done():
+            first_page.set_result(None)
+        voice = ctx.voice_client
+        if voice and not (voice.is_playing() or voice.is_paused()):
+            play_next(ctx)
+
+    async def listing():
+        try:
+            queued = await playlist_ingests.run(ctx.guild.id, url, on_page, pages)
+        except ExtractionCancelled:
+            outbox.progress(ctx.channel, progress_key, "⏹️ Stopped loading the playlist.", final=True)
+            return
+        except Exception as e:
+            # Includes SoundCloudUnavailable for sets
+            logging.getLogger("sonix_playback").error(f"[Sonix] Playlist listing failed for {url}: {e}")
+            embed = discord.Embed(title="❌ Playlist Error", description=f"Could not load this playlist.\n```{e}```", color=discord.Color.red())
+            outbox.progress(ctx.channel, progress_key, embed=embed, final=True)
+            return
+        if queued:
+            embed = discord.Embed(title="🟢 Added Playlist", description=f"Added **{queued}** tracks from the playlist!", color=discord.Color.green())
+        else:
+            embed = discord.Embed(title="❌ Playlist Error", description="No playable videos found in this playlist.", color=discord.Color.red())
+        outbox.progress(ctx.channel, progress_key, embed=embed, final=True)
+
+    task = ctx.bot.loop.create_task(listing())
+    await asyncio.wait({first_page, task}, return_when=asyncio.FIRST_COMPLETED)
+
 async def play_song(ctx, query_or_song, retry_count=0):
     # Cancel elevator music if running
-    if hasattr(ctx.bot, 'elevator_task') and ctx.bot.elevator_task:
-        ctx.bot.elevator_task.cancel()
-        ctx.bot.elevator_task = None
+    stop_elevator(ctx.guild.id)
     import re
     logger = logging.getLogger("sonix_playback")
-    # If passed a dict (already extracted), use it directly
-    if isinstance(query_or_song, dict):
+    # If passed a Track (already extracted), use it directly
+    if isinstance(query_or_song, Track):
         song = query_or_song
-        audio_url = song['audio_url']
-        title = song['title']
-        info = song['info']
-        is_ytmusic = song.get('is_ytmusic', False)
-        is_search = song.get('is_search', False)
-        query = song.get('query', None)
+        # Restored songs carry no stream URL until they are about to play
+        if not await resolve_song_stream(ctx.guild.id, song):
+            logger.error(f"[Sonix] Could not resolve queued song: {song.title}")
+            embed = discord.Embed(title="❌ Error", description=f"Could not play **{song.title or 'the next song'}**. Skipping it.", color=discord.Color.red())
+            await ctx.send(embed=embed)
+            if hasattr(ctx.bot, 'is_playing_flag'):
+                ctx.bot.is_playing_flag[ctx.guild.id] = False
+            play_next(ctx)
+            return
+    elif is_playlist_url(str(query_or_song)):
+        await ingest_playlist(ctx, str(query_or_song))
+        return
+    elif is_soundcloud_set(str(query_or_song)):
+        await ingest_playlist(ctx, str(query_or_song), soundcloud.iter_set(str(query_or_song)))
+        return
     else:
         # If passed a Spotify URL, expand to YouTube search queries
         spotify_pattern = r"https://open\.spotify\.com/(track|album|playlist)/([a-zA-Z0-9]+)"
         match = re.match(spotify_pattern, str(query_or_song))
         if match:
             await ctx.send("🔎 Expanding Spotify link and searching YouTube for playable tracks. This may take a moment for large playlists...")
-            expanded = await expand_spotify_url_to_queries(str(query_or_song))
+            expanded = await expand_spotify_url_to_queries(str(query_or_song), ctx.guild.id)
             if not expanded:
                 await ctx.send("❌ Could not extract any playable tracks from this Spotify link.")
                 return
             first, *rest = expanded
-            await ctx.send(f"▶️ Now playing: **{first['title']}** (from Spotify)")
+            await ctx.send(f"▶️ Now playing: **{first.title}** (from Spotify)")
             await play_song(ctx, first)
             queue = get_queue(ctx)
             # Incrementally queue the rest in the background
             async def queue_spotify_tracks(rest_tracks):
+                # One message edited in place; updates made faster than the channel allows collapse into the latest
+                progress_key = f"spotify:{query_or_song}"
                 added = 0
                 for song in rest_tracks:
                     queue.append(song)
                     added += 1
                     if added % 5 == 0 or added == len(rest_tracks):
-                        await ctx.send(f"➕ Added {added}/{len(rest_tracks)} tracks from the Spotify playlist to the queue.")
-                await ctx.send(f"✅ Finished adding {len(rest_tracks)} tracks from Spotify playlist to the queue!")
+                        outbox.progress(ctx.channel, progress_key, f"➕ Added {added}/{len(rest_tracks)} tracks from the Spotify playlist to the queue.")
+                outbox.progress(ctx.channel, progress_key, f"✅ Finished adding {len(rest_tracks)} tracks from Spotify playlist to the queue!", final=True)
             ctx.bot.loop.create_task(queue_spotify_tracks(rest))
             return
         query = query_or_song
         is_ytmusic = isinstance(query, str) and re.match(r"https?://music\.youtube\.com/", query)
         is_search = not (isinstance(query, str) and re.match(r"https?://", query))
         ydl_opts = {
-            'format': 'bestaudio/best',
+            # Audio-only and sized to the voice channel; never a muxed video format
+            'format': stream_format(ctx.guild.id),
             'quiet': True,
             'noplaylist': True,
             'default_search': 'ytsearch' if is_search else None,
             'nocheckcertificate': True,
             'extract_flat': 'in_playlist',
-            'cookiefile': 'youtube_cookies.txt',
             'outtmpl': '%(title)s.%(ext)s',
             'cachedir': False,
             'source_address': '0.0.0.0',  # Bind to IPv4
@@ -450,40 +985,42 @@ async def play_song(ctx, query_or_song, retry_count=0):
                 'Upgrade-Insecure-Requests': '1',
             },
         }
-        # Check cache first
-        cached = get_cached_ytdlp(query)
-        if cached:
-            audio_url, title, info = cached
-            logger.info(f"[Sonix] [CACHE] Successfully extracted: {title}")
+        # Local library first, then the cache
+        local = library_lookup(query)
+        cached = None if local else get_cached_ytdlp(query)
+        if local:
+            result = local
+            logger.info(f"[Sonix] [LIBRARY] Playing from the local library: {result.title}")
+        elif cached:
+            result = cached
+            logger.info(f"[Sonix] [CACHE] Successfully extracted: {result.title}")
         else:
-            loop = asyncio.get_running_loop()
-            result = await loop.run_in_executor(
-                process_pool, functools.partial(ytdlp_extract, query, ydl_opts)
-            )
+            sc_terms = soundcloud_search_query(query)
+            result = await soundcloud_lookup(query)
+            if result is None and sc_terms:
+                # The SoundCloud API is unavailable, but yt-dlp can still search it
+                with span('ytdlp_extract', query=query):
+                    result = await extraction_scheduler.run(
+                        INTERACTIVE, ctx.guild.id, functools.partial(ytdlp_extract, f"scsearch:{sc_terms}", ydl_opts), process_pool
+                    )
+            elif result is None:
+                # Invidious and yt-dlp race; this replaces retrying the same extractor after a failure
+                result = await hedged_resolve(ctx.guild.id, query, ydl_opts, bool(is_ytmusic), is_search)
             if result:
-                audio_url, title, info = result
-                set_cached_ytdlp(query, (audio_url, title, info))
-                logger.info(f"[Sonix] Successfully extracted: {title}")
+                set_cached_ytdlp(query, result)
+                logger.info(f"[Sonix] Successfully extracted: {result.title}")
             else:
                 logger.error(f"[Sonix] Error extracting info: {query}")
-                if retry_count < 1:
-                    logger.info(f"[Sonix] Retrying extraction for: {query}")
-                    await play_song(ctx, query, retry_count=retry_count+1)
-                    return
-                embed = discord.Embed(title="❌ Error", description=f"Could not play the requested song after retry.", color=discord.Color.red())
+                embed = discord.Embed(title="❌ Error", description=f"Could not play the requested song.", color=discord.Color.red())
                 await ctx.send(embed=embed)
                 return
-        # Build the song dict
-        song = {
-            'audio_url': audio_url,
-            'title': title,
-            'info': info,
-            'webpage_url': info.get('webpage_url', ''),
-            'thumbnail': info.get('thumbnail', ''),
-            'is_ytmusic': is_ytmusic,
-            'is_search': is_search,
-            'query': query,
-        }
+        # Each play gets its own record; the cached one is only a template
+        song = result.copy(is_ytmusic=bool(is_ytmusic), is_search=is_search, query=query)
+        # Flat search results carry only the watch URL, and cached streams may have expired
+        if not await resolve_song_stream(ctx.guild.id, song):
+            embed = discord.Embed(title="❌ Error", description=f"Could not play the requested song.", color=discord.Color.red())
+            await ctx.send(embed=embed)
+            return
 
     # If voice client is already playing, do not attempt playback or send error
     voice = ctx.voice_client
@@ -491,16 +1028,48 @@ async def play_song(ctx, query_or_song, retry_count=0):
         logger.info(f"[Sonix] play_song called but audio is already playing. Suppressing error.")
         return
     try:
-        logger.info(f"[Sonix] Starting playback: {song['title']}")
-        source = await discord.FFmpegOpusAudio.from_probe(
-            song['audio_url'],
-            options='-analyzeduration 0 -probesize 32'
-        )
+        logger.info(f"[Sonix] Starting playback: {song.title}")
+        if song.gain_db is None and song.id in track_gains:
+            song.gain_db = track_gains[song.id]
+        gain_options = ffmpeg_gain_options(playback_volume_factor(ctx.guild.id, song))
+        transition = get_transition(ctx.guild.id)
+        # A song cut off by a voice drop continues where it was
+        start = 0.0
+        resume = resume_positions.pop(ctx.guild.id, None)
+        if resume and resume[0] is song:
+            start = resume[1]
+        if transition is not None:
+            # Gapless/crossfade: one PCM mixer stays on the player across tracks
+            with span('open source', kind='mixer'):
+                source = start_mixer(ctx, song, transition, start)
+        elif library_direct(ctx.guild.id, song):
+            # Packets straight out of the memory-mapped file: no ffmpeg, no network
+            with span('open source', kind='library'):
+                source = PositionedSource(open_direct_source(song, start), start)
+        elif gain_options:
+            # Volume and normalization run inside ffmpeg's filter chain (re-encoded to opus),
+            # so they cost no Python work per frame
+            with span('open source', kind='ffmpeg opus'):
+                source = PositionedSource(discord.FFmpegOpusAudio(
+                    song.stream_url,
+                    before_options=seek_options(start) or None,
+                    options=f'-analyzeduration 0 -probesize 32 {gain_options}'
+                ), start)
+        else:
+            with span('from_probe'):
+                source = PositionedSource(await discord.FFmpegOpusAudio.from_probe(
+                    song.stream_url,
+                    before_options=seek_options(start) or None,
+                    options='-analyzeduration 0 -probesize 32'
+                ), start)
+        playing_sources[ctx.guild.id] = source
         # Preload the next song in the queue
         ctx.bot.loop.create_task(preload_next_song(ctx))
+        # Measure this track's loudness in the background for its next play
+        ctx.bot.loop.create_task(analyze_song_gain(ctx.guild.id, song))
+        count_play(song)
         # Track now playing and last played
-        last_played[ctx.guild.id] = now_playing.get(ctx.guild.id)
-        now_playing[ctx.guild.id] = song
+        set_now_playing(ctx.guild.id, song, rotate=True)
         async def handle_after_playing_error(err):
             channel = ctx.channel
             logger.error(f"[Sonix] Playback error: {err}")
@@ -510,25 +1079,24 @@ async def play_song(ctx, query_or_song, retry_count=0):
             # Always clear the playback flag before triggering next
             if hasattr(ctx.bot, 'is_playing_flag'):
                 ctx.bot.is_playing_flag[ctx.guild.id] = False
+            if active_mixers.get(ctx.guild.id) is source:
+                active_mixers.pop(ctx.guild.id, None)
             if err:
                 logger.error(f"[Sonix] Error in after_playing: {err}")
                 ctx.bot.loop.create_task(handle_after_playing_error(err))
             else:
-                logger.info(f"[Sonix] Song finished: {song['title']}")
+                logger.info(f"[Sonix] Song finished: {song.title}")
             ctx.bot.loop.call_soon_threadsafe(play_next, ctx)
 
+        # Time from here until the player thread pulls the first frame
+        trace_first_read(source)
         ctx.voice_client.play(source, after=after_playing)
-        if song['is_ytmusic'] or (song['is_search'] and 'music.youtube.com' in song['info'].get('webpage_url', '')):
-            embed = discord.Embed(title="🎶 Now Playing from YouTube Music", description=f"**[{song['title']}]({song['info'].get('webpage_url', '')})**", color=discord.Color.red())
-        else:
-            embed = discord.Embed(title="🎶 Now Playing", description=f"**[{song['title']}]({song['info'].get('webpage_url', '')})**", color=discord.Color.green())
-        if song['thumbnail']:
-            embed.set_thumbnail(url=song['thumbnail'])
-        await ctx.send(embed=embed)
+        api_bridge.mark_changed(ctx.guild.id)
+        await ctx.send(embed=now_playing_embed(song))
     except Exception as e:
         logger.error(f"[Sonix] Error starting playback: {e}")
         if retry_count < 1:
-            logger.info(f"[Sonix] Retrying playback for: {song['title']}")
+            logger.info(f"[Sonix] Retrying playback for: {song.title}")
             await play_song(ctx, song, retry_count=retry_count+1)
             return
         embed = discord.Embed(title="❌ Error", description=f"Could not start playback after retry.\n```{str(e)}```", color=discord.Color.red())
@@ -544,33 +1112,138 @@ def play_next(ctx):
         return
     queue = get_queue(ctx)
     # Cancel elevator music if running
-    if hasattr(ctx.bot, 'elevator_task') and ctx.bot.elevator_task:
-        ctx.bot.elevator_task.cancel()
-        ctx.bot.elevator_task = None
-    if hasattr(ctx.bot, 'disconnect_task') and ctx.bot.disconnect_task:
-        ctx.bot.disconnect_task.cancel()
-        ctx.bot.disconnect_task = None
+    stop_elevator(ctx.guild.id)
+    # Music is starting (or the guild goes idle again below); drop any pending idle disconnect
+    voice_sessions.cancel_idle(ctx.guild.id)
     if queue:
         ctx.bot.is_playing_flag[ctx.guild.id] = True
         ctx.bot.loop.create_task(play_next_with_delay(ctx))
-        # Cancel disconnect timer if music starts
-        if hasattr(ctx.bot, 'disconnect_task') and ctx.bot.disconnect_task:
-            ctx.bot.disconnect_task.cancel()
-            ctx.bot.disconnect_task = None
     else:
-        now_playing[ctx.guild.id] = None
+        set_now_playing(ctx.guild.id, None)
         ctx.bot.is_playing_flag[ctx.guild.id] = False
         # Only start elevator music if enabled, not prevented, and nothing is playing
         if is_elevator_enabled(ctx) and not getattr(ctx.bot, 'prevent_fallback', False):
             if ctx.voice_client and not ctx.voice_client.is_playing():
-                ctx.bot.elevator_task = ctx.bot.loop.create_task(play_elevator_music(ctx))
+                schedule_fallback(ctx, announce=True)
         else:
-            ctx.bot.disconnect_task = ctx.bot.loop.create_task(disconnect_after_timeout(ctx, 300))
+            # Stay connected for the grace period so the next !play skips the voice handshake
+            voice_sessions.release(ctx.guild)
+
+# --- Per-guild admission control ---
+
+class GuildRateLimited(commands.CheckFailure):
+    def __init__(self, rejection):
+        self.retry_after = rejection.retry_after
+        super().__init__(str(rejection))
+
+@bot.check
+async def guild_admission_check(ctx):
+    if ctx.guild is None:
+        return True
+    try:
+        admission.check_rate(ctx.guild.id)
+    except AdmissionRejected as e:
+        raise GuildRateLimited(e)
+    return True
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, GuildRateLimited):
+        await ctx.send(f"⏳ This server is sending commands too quickly. Please try again in {max(1, round(error.retry_after))}s.")
+        return
+    # Keep discord.py's default reporting for everything else
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+# --- Queue persistence and resume ---
+
+RESUME_VOICE = os.getenv('SONIX_RESUME_VOICE', '0') == '1'
+
+class ResumeContext:
+    """Minimal stand-in for commands.Context used to restart playback after a restart."""
+    def __init__(self, bot, guild, channel):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, *args, **kwargs):
+        if self.channel:
+            return await self.channel.send(*args, **kwargs)
+
+def queue_state_snapshot():
+    return {'queues': song_queues, 'now': now_playing, 'last': last_played}
+
+def restore_queue_state():
+    """
+    Rebuild queues from the journal. Only stored identity fields come back;
+    streams are resolved when each song is about to play.
+    """
+    state = queue_journal.load()
+    for gid, records in state['queues'].items():
+        songs = [restore_track(record) for record in records]
+        # The song that was interrupted goes back to the front of its queue
+        if state['now'].get(gid):
+            songs.insert(0, restore_track(state['now'][gid]))
+        if songs:
+            song_queues[gid] = GuildQueue(gid, queue_journal, songs, listener=api_bridge.queue_changed)
+    for gid, record in state['now'].items():
+        if record and gid not in state['queues']:
+            song_queues[gid] = GuildQueue(gid, queue_journal, [restore_track(record)], listener=api_bridge.queue_changed)
+    last_played.update({gid: restore_track(record) for gid, record in state['last'].items() if record})
+    queue_journal.open(queue_state_snapshot)
+    # Start from a fresh snapshot so the next restart replays only new mutations
+    queue_journal.compact()
+    restored = sum(len(q) for q in song_queues.values())
+    logging.getLogger("sonix_playback").info(f"[Sonix] Restored {restored} queued songs across {len(song_queues)} guilds.")
+
+async def resume_voice_sessions():
+    for gid, voice_state in list(queue_journal.voice.items()):
+        guild = bot.get_guild(gid)
+        channel = guild.get_channel(voice_state['channel']) if guild else None
+        if not channel or guild.voice_client:
+            continue
+        text_channel = guild.get_channel(voice_state['text']) if voice_state.get('text') else None
+        try:
+            await voice_sessions.ensure(channel)
+        except Exception as e:
+            logging.getLogger("sonix_playback").error(f"[Sonix] Could not rejoin {channel} in {guild.name}: {e}")
+            continue
+        if text_channel:
+            setattr(bot, f'last_text_channel_{gid}', text_channel)
+        if song_queues.get(gid):
+            play_next(ResumeContext(bot, guild, text_channel))
+
+async def resume_after_reconnect(guild):
+    """Restart the queue after voice_sessions rejoined a dropped channel."""
+    voice = guild.voice_client
+    if voice and (voice.is_playing() or voice.is_paused()):
+        return
+    if song_queues.get(guild.id):
+        play_next(ResumeContext(bot, guild, getattr(bot, f'last_text_channel_{guild.id}', None)))
+
+voice_sessions.on_reconnected = resume_after_reconnect
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user}')
-    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("sonix_playback").info(f"[Sonix] Logged in as {bot.user}")
+    # Voice stutters when the loop is held; this measures by how long and where
+    loop_watchdog.start()
+    # Keeps latency and circuit-breaker state fresh for every configured Invidious instance
+    invidious_pool.start_health_checks()
+    # Picks up a rotated cookie file and writes back cookies YouTube refreshed
+    cookies.start()
+    # Pick up files added to the library since the index was written
+    if library.enabled and library.scanned_at is None:
+        asyncio.get_running_loop().run_in_executor(None, library.scan)
+    if api_bridge.API_MODE == 'process' and getattr(bot, 'api_bridge', None) is None:
+        start_api_process(bot)
+    # on_ready fires again after gateway reconnects; only resume once
+    if RESUME_VOICE and not getattr(bot, 'voice_resumed', False):
+        bot.voice_resumed = True
+        await resume_voice_sessions()
 
 # This is where music commands will go
 
@@ -582,8 +1255,13 @@ async def join(ctx):
     if ctx.author.voice:
         channel = ctx.author.voice.channel
         try:
-            await channel.connect()
-            embed = discord.Embed(title="🔊 Joined Voice Channel", description=f"Joined **{channel}**!", color=discord.Color.blurple())
+            previous = ctx.voice_client.channel if ctx.voice_client else None
+            # Moves an existing connection instead of reconnecting
+            await voice_sessions.ensure(channel)
+            if previous and previous != channel:
+                embed = discord.Embed(title="🔊 Moved Voice Channel", description=f"Moved from **{previous}** to **{channel}**!", color=discord.Color.blurple())
+            else:
+                embed = discord.Embed(title="🔊 Joined Voice Channel", description=f"Joined **{channel}**!", color=discord.Color.blurple())
             await ctx.send(embed=embed)
         except Exception as e:
             logger.error(f"[DEBUG] Failed to join voice channel: {e}")
@@ -596,21 +1274,34 @@ async def join(ctx):
 @bot.command(aliases=["m!p", "p"])
 async def play(ctx, *, query):
     """
-    Adds a song or Spotify track/album/playlist to the queue or plays if nothing is playing.
+    Adds a song, YouTube playlist or Spotify track/album/playlist to the queue or plays if nothing is playing.
     Usage: !play <song name or URL>
     """
+    # Cap concurrent resolutions per guild so one guild cannot fill the pools
+    try:
+        admission.acquire_resolution(ctx.guild.id)
+    except AdmissionRejected:
+        await ctx.send("⏳ I'm still looking up your previous requests. Please wait a moment before adding more.")
+        return
+    try:
+        with start_trace('!play', ctx.guild.id, query=query):
+            await handle_play(ctx, query)
+    finally:
+        admission.release_resolution(ctx.guild.id)
+
+async def handle_play(ctx, query):
     import logging
     logger = logging.getLogger("sonix_debug")
     queue = get_queue(ctx)
-    await ctx.send("[DEBUG] Play command called.")
+    outbox.line(ctx.channel, "[DEBUG] Play command called.")
     logger.info("[DEBUG] Play command called.")
     # Check if user is in a voice channel and join if not already connected
     if ctx.voice_client is None:
         if ctx.author.voice and ctx.author.voice.channel:
-            await ctx.send("[DEBUG] Joining your voice channel...")
+            outbox.line(ctx.channel, "[DEBUG] Joining your voice channel...")
             try:
-                await ctx.author.voice.channel.connect()
-                await ctx.send(f"[DEBUG] Joined voice channel: {ctx.author.voice.channel}")
+                await voice_sessions.ensure(ctx.author.voice.channel)
+                outbox.line(ctx.channel, f"[DEBUG] Joined voice channel: {ctx.author.voice.channel}")
             except Exception as e:
                 await ctx.send(f"❌ Failed to join voice channel: `{e}`")
                 import logging
@@ -619,34 +1310,34 @@ async def play(ctx, *, query):
         else:
             await ctx.send("You are not in a voice channel.")
             return
+    # YouTube playlists stream into the queue instead of resolving one song
+    if is_playlist_url(query):
+        await ingest_playlist(ctx, query)
+        return
+    if is_soundcloud_set(query):
+        await ingest_playlist(ctx, query, soundcloud.iter_set(query))
+        return
     # Check if query is a Spotify link
     spotify_pattern = r"https://open\.spotify\.com/(track|album|playlist)/([a-zA-Z0-9]+)"
     match = re.match(spotify_pattern, query)
     # Determine if the bot is already playing or paused
     is_playing = ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused())
 
-    await ctx.send(f"[DEBUG] Fetching metadata for query: {query}")
+    outbox.line(ctx.channel, f"[DEBUG] Fetching metadata for query: {query}")
     logger.info(f"[DEBUG] Fetching metadata for query: {query}")
     try:
-        song = await fetch_song_metadata(query)
+        song = await fetch_song_metadata(query, ctx.guild.id)
     except Exception as e:
-        await ctx.send(f"[DEBUG] Exception during metadata fetch: {e}")
+        outbox.line(ctx.channel, f"[DEBUG] Exception during metadata fetch: {e}")
         logger.error(f"[DEBUG] Exception during metadata fetch: {e}")
         song = None
     if not song:
-        await ctx.send(f"[DEBUG] Metadata fetch failed for query: {query}")
+        outbox.line(ctx.channel, f"[DEBUG] Metadata fetch failed for query: {query}")
         logger.error(f"[DEBUG] Metadata fetch failed for query: {query}")
         embed = discord.Embed(title="❌ Error", description="Could not find song metadata.", color=discord.Color.red())
         await ctx.send(embed=embed)
         return
 
-
-    async def fetch_multiple_song_metadata(queries):
-        # Helper to fetch metadata for a list of queries in parallel
-        results = await asyncio.gather(*(fetch_song_metadata(q) for q in queries))
-        # Filter out None (failed) results
-        return [song for song in results if song is not None]
-
     if match:
         # Set up Spotify API
         client_id = os.getenv('SPOTIPY_CLIENT_ID')
@@ -661,18 +1352,18 @@ async def play(ctx, *, query):
             if link_type == 'track':
                 track = sp.track(spotify_id)
                 search_query = f"{track['name']} {track['artists'][0]['name']}"
-                song = await fetch_song_metadata(search_query)
+                song = await fetch_song_metadata(search_query, ctx.guild.id)
                 queue.append(song)
                 if is_playing:
-                    embed = discord.Embed(title="🟢 Added from Spotify", description=f"**{song['title']}**", color=discord.Color.green())
-                    if song['thumbnail']:
-                        embed.set_thumbnail(url=song['thumbnail'])
+                    embed = discord.Embed(title="🟢 Added from Spotify", description=f"**{song.title}**", color=discord.Color.green())
+                    if song.thumbnail:
+                        embed.set_thumbnail(url=song.thumbnail)
                     await ctx.send(embed=embed)
             elif link_type == 'album':
                 album = sp.album(spotify_id)
                 tracks = album['tracks']['items']
                 queries = [f"{t['name']} {t['artists'][0]['name']}" for t in tracks]
-                songs = await fetch_multiple_song_metadata(queries)
+                songs = await fetch_multiple_song_metadata(queries, ctx.guild.id, BULK)
                 if songs:
                     queue.extend(songs)
                     if is_playing:
@@ -689,7 +1380,7 @@ async def play(ctx, *, query):
                     t = item['track']
                     if t is not None:
                         queries.append(f"{t['name']} {t['artists'][0]['name']}")
-                songs = await fetch_multiple_song_metadata(queries)
+                songs = await fetch_multiple_song_metadata(queries, ctx.guild.id, BULK)
                 if songs:
                     queue.extend(songs)
                     if is_playing:
@@ -703,49 +1394,34 @@ async def play(ctx, *, query):
             await ctx.send(embed=embed)
             return
     else:
-        # Always fetch metadata and store as song object
-        song = await fetch_song_metadata(query)
-        queue.append(song)
-        if is_playing:
-            embed = discord.Embed(title="➕ Added to Queue", description=f"**[{song['title']}]({song['webpage_url']})**", color=discord.Color.blurple())
-            if song['thumbnail']:
-                embed.set_thumbnail(url=song['thumbnail'])
-            await ctx.send(embed=embed)
-    # Check if the bot is already playing audio
-    if ctx.voice_client and ctx.voice_client.is_playing():
-        # Only add to queue if not already in queue
-        song = await fetch_song_metadata(query)
-        queue = get_queue(ctx)
-        if song and song not in queue:
-            add_to_queue(ctx, song)
-            embed = discord.Embed(title="➕ Added to Queue", description=f"**[{song['title']}]({song['webpage_url']})**", color=discord.Color.blurple())
-            if song['thumbnail']:
-                embed.set_thumbnail(url=song['thumbnail'])
-            await ctx.send(embed=embed)
-        elif song:
-            embed = discord.Embed(title="⚠️ Already Queued", description=f"**[{song['title']}]({song['webpage_url']})** is already in the queue.", color=discord.Color.orange())
+        # The song resolved above is the one to queue; O(1) lookup in the queue's video-ID index
+        if is_playing and queue.has_track(song):
+            embed = discord.Embed(title="⚠️ Already Queued", description=f"**[{song.title}]({song.webpage_url})** is already in the queue.", color=discord.Color.orange())
             await ctx.send(embed=embed)
-        else:
-            embed = discord.Embed(title="❌ Error", description="Could not find song metadata.", color=discord.Color.red())
+            return
+        add_to_queue(ctx, song)
+        if is_playing:
+            embed = discord.Embed(title="➕ Added to Queue", description=song_link(song), color=discord.Color.blurple())
+            if song.thumbnail:
+                embed.set_thumbnail(url=song.thumbnail)
             await ctx.send(embed=embed)
+    # Already playing: the queue picks it up when the current track ends
+    if is_playing:
         return
-    # If nothing is playing, add to queue and start playback
-    song = await fetch_song_metadata(query)
-    if not song:
-        embed = discord.Embed(title="❌ Error", description="Could not find song metadata.", color=discord.Color.red())
-        await ctx.send(embed=embed)
+    # Nothing is playing: start playback with the head of the queue
+    if not queue:
         return
-    add_to_queue(ctx, song)
+    song = queue[0]
     if ctx.voice_client is None:
         if ctx.author.voice:
-            await ctx.author.voice.channel.connect()
+            await voice_sessions.ensure(ctx.author.voice.channel)
         else:
             await ctx.send("You are not in a voice channel.")
             return
     play_next(ctx)
-    embed = discord.Embed(title="🎶 Now Playing", description=f"**[{song['title']}]({song['webpage_url']})**", color=discord.Color.green())
-    if song['thumbnail']:
-        embed.set_thumbnail(url=song['thumbnail'])
+    embed = discord.Embed(title="🎶 Now Playing", description=f"**[{song.title}]({song.webpage_url})**", color=discord.Color.green())
+    if song.thumbnail:
+        embed.set_thumbnail(url=song.thumbnail)
     await ctx.send(embed=embed)
 
 
@@ -757,6 +1433,7 @@ async def pause(ctx):
     """Pauses the current song."""
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
+        api_bridge.mark_changed(ctx.guild.id)
         embed = discord.Embed(title="⏸️ Paused", description="Paused the music.", color=discord.Color.blurple())
         await ctx.send(embed=embed)
     else:
@@ -768,6 +1445,7 @@ async def resume(ctx):
     """Resumes the paused song."""
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
+        api_bridge.mark_changed(ctx.guild.id)
         embed = discord.Embed(title="▶️ Resumed", description="Resumed the music.", color=discord.Color.blurple())
         await ctx.send(embed=embed)
     else:
@@ -777,19 +1455,111 @@ async def resume(ctx):
 @bot.command(aliases=["m!s", "s"])
 async def skip(ctx):
     """Skips the current song and plays the next in queue."""
+    mixer = active_mixers.get(ctx.guild.id)
+    if ctx.voice_client and mixer is not None and ctx.voice_client.source is mixer and mixer.skip():
+        # The next track was already open in the mixer; it takes over without a restart
+        await ctx.send("Skipped the song.")
+        return
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.stop()
         # Immediately clear playback flag and now_playing state to prevent race conditions
         if hasattr(ctx.bot, 'is_playing_flag'):
             ctx.bot.is_playing_flag[ctx.guild.id] = False
-        now_playing[ctx.guild.id] = None
+        set_now_playing(ctx.guild.id, None)
         await ctx.send("Skipped the song.")
     else:
         await ctx.send("Nothing is playing to skip.")
 
+def playback_position(guild_id):
+    """Seconds into the guild's current track, or None if no music source is on the player."""
+    guild = bot.get_guild(guild_id)
+    voice = guild.voice_client if guild else None
+    source = voice.source if voice else None
+    return getattr(source, 'position', None)
+
+async def seek_playback(guild, target):
+    """
+    Restart the current track `target` seconds in by reopening ffmpeg on its
+    stream URL with an input-side seek; the queue and player are untouched.
+    Returns the new position, or None if nothing seekable is playing.
+    """
+    voice = guild.voice_client
+    source = voice.source if voice else None
+    if getattr(source, 'position', None) is None:
+        return None
+    mixer = active_mixers.get(guild.id)
+    song = mixer.current_track if source is mixer else now_playing.get(guild.id)
+    if not isinstance(song, Track):
+        return None
+    target = max(0.0, float(target))
+    if song.duration:
+        target = min(target, max(0.0, song.duration - 1))
+    # Normally the cached stream URL is reused; only an expired one is resolved again
+    if not song.has_stream():
+        if not await resolve_song_stream(guild.id, song) or voice.source is not source:
+            return None
+    if source is mixer:
+        mixer.seek(open_pcm_source(song, target), target)
+    else:
+        # Swapping the player's source does not fire its `after`, so play_next is not triggered
+        opened = open_direct_source(song, target) if library_direct(guild.id, song) else open_opus_source(song, guild.id, target)
+        voice.source = PositionedSource(opened, target)
+        playing_sources[guild.id] = voice.source
+        source.cleanup()
+    api_bridge.mark_changed(guild.id)
+    return target
+
+def parse_timestamp(value):
+    """'90', '1:30' or '1:02:03' -> seconds."""
+    seconds = 0.0
+    for part in str(value).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+async def send_seek_result(ctx, position, title):
+    if position is None:
+        embed = discord.Embed(title="❌ Error", description="Nothing is playing.", color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+    song = now_playing.get(ctx.guild.id)
+    total = f" / {format_timestamp(song.duration)}" if isinstance(song, Track) and song.duration else ""
+    embed = discord.Embed(title=title, description=f"Now at **{format_timestamp(position)}**{total}.", color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def seek(ctx, position: str):
+    """Jumps to a position in the current song, e.g. !seek 1:30 or !seek 90."""
+    try:
+        target = parse_timestamp(position)
+    except ValueError:
+        await ctx.send("Usage: !seek <seconds | m:ss | h:mm:ss>")
+        return
+    await send_seek_result(ctx, await seek_playback(ctx.guild, target), "⏩ Seeked")
+
+@bot.command(aliases=["ff", "fwd"])
+async def forward(ctx, seconds: float = 10):
+    """Skips ahead in the current song (default 10 seconds)."""
+    position = playback_position(ctx.guild.id)
+    await send_seek_result(ctx, await seek_playback(ctx.guild, position + seconds) if position is not None else None, "⏩ Forward")
+
+@bot.command(aliases=["rw", "rew"])
+async def rewind(ctx, seconds: float = 10):
+    """Goes back in the current song (default 10 seconds)."""
+    position = playback_position(ctx.guild.id)
+    await send_seek_result(ctx, await seek_playback(ctx.guild, position - seconds) if position is not None else None, "⏪ Rewind")
+
 @bot.command()
 async def replay(ctx):
-    """Replays the last played song (adds it to the front of the queue)."""
+    """Restarts the current song, or replays the last played one (adds it to the front of the queue)."""
+    # Restarting what is playing is a seek to 0, so nothing is resolved again
+    if await seek_playback(ctx.guild, 0) is not None:
+        await ctx.send("Replaying the current song!")
+        return
     if not hasattr(ctx.bot, 'last_query') or not ctx.bot.last_query:
         await ctx.send("No song to replay.")
         return
@@ -801,16 +1571,75 @@ async def replay(ctx):
 
 @bot.command(aliases=["m!st", "st"])
 async def stop(ctx):
-    """Stops the music, clears the queue, and leaves the voice channel."""
-    song_queues[ctx.guild.id] = []
+    """
+    Stops the music and clears the queue. The voice connection stays warm for a
+    while so the next !play starts instantly; use !leave to disconnect now.
+    """
+    get_queue(ctx).clear()
+    # Nothing queued is needed any more; free the workers for other guilds
+    extraction_scheduler.cancel(ctx.guild.id)
+    playlist_ingests.cancel(ctx.guild.id)
+    if ctx.voice_client:
+        if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
+            ctx.voice_client.stop()
+        voice_sessions.release(ctx.guild)
+        if is_elevator_enabled(ctx):
+            # The emptied queue hands over to elevator music, which keeps the connection
+            later = "Elevator music will play until something else is queued"
+        else:
+            later = f"I'll leave the channel in {max(1, round(voice_sessions.grace_seconds / 60))} min unless something else is played"
+        embed = discord.Embed(title="🛑 Stopped", description=f"Stopped the music and cleared the queue. {later}, or use `!leave` to disconnect now.", color=discord.Color.orange())
+        await ctx.send(embed=embed)
+    else:
+        embed = discord.Embed(title="❌ Error", description="I'm not in a voice channel.", color=discord.Color.red())
+        await ctx.send(embed=embed)
+
+@bot.command(aliases=["disconnect", "dc"])
+async def leave(ctx):
+    """Stops the music, clears the queue, and leaves the voice channel now."""
+    get_queue(ctx).clear()
+    extraction_scheduler.cancel(ctx.guild.id)
+    playlist_ingests.cancel(ctx.guild.id)
     if ctx.voice_client:
-        await ctx.voice_client.disconnect()
-        embed = discord.Embed(title="🛑 Stopped & Left", description="Stopped the music, cleared the queue, and left the channel.", color=discord.Color.orange())
+        await voice_sessions.disconnect(ctx.guild)
+        embed = discord.Embed(title="👋 Left", description="Stopped the music, cleared the queue, and left the channel.", color=discord.Color.orange())
         await ctx.send(embed=embed)
     else:
         embed = discord.Embed(title="❌ Error", description="I'm not in a voice channel.", color=discord.Color.red())
         await ctx.send(embed=embed)
 
+@bot.command()
+async def trace(ctx, which: str = 'last'):
+    """
+    Show a timing breakdown of the last traced !play / POST /play in this server.
+    Usage: !trace [last]
+    """
+    if which.lower() != 'last':
+        await ctx.send("Usage: `!trace [last]`")
+        return
+    recorded = last_trace(ctx.guild.id)
+    if not recorded:
+        await ctx.send("No traced requests in this server yet. Try `!play` first.")
+        return
+    lines = [f"{'start':>8} {'ms':>8}  span"]
+    for depth, offset, duration, name, attrs in recorded.breakdown():
+        took = f"{duration:8.1f}" if duration is not None else f"{'…':>8}"
+        lines.append(f"{offset:8.1f} {took}  {'  ' * depth}{name}")
+    body = "\n".join(lines)
+    # Embed descriptions are capped at 4096 characters
+    if len(body) > 3900:
+        body = body[:3900].rsplit("\n", 1)[0] + "\n…"
+    root = recorded.root
+    embed = discord.Embed(
+        title=f"⏱️ Trace: {root.name}",
+        description=f"```\n{body}\n```",
+        color=discord.Color.blurple(),
+    )
+    if root.attrs.get('query'):
+        embed.add_field(name="Query", value=str(root.attrs['query'])[:1024], inline=False)
+    embed.set_footer(text=f"Trace #{recorded.id} • Full trace in {TRACE_FILE} (Chrome trace format)")
+    await ctx.send(embed=embed)
+
 # Save last played query for replay
 @bot.listen('on_command')
 async def save_last_query(ctx):
@@ -818,67 +1647,137 @@ async def save_last_query(ctx):
         ctx.bot.last_query = ctx.kwargs.get('query')
 
 @bot.command(aliases=["m!q", "q"])
-async def queue(ctx):
-    """Shows the current song queue."""
+async def queue(ctx, page: int = 1):
+    """Shows the current song queue. Usage: !queue [page]"""
+    gid = ctx.guild.id
     queue = get_queue(ctx)
-    if not queue:
-        embed = discord.Embed(title="🎶 Song Queue", description="The queue is empty.", color=discord.Color.blurple())
+    embed = build_queue_embed(queue, page, now_playing.get(gid))
+    if page_count(len(queue)) <= 1:
         await ctx.send(embed=embed)
-    else:
-        async def get_metadata(q):
-            # Use the same process pool and cache as playback
-            cached = get_cached_ytdlp(q)
-            if cached:
-                _, title, info = cached
-            else:
-                ydl_opts = {
-                    'format': 'bestaudio',
-                    'noplaylist': True,
-                    'quiet': True,
-                    'outtmpl': 'song.%(ext)s',
-                }
-                loop = asyncio.get_running_loop()
-                try:
-                    audio_url, title, info = await loop.run_in_executor(
-                        process_pool, functools.partial(ytdlp_extract, q, ydl_opts)
-                    )
-                    set_cached_ytdlp(q, (audio_url, title, info))
-                except Exception:
-                    return q, q, None
-            title = info.get('title', q)
-            url = info.get('webpage_url', q)
-            thumbnail = info.get('thumbnail')
-            return title, url, thumbnail
-        fields = []
-        for i, q in enumerate(queue[:10]):
-            # Only fetch metadata for real URLs (http/https), never for search queries or ytsearchmusic: etc
-            if (
-                isinstance(q, str)
-                and q.startswith("http")
-                and not q.startswith("ytsearchmusic:")
-                and not q.startswith("ytsearch:")
-            ):
-                try:
-                    title, url, thumbnail = await get_metadata(q)
-                    fields.append((f"{i+1}.", f"[{title}]({url})", thumbnail))
-                except Exception as e:
-                    logging.getLogger("sonix_playback").error(f"Error fetching queue metadata: {e}")
-                    fields.append((f"{i+1}.", q, None))
-            else:
-                # Always treat non-URLs and search queries as plain text
-                fields.append((f"{i+1}.", q, None))
-        for idx, (name, value, thumbnail) in enumerate(fields):
-            embed.add_field(name=name, value=value, inline=False)
-            if idx == 0 and thumbnail:
-                embed.set_thumbnail(url=thumbnail)
-        if len(queue) > max_display:
-            embed.set_footer(text=f"...and {len(queue) - max_display} more in the queue!")
+        return
+    view = QueuePaginator(lambda: song_queues.get(gid, []), lambda: now_playing.get(gid), clamp_page(page, len(queue)))
+    view.message = await ctx.send(embed=embed, view=view)
+
+# --- Bulk queue editing ---
+
+# Most queries resolved by one !enqueue / POST /queue/add
+BULK_ENQUEUE_MAX = int(os.getenv('SONIX_BULK_ENQUEUE_MAX', '100'))
+
+async def enqueue_many(ctx, queries, allow_duplicates=False):
+    """
+    Resolve `queries` in parallel and add them to the queue as one mutation.
+    Returns (added, duplicates, failed) counts. Starts playback if idle.
+    """
+    queue = get_queue(ctx)
+    songs = await fetch_multiple_song_metadata(queries, ctx.guild.id, BULK)
+    failed = len(queries) - len(songs)
+    added = []
+    seen = set()
+    for song in songs:
+        key = track_key(song)
+        if not allow_duplicates and (queue.has_key(key) or key in seen):
+            continue
+        seen.add(key)
+        added.append(song)
+    queue.extend(added)
+    voice = ctx.voice_client
+    if added and voice and not (voice.is_playing() or voice.is_paused()):
+        play_next(ctx)
+    return len(added), len(songs) - len(added), failed
+
+def parse_queue_targets(tokens):
+    """
+    Split !remove arguments into 0-based indexes (from 1-based positions and
+    ranges like 3-7) and track keys (video IDs or URLs).
+    """
+    indexes, keys = [], []
+    for token in tokens:
+        m = re.fullmatch(r"(\d+)(?:-(\d+))?", token)
+        if m:
+            first = int(m.group(1))
+            last = int(m.group(2) or first)
+            indexes.extend(range(min(first, last) - 1, max(first, last)))
         else:
-            embed.set_footer(text=f"Total songs in queue: {len(queue)}")
-        await ctx.send(embed=embed)
+            keys.append(extract_video_id(token) or token)
+    return indexes, keys
+
+@bot.command(aliases=["add", "addmany"])
+async def enqueue(ctx, *, queries):
+    """
+    Add several songs at once, separated by |.
+    Usage: !enqueue <song/url> | <song/url> | ...
+    """
+    items = [q.strip() for q in queries.split("|") if q.strip()]
+    if not items:
+        await ctx.send("Usage: `!enqueue <song/url> | <song/url> | ...`")
+        return
+    if len(items) > BULK_ENQUEUE_MAX:
+        await ctx.send(f"❌ You can add at most {BULK_ENQUEUE_MAX} songs at once.")
+        return
+    if ctx.voice_client is None and ctx.author.voice:
+        await voice_sessions.ensure(ctx.author.voice.channel)
+    added, duplicates, failed = await enqueue_many(ctx, items)
+    description = f"Added **{added}** song(s) to the queue."
+    if duplicates:
+        description += f"\nSkipped {duplicates} already queued."
+    if failed:
+        description += f"\nCould not find {failed}."
+    embed = discord.Embed(title="➕ Added to Queue", description=description, color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(aliases=["rm"])
+async def remove(ctx, *targets):
+    """
+    Remove songs by queue position, range, or video ID/URL.
+    Usage: !remove <position|from-to|video id>...
+    """
+    if not targets:
+        await ctx.send("Usage: `!remove <position|from-to|video id>...`")
+        return
+    queue = get_queue(ctx)
+    indexes, keys = parse_queue_targets(targets)
+    removed = queue.remove_at(indexes)
+    removed += queue.remove_keys(keys)
+    if not removed:
+        embed = discord.Embed(title="❌ Nothing Removed", description="No queued songs matched.", color=discord.Color.red())
+    elif len(removed) == 1:
+        title, url, _ = song_summary(removed[0])
+        embed = discord.Embed(title="🗑️ Removed", description=f"**[{title}]({url})**" if url else f"**{title}**", color=discord.Color.orange())
+    else:
+        embed = discord.Embed(title="🗑️ Removed", description=f"Removed **{len(removed)}** songs from the queue.", color=discord.Color.orange())
+    await ctx.send(embed=embed)
+
+@bot.command(aliases=["mv"])
+async def move(ctx, source: int, destination: int):
+    """Move a queued song to another position. Usage: !move <from> <to>"""
+    queue = get_queue(ctx)
+    try:
+        queue.move(source - 1, destination - 1)
+    except IndexError:
+        await ctx.send(f"❌ Positions must be between 1 and {len(queue)}.")
+        return
+    title, url, _ = song_summary(queue[destination - 1])
+    embed = discord.Embed(title="↕️ Moved", description=f"**{title}** is now at position {destination}.", color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def shuffle(ctx):
+    """Shuffle the upcoming songs."""
+    queue = get_queue(ctx)
+    queue.shuffle()
+    await ctx.send(f"🔀 Shuffled {len(queue)} songs.")
+
+@bot.command()
+async def clear(ctx):
+    """Clear the upcoming songs without stopping the current one."""
+    queue = get_queue(ctx)
+    count = len(queue)
+    queue.clear()
+    playlist_ingests.cancel(ctx.guild.id)
+    await ctx.send(f"🧹 Cleared {count} songs from the queue.")
 
 # The official help command is now !sonixhelp (with aliases), see above.
-# All blocking yt-dlp calls in queue and play_song use asyncio.to_thread to avoid lag.
+# All blocking yt-dlp calls go through extraction_scheduler so interactive plays are never stuck behind background work.
 
 # --- Track Last Command Channel ---
 
@@ -894,73 +1793,334 @@ async def on_voice_state_update(member, before, after):
     # Only act if this is the bot itself
     if member.id != bot.user.id:
         return
+    # Joined, left, moved or muted: the API's voice state is stale
+    api_bridge.mark_changed(member.guild.id)
     # Find the last used text channel for this guild
     channel = getattr(bot, f'last_text_channel_{member.guild.id}', None)
+    # Remember which voice channel to rejoin after a restart
+    if before.channel != after.channel:
+        queue_journal.record_voice(member.guild.id, after.channel.id if after.channel else None, channel.id if channel else None)
     # 1. Pause music if server muted (not deafened), unpause if unmuted
     voice = discord.utils.get(bot.voice_clients, guild=member.guild)
     # If server muted (not deafened), pause
     if (after.self_mute or after.mute) and after.channel is not None:
         if voice and voice.is_playing():
             voice.pause()
+            api_bridge.mark_changed(member.guild.id)
         if channel:
             embed = discord.Embed(
                 title="🔇 Server Muted",
                 description="I have been server muted and paused playback. Unmute me to resume music.",
                 color=discord.Color.orange()
             )
-            await channel.send(embed=embed)
+            # Rapid mute/unmute toggles only post the state they settle on
+            outbox.status(channel, 'voice-mute', embed=embed)
     # If unmuted (was previously muted), unpause
     elif (before.self_mute or before.mute) and not (after.self_mute or after.mute):
         if voice and voice.is_paused():
             voice.resume()
+            api_bridge.mark_changed(member.guild.id)
         if channel:
             embed = discord.Embed(
                 title="🔊 Server Unmuted",
                 description="I am no longer server muted and have resumed playback.",
                 color=discord.Color.green()
             )
-            await channel.send(embed=embed)
+            outbox.status(channel, 'voice-mute', embed=embed)
     # Do nothing on deafened/undeafened
-    # 2. On disconnect, clear queue and prevent fallback music
+    # 2. On disconnect, keep the queue; rejoin in the background if the drop was not ours
     if before.channel and not after.channel:
-        # Clear the queue for this guild
-        if hasattr(bot, 'queues') and member.guild.id in bot.queues:
-            bot.queues[member.guild.id].clear()
-        # Cancel any elevator/done/disconnect tasks
-        if hasattr(bot, 'elevator_task') and bot.elevator_task:
-            bot.elevator_task.cancel()
-            bot.elevator_task = None
-        if hasattr(bot, 'disconnect_task') and bot.disconnect_task:
-            bot.disconnect_task.cancel()
-            bot.disconnect_task = None
+        gid = member.guild.id
+        # Cancel any pending elevator/done fallback
+        stop_elevator(gid)
+        voice_sessions.cancel_idle(gid)
+        if not voice_sessions.left_on_purpose(gid) and (song_queues.get(gid) or now_playing.get(gid)):
+            # The interrupted song goes back to the front and continues from where it was cut off
+            if now_playing.get(gid):
+                position = getattr(playing_sources.get(gid), 'position', None)
+                if position and isinstance(now_playing[gid], Track):
+                    resume_positions[gid] = (now_playing[gid], position)
+                get_guild_queue(gid).insert(0, now_playing[gid])
+                set_now_playing(gid, None)
+            voice_sessions.reconnect_later(before.channel)
+            if channel:
+                embed = discord.Embed(
+                    title="📡 Voice Connection Lost",
+                    description="I lost my voice connection and am reconnecting. Your queue has been kept.",
+                    color=discord.Color.orange()
+                )
+                await channel.send(embed=embed)
+            return
         # Set a flag to prevent fallback music
         bot.prevent_fallback = True
         if channel:
             embed = discord.Embed(
                 title="👋 Disconnected from Voice",
-                description="I have been disconnected from voice and cleared the queue.",
+                description="I have been disconnected from voice.",
                 color=discord.Color.red()
             )
             await channel.send(embed=embed)
     else:
         bot.prevent_fallback = False
 
-# In your play_next and disconnect logic, check bot.prevent_fallback before playing elevator/done music
-# Example modification for play_next:
-# if is_elevator_enabled(ctx) and not getattr(ctx.bot, 'prevent_fallback', False):
-#    ctx.bot.elevator_task = ctx.bot.loop.create_task(play_elevator_music(ctx))
-
 # --- Web API Integration: Start FastAPI in a background thread ---
+# --- HTTP API: bot-side state and commands ---
+# api.py reads guild state through api_bridge and sends every change as a named
+# command. In thread mode the commands are scheduled on this loop directly; in
+# process mode they arrive over the bridge socket from the uvicorn workers.
+
+# guild_id -> wall time the current track would have started at, given its position
+position_anchors = {}
+
+def api_position(guild_id, voice):
+    """
+    Playback position for the API as {'seconds': s} while paused or
+    {'started_at': t} while playing, so the API can compute it at request
+    time. The anchor only moves when playback really jumps (seek, stall),
+    which keeps the snapshot unchanged between bridge publishes.
+    """
+    position = playback_position(guild_id)
+    if position is None:
+        position_anchors.pop(guild_id, None)
+        return None
+    if voice.is_paused():
+        return {'seconds': round(position, 2)}
+    anchor = time.time() - position
+    previous = position_anchors.get(guild_id)
+    if previous is not None and abs(previous - anchor) < 0.25:
+        anchor = previous
+    position_anchors[guild_id] = anchor
+    return {'started_at': anchor}
+
+def api_guild_snapshot(guild_id):
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        return None
+    voice = guild.voice_client
+    song = now_playing.get(guild_id)
+    if song is not None and (isinstance(song, str) or not song.title):
+        song = None
+    return {
+        'id': guild.id,
+        'name': guild.name,
+        'voice_channels': [{'id': c.id, 'name': c.name} for c in guild.voice_channels],
+        'text_channels': [{'id': c.id, 'name': c.name} for c in guild.text_channels],
+        'voice': {'channel_id': voice.channel.id, 'playing': voice.is_playing(), 'paused': voice.is_paused()} if voice else None,
+        'now_playing': {'title': song.title, 'url': song.webpage_url, 'thumbnail': song.thumbnail, 'duration': song.duration} if song else None,
+        'position': api_position(guild_id, voice) if song and voice else None,
+        'volume': get_guild_volume(guild_id),
+        'normalize': is_normalize_enabled(guild_id),
+    }
+
+api_bridge.provide_state(api_guild_snapshot, lambda guild_id: song_queues.get(guild_id, []), lambda: [g.id for g in bot.guilds])
+
+def api_guild(guild_id, channel_id=None):
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        raise CommandError(404, "Guild not found")
+    if channel_id is None:
+        return guild, None
+    channel = guild.get_channel(channel_id)
+    if channel is None:
+        raise CommandError(404, "Guild or channel not found")
+    return guild, channel
+
+def api_acquire_resolution(guild_id):
+    # Concurrent resolutions are capped here, in the bot, so the cap holds across API workers
+    try:
+        admission.acquire_resolution(guild_id)
+    except AdmissionRejected:
+        raise CommandError(429, "Too many songs being resolved for this guild", retry_after=1)
+
+async def api_join(channel):
+    voice = channel.guild.voice_client
+    if not voice or voice.channel != channel:
+        # Moves an existing connection rather than opening a second one
+        await voice_sessions.ensure(channel)
+
+@api_bridge.command('play')
+async def api_play(guild_id, channel_id, query):
+    guild, channel = api_guild(guild_id, channel_id)
+    api_acquire_resolution(guild_id)
+    try:
+        with start_trace('POST /play', guild_id, query=query):
+            await api_join(channel)
+            # Echoes of back-to-back web plays share one message; any of them works as the context
+            message = await outbox.line(channel, f"Web: Play command received! {query}")
+            if message is None:
+                raise CommandError(502, "Could not post to the text channel")
+            with span('get_context'):
+                ctx = await bot.get_context(message)
+            with span('play_song'):
+                await play_song(ctx, query)
+    finally:
+        admission.release_resolution(guild_id)
+    return {"status": "queued", "query": query}
+
+@api_bridge.command('pause')
+async def api_pause(guild_id):
+    guild = bot.get_guild(guild_id)
+    voice = guild.voice_client if guild else None
+    if voice and voice.is_playing():
+        voice.pause()
+        api_bridge.mark_changed(guild_id)
+        return {"status": "paused"}
+    return {"status": "not_playing"}
+
+@api_bridge.command('unpause')
+async def api_unpause(guild_id):
+    guild = bot.get_guild(guild_id)
+    voice = guild.voice_client if guild else None
+    if voice and voice.is_paused():
+        voice.resume()
+        api_bridge.mark_changed(guild_id)
+        return {"status": "resumed"}
+    return {"status": "not_paused"}
+
+@api_bridge.command('skip')
+async def api_skip(guild_id):
+    guild = bot.get_guild(guild_id)
+    voice = guild.voice_client if guild else None
+    mixer = active_mixers.get(guild_id)
+    if voice and mixer is not None and voice.source is mixer and mixer.skip():
+        # As in !skip: stopping the mixer would discard the next track it already took off the queue
+        return {"status": "skipped"}
+    if voice and voice.is_playing():
+        voice.stop()
+        return {"status": "skipped"}
+    return {"status": "not_playing"}
+
+@api_bridge.command('replay')
+async def api_replay(guild_id, channel_id):
+    guild, channel = api_guild(guild_id, channel_id)
+    message = await channel.send("Web: Replay command received!")
+    await replay(await bot.get_context(message))
+    return {"status": "replayed"}
+
+@api_bridge.command('seek')
+async def api_seek(guild_id, position, delta):
+    guild, _ = api_guild(guild_id)
+    if position is None:
+        current = playback_position(guild_id)
+        if current is None:
+            raise CommandError(409, "Nothing is playing")
+        position = current + (delta or 0)
+    target = await seek_playback(guild, position)
+    if target is None:
+        raise CommandError(409, "Nothing is playing")
+    return {"status": "ok", "position": target}
+
+@api_bridge.command('volume')
+async def api_volume(guild_id, volume, normalize):
+    guild, _ = api_guild(guild_id)
+    if volume is not None and not (isinstance(volume, int) and 0 <= volume <= MAX_VOLUME):
+        raise CommandError(400, f"volume must be an integer between 0 and {MAX_VOLUME}")
+    set_guild_volume(guild, volume, normalize)
+    return {"status": "ok", "volume": get_guild_volume(guild_id), "normalize": is_normalize_enabled(guild_id)}
+
+@api_bridge.command('queue_add')
+async def api_queue_add(guild_id, queries, channel_id, allow_duplicates):
+    guild, channel = api_guild(guild_id, channel_id)
+    if not queries or len(queries) > BULK_ENQUEUE_MAX:
+        raise CommandError(400, f"queries must contain 1 to {BULK_ENQUEUE_MAX} entries")
+    api_acquire_resolution(guild_id)
+    try:
+        if channel is not None:
+            await api_join(channel)
+        text_channel = getattr(bot, f'last_text_channel_{guild_id}', None)
+        added, duplicates, failed = await enqueue_many(ResumeContext(bot, guild, text_channel), queries, allow_duplicates)
+    finally:
+        admission.release_resolution(guild_id)
+    return {"status": "ok", "added": added, "duplicates": duplicates, "failed": failed, "total": len(get_guild_queue(guild_id))}
+
+@api_bridge.command('queue_remove')
+async def api_queue_remove(guild_id, indexes, ids):
+    api_guild(guild_id)
+    queue = get_guild_queue(guild_id)
+    keys = [extract_video_id(i) or i for i in ids]
+    removed = len(queue.remove_at(indexes)) + len(queue.remove_keys(keys))
+    return {"status": "ok", "removed": removed, "total": len(queue)}
+
+@api_bridge.command('queue_move')
+async def api_queue_move(guild_id, moves):
+    api_guild(guild_id)
+    queue = get_guild_queue(guild_id)
+    # Validate everything first so a bad pair leaves the queue untouched
+    if any(not (0 <= i < len(queue) and 0 <= j < len(queue)) for i, j in moves):
+        raise CommandError(400, "move index out of range")
+    for i, j in moves:
+        queue.move(i, j)
+    return {"status": "ok", "moved": len(moves), "total": len(queue)}
+
+@api_bridge.command('queue_shuffle')
+async def api_queue_shuffle(guild_id):
+    api_guild(guild_id)
+    queue = get_guild_queue(guild_id)
+    queue.shuffle()
+    return {"status": "ok", "total": len(queue)}
+
+@api_bridge.command('queue_clear')
+async def api_queue_clear(guild_id):
+    api_guild(guild_id)
+    queue = get_guild_queue(guild_id)
+    cleared = len(queue)
+    # A playlist still streaming in would refill the queue right after it is cleared
+    playlist_ingests.cancel(guild_id)
+    queue.clear()
+    return {"status": "ok", "cleared": cleared, "total": 0}
+
+@api_bridge.command('resolver_stats')
+async def api_resolver_stats():
+    return {"resolver": hedged_resolver.stats(), "invidious": invidious_pool.stats(), "soundcloud": soundcloud.stats(), "audio_cache": audio_cache.stats()}
+
+@api_bridge.command('loop_lag')
+async def api_loop_lag(sites):
+    return {"loop": loop_watchdog.stats(sites)}
+
 def start_api(bot):
     import threading
     import uvicorn
+    if api_bridge.API_MODE == 'process':
+        # Needs the running bot loop; started from on_ready
+        return
     import api
     api.set_bot(bot)
     def run():
-        uvicorn.run("api:app", host="0.0.0.0", port=8000, log_level="info")
+        # log_config=None keeps uvicorn on our queued JSON logging
+        uvicorn.run("api:app", host="0.0.0.0", port=8000, log_level="info", log_config=None)
     thread = threading.Thread(target=run, daemon=True)
     thread.start()
 
+def start_api_process(bot):
+    """
+    Run the API as its own multi-worker uvicorn process. Workers serve reads
+    from state the bot publishes over the bridge socket and forward changes as
+    commands, so dashboard traffic never competes with the bot for the GIL.
+    Called once from on_ready.
+    """
+    import sys
+    import subprocess
+    server = api_bridge.BridgeServer(asyncio.get_running_loop())
+    server.start()
+    env = dict(os.environ, SONIX_API_MODE='process', SONIX_API_IPC=os.path.abspath(server.address), SONIX_API_IPC_KEY=server.authkey.hex())
+    log_config = write_uvicorn_log_config(os.path.join(os.path.dirname(os.path.abspath(server.address)), 'uvicorn_log.json'))
+    bot.api_process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '0.0.0.0', '--port', '8000',
+         '--workers', str(api_bridge.API_WORKERS), '--log-level', 'info', '--log-config', log_config],
+        env=env,
+    )
+    bot.api_bridge = server
+
 if __name__ == '__main__':
+    setup_logging()
+    # Before the queues come back, so restored library tracks find their files
+    library.load()
+    audio_cache.load()
+    restore_queue_state()
     start_api(bot)
-    bot.run(TOKEN)
\ No newline at end of file
+    # log_handler=None stops discord.py from installing its own synchronous stderr handler
+    bot.run(TOKEN, log_handler=None)
+    if getattr(bot, 'api_process', None) is not None:
+        bot.api_process.terminate()
+    # Write back any refreshed cookies that have not been flushed yet
+    cookies.stop()
\ No newline at end of file
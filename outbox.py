@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+import discord
+
+# Discord allows 5 messages (edits included) per 5 s per channel. The outbox
+# keeps one slot free so direct command replies never queue behind a 429.
+OUTBOX_RATE = int(os.getenv('SONIX_OUTBOX_RATE', '4'))
+OUTBOX_PERIOD = float(os.getenv('SONIX_OUTBOX_PERIOD', '5'))
+# A progress message older than this is replaced by a new one instead of editing something far up the channel
+PROGRESS_REUSE_SECONDS = float(os.getenv('SONIX_PROGRESS_REUSE_SECONDS', '120'))
+MAX_MESSAGE_LENGTH = 2000
+# A failed request is tried this many times when Discord still answers 429
+SEND_ATTEMPTS = 3
+
+logger = logging.getLogger("sonix_debug")
+
+
+class _Item:
+    __slots__ = ('kind', 'key', 'content', 'embed', 'final', 'futures')
+
+    def __init__(self, kind, key=None, content=None, embed=None, final=False):
+        self.kind = kind
+        self.key = key
+        self.content = content
+        self.embed = embed
+        self.final = final
+        self.futures = []
+
+
+class _Channel:
+    __slots__ = ('channel', 'items', 'sent_at', 'blocked_until', 'progress', 'task')
+
+    def __init__(self, channel, rate):
+        self.channel = channel
+        self.items = deque()
+        # Times of the last `rate` requests, oldest first
+        self.sent_at = deque(maxlen=rate)
+        self.blocked_until = 0.0
+        self.progress = {}  # key -> (message, posted_at)
+        self.task = None
+
+
+class Outbox:
+    """
+    Paced, coalescing sender for the bot's chatty messages: debug lines,
+    progress counters, status notices and the web API's command echoes.
+    Each channel gets its own FIFO drained by one task that never exceeds
+    OUTBOX_RATE requests per OUTBOX_PERIOD. Pending work is merged while it
+    waits for a slot:
+
+    - line(): consecutive text lines become one message (up to 2000 chars)
+    - status(): a newer notice with the same key replaces an unsent one
+    - progress(): one message per key, edited in place; unsent updates collapse to the latest
+
+    Every call returns a future for the delivered discord.Message (None if
+    it could not be sent); awaiting it is optional. Must be used from the
+    bot's event loop.
+    """
+
+    def __init__(self, rate=OUTBOX_RATE, period=OUTBOX_PERIOD):
+        self.rate = rate
+        self.period = period
+        self._channels = {}
+        self.stats = {'messages': 0, 'edits': 0, 'coalesced': 0, 'rate_limited': 0, 'failed': 0}
+
+    def _state(self, channel):
+        state = self._channels.get(channel.id)
+        if state is None:
+            state = self._channels[channel.id] = _Channel(channel, self.rate)
+        return state
+
+    def _pending(self, state, kind, key):
+        for item in state.items:
+            if item.kind == kind and item.key == key:
+                return item
+        return None
+
+    def _join(self, item):
+        future = asyncio.get_running_loop().create_future()
+        item.futures.append(future)
+        return future
+
+    def _enqueue(self, channel, item):
+        state = self._state(channel)
+        future = self._join(item)
+        state.items.append(item)
+        if state.task is None:
+            state.task = asyncio.get_running_loop().create_task(self._drain(state))
+        return future
+
+    # --- public API ---
+
+    def send(self, channel, content=None, *, embed=None):
+        """A regular message, delivered in order with everything else queued for the channel."""
+        return self._enqueue(channel, _Item('send', content=content, embed=embed))
+
+    def line(self, channel, text):
+        """A short text line; lines queued back to back go out as one message."""
+        state = self._state(channel)
+        last = state.items[-1] if state.items else None
+        if last is not None and last.kind == 'line' and len(last.content) + len(text) + 1 <= MAX_MESSAGE_LENGTH:
+            last.content += '\n' + text
+            self.stats['coalesced'] += 1
+            return self._join(last)
+        return self._enqueue(channel, _Item('line', content=text[:MAX_MESSAGE_LENGTH]))
+
+    def status(self, channel, key, content=None, *, embed=None):
+        """A notice that only matters in its latest form, e.g. muted/unmuted."""
+        item = self._pending(self._state(channel), 'status', key)
+        if item is not None:
+            item.content, item.embed = content, embed
+            self.stats['coalesced'] += 1
+            return self._join(item)
+        return self._enqueue(channel, _Item('status', key, content, embed))
+
+    def progress(self, channel, key, content=None, *, embed=None, final=False):
+        """
+        Post or edit the channel's progress message for `key`. The final
+        update is applied and the key forgotten, so the next progress for it
+        starts a new message.
+        """
+        item = self._pending(self._state(channel), 'progress', key)
+        if item is not None:
+            item.content, item.embed = content, embed
+            item.final = item.final or final
+            self.stats['coalesced'] += 1
+            return self._join(item)
+        return self._enqueue(channel, _Item('progress', key, content, embed, final))
+
+    # --- delivery ---
+
+    async def _wait_turn(self, state):
+        now = time.monotonic()
+        wait = state.blocked_until - now
+        if len(state.sent_at) >= self.rate:
+            wait = max(wait, state.sent_at[0] + self.period - now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        state.sent_at.append(time.monotonic())
+
+    async def _drain(self, state):
+        try:
+            while state.items:
+                await self._wait_turn(state)
+                item = state.items.popleft()
+                message = await self._deliver(state, item)
+                for future in item.futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            state.task = None
+
+    async def _deliver(self, state, item):
+        for attempt in range(SEND_ATTEMPTS):
+            if attempt:
+                await self._wait_turn(state)
+            try:
+                if item.kind == 'progress':
+                    return await self._progress(state, item)
+                message = await state.channel.send(content=item.content, embed=item.embed)
+                self.stats['messages'] += 1
+                return message
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    logger.warning(f"[Outbox] Could not send to channel {state.channel.id}: {e}")
+                    break
+                # discord.py already retried; hold the whole channel back rather than just this message
+                retry_after = getattr(e, 'retry_after', None) or self.period
+                state.blocked_until = time.monotonic() + retry_after
+                self.stats['rate_limited'] += 1
+            except Exception as e:
+                logger.warning(f"[Outbox] Could not send to channel {state.channel.id}: {e}")
+                break
+        self.stats['failed'] += 1
+        return None
+
+    async def _progress(self, state, item):
+        now = time.monotonic()
+        message = None
+        entry = state.progress.get(item.key)
+        if entry is not None and now - entry[1] < PROGRESS_REUSE_SECONDS:
+            try:
+                message = await entry[0].edit(content=item.content, embed=item.embed) or entry[0]
+                self.stats['edits'] += 1
+            except discord.NotFound:
+                # Deleted by someone; post a fresh one below
+                await self._wait_turn(state)
+        if message is None:
+            message = await state.channel.send(content=item.content, embed=item.embed)
+            self.stats['messages'] += 1
+            entry = (message, now)
+        if item.final:
+            state.progress.pop(item.key, None)
+        else:
+            state.progress[item.key] = (message, entry[1])
+        return message
+
+
+# One pacer per bot process, shared by commands, background tasks and the web API
+outbox = Outbox()
@@ -0,0 +1,191 @@
+import os
+import re
+import asyncio
+import logging
+import functools
+import threading
+
+from track import Track
+from cookie_jar import youtube_dl
+from extraction_scheduler import extraction_scheduler, INTERACTIVE, BULK
+
+# Entries handed to the event loop per batch (the first entry is always sent on its own)
+PLAYLIST_PAGE_SIZE = int(os.getenv('SONIX_PLAYLIST_PAGE_SIZE', '100'))
+PLAYLIST_MAX_ENTRIES = int(os.getenv('SONIX_PLAYLIST_MAX_ENTRIES', '5000'))
+
+# youtube.com/playlist?list=..., music.youtube.com/playlist?list=... and music's browse/VL<id> pages
+_PLAYLIST_RE = re.compile(
+    r"https?://(?:www\.|m\.|music\.)?youtube\.com/(?:playlist\?(?:.*&)?list=|browse/VL)([\w-]+)"
+)
+
+# Flat extraction lists entries without touching their formats; streams are resolved when each one plays
+PLAYLIST_YDL_OPTS = {
+    'extract_flat': 'in_playlist',
+    'quiet': True,
+    'skip_download': True,
+}
+
+logger = logging.getLogger("sonix_playback")
+
+
+def playlist_id(url):
+    """The list ID of a YouTube / YouTube Music playlist URL, or None."""
+    m = _PLAYLIST_RE.match(url or '')
+    return m.group(1) if m else None
+
+
+def is_playlist_url(url):
+    return playlist_id(url) is not None
+
+
+def iter_playlist_tracks(url, ydl_opts=PLAYLIST_YDL_OPTS):
+    """
+    Yield a Track per playlist entry as yt-dlp pages through the playlist.
+    process=False keeps `entries` a lazy generator, so nothing but the current
+    continuation page and the Tracks already yielded is held in memory.
+    """
+    is_ytmusic = url.startswith(('https://music.', 'http://music.'))
+    with youtube_dl(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        # Music playlist pages may hand off to the regular playlist extractor
+        if info.get('_type') in ('url', 'url_transparent') and 'entries' not in info:
+            info = ydl.extract_info(info['url'], download=False, process=False)
+        for entry in info.get('entries') or ():
+            if not entry or not entry.get('id'):
+                continue
+            # Deleted and private videos are listed but cannot be played
+            if entry.get('title') in ('[Deleted video]', '[Private video]'):
+                continue
+            track = Track.from_info(entry, is_ytmusic=is_ytmusic)
+            if not track.webpage_url:
+                track.webpage_url = f"https://www.youtube.com/watch?v={track.id}"
+            yield track
+
+
+class PlaylistIngest:
+    """One playlist being streamed into a guild's queue."""
+
+    def __init__(self, guild_id, url):
+        self.guild_id = guild_id
+        self.url = url
+        self.queued = 0
+        self.stopped = threading.Event()
+        self.future = None
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def cancel(self):
+        self.stopped.set()
+
+
+class PlaylistIngestManager:
+    """
+    Streams playlist entries into guild queues. A YouTube listing runs as one
+    extraction job per page: the first page at INTERACTIVE priority, since a
+    user is waiting for playback to start, the rest as BULK, so the worker
+    slot is given back between pages. Other sources (SoundCloud sets) pass
+    an async iterator of pages instead. Each batch of Tracks is handed to
+    `on_page(ingest, tracks)` as soon as it is read, so the first entry can
+    start playing while later pages are still loading.
+    One ingest per guild: starting another or calling cancel() stops the
+    current one after its in-flight page. Must be used from the event loop.
+    """
+
+    def __init__(self, page_size=PLAYLIST_PAGE_SIZE, max_entries=PLAYLIST_MAX_ENTRIES):
+        self.page_size = page_size
+        self.max_entries = max_entries
+        self._active = {}
+
+    def active(self, guild_id):
+        ingest = self._active.get(guild_id)
+        return ingest if ingest is not None and not ingest.done else None
+
+    def cancel(self, guild_id):
+        ingest = self._active.pop(guild_id, None)
+        if ingest is None:
+            return False
+        ingest.cancel()
+        return True
+
+    def _read_page(self, loop, ingest, entries, on_page):
+        """
+        Read the next page of `entries` and hand it to the loop. Blocking; runs
+        on an extraction worker. Returns False once the listing is finished.
+        """
+        page = []
+
+        def flush():
+            tracks = page[:]
+            page.clear()
+            ingest.queued += len(tracks)
+            loop.call_soon_threadsafe(on_page, ingest, tracks)
+
+        limit = min(self.page_size, self.max_entries - ingest.queued)
+        read = 0
+        for track in entries:
+            if ingest.stopped.is_set():
+                return False
+            page.append(track)
+            read += 1
+            # First entry on its own so playback starts before the rest is listed
+            if ingest.queued == 0:
+                flush()
+            if read >= limit:
+                break
+        else:
+            if page:
+                flush()
+            return False
+        if page:
+            flush()
+        return ingest.queued < self.max_entries and not ingest.stopped.is_set()
+
+    async def _list(self, ingest, on_page):
+        loop = asyncio.get_running_loop()
+        # One generator across the page jobs; they run one after another, never concurrently
+        entries = iter_playlist_tracks(ingest.url)
+        priority = INTERACTIVE
+        while await extraction_scheduler.run(
+            priority, ingest.guild_id, functools.partial(self._read_page, loop, ingest, entries, on_page)
+        ):
+            priority = BULK
+        return ingest.queued
+
+    async def _drain(self, ingest, pages, on_page):
+        async for tracks in pages:
+            if ingest.stopped.is_set():
+                break
+            tracks = tracks[:self.max_entries - ingest.queued]
+            ingest.queued += len(tracks)
+            on_page(ingest, tracks)
+            if ingest.queued >= self.max_entries:
+                break
+        return ingest.queued
+
+    async def run(self, guild_id, url, on_page, pages=None):
+        """
+        List `url` and deliver its entries to `on_page` in batches. `pages`,
+        if given, is an async iterator of Track lists used instead of yt-dlp.
+        Returns the number of entries delivered; raises if the listing failed.
+        """
+        self.cancel(guild_id)
+        ingest = PlaylistIngest(guild_id, url)
+        self._active[guild_id] = ingest
+        loop = asyncio.get_running_loop()
+        if pages is not None:
+            ingest.future = loop.create_task(self._drain(ingest, pages, on_page))
+        else:
+            ingest.future = loop.create_task(self._list(ingest, on_page))
+        try:
+            queued = await ingest.future
+        finally:
+            if self._active.get(guild_id) is ingest:
+                del self._active[guild_id]
+        logger.info(f"[Sonix] Queued {queued} playlist entries for guild {guild_id} from {url}")
+        return queued
+
+
+# Shared by !play and POST /play
+playlist_ingests = PlaylistIngestManager()
@@ -0,0 +1,239 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from track import Track
+
+STATE_DIR = os.getenv('SONIX_STATE_DIR', 'sonix_state')
+# Rewrite the snapshot and truncate the journal after this many records
+JOURNAL_COMPACT_AFTER = int(os.getenv('SONIX_JOURNAL_COMPACT_AFTER', '5000'))
+
+
+def track_record(song):
+    # Only stable identity and display fields are persisted (Track.to_record);
+    # stream URLs expire and are resolved again just before a restored track plays.
+    # Plain query strings (e.g. from !replay) are stored as-is.
+    if song is None or isinstance(song, str):
+        return song
+    return song.to_record()
+
+
+def restore_track(record):
+    if isinstance(record, dict):
+        return Track.from_record(record)
+    return record
+
+
+class QueueJournal:
+    """
+    Append-only journal of queue mutations plus a periodic snapshot.
+    Each record carries a sequence number and the snapshot stores the last one
+    it includes, so a crash between writing the snapshot and truncating the
+    journal never replays a mutation twice.
+
+    record() and compact() only build dicts on the caller's thread (the bot
+    loop); serialising, writing and fsyncing happen in order on a writer
+    thread, so a large snapshot never stalls playback.
+    """
+
+    def __init__(self, state_dir=STATE_DIR, compact_after=JOURNAL_COMPACT_AFTER):
+        self.journal_path = os.path.join(state_dir, 'queue.journal')
+        self.snapshot_path = os.path.join(state_dir, 'queue.snapshot.json')
+        self.compact_after = compact_after
+        self.voice = {}  # {guild_id: {'channel': id, 'text': id}}
+        self._snapshot_source = None
+        self._file = None
+        self._seq = 0
+        self._records = 0
+        self._writes = None
+        self._writer = None
+
+    def open(self, snapshot_source):
+        """
+        Start journaling. `snapshot_source()` returns {'queues', 'now', 'last'}
+        for compaction.
+        """
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        self._snapshot_source = snapshot_source
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._writes = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name='sonix-queue-journal', daemon=True)
+        self._writer.start()
+        # Records still queued at exit are written before the process ends
+        atexit.register(self.close)
+
+    def close(self):
+        """Write out everything queued and stop the writer thread."""
+        if self._writer is None:
+            return
+        self._writes.put(None)
+        self._writer.join()
+        self._writer = None
+        self._file.close()
+        self._file = None
+
+    def record(self, op, guild_id, **fields):
+        if self._file is None:
+            return
+        self._seq += 1
+        entry = {'n': self._seq, 'op': op, 'g': guild_id}
+        if 'track' in fields:
+            entry['t'] = track_record(fields['track'])
+        if 'tracks' in fields:
+            entry['ts'] = [track_record(song) for song in fields['tracks']]
+        if 'index' in fields:
+            entry['i'] = fields['index']
+        if 'indexes' in fields:
+            entry['is'] = fields['indexes']
+        if 'to' in fields:
+            entry['j'] = fields['to']
+        if 'order' in fields:
+            entry['p'] = fields['order']
+        if op == 'now':
+            entry['t'] = track_record(fields.get('now'))
+            entry['l'] = track_record(fields.get('last'))
+        if op == 'voice':
+            entry['c'] = fields.get('channel')
+            entry['x'] = fields.get('text')
+            self._apply_voice(self.voice, guild_id, entry)
+        self._writes.put(('record', entry))
+        self._records += 1
+        if self._records >= self.compact_after:
+            self.compact()
+
+    def record_now(self, guild_id, now, last):
+        self.record('now', guild_id, now=now, last=last)
+
+    def record_voice(self, guild_id, channel_id, text_channel_id=None):
+        self.record('voice', guild_id, channel=channel_id, text=text_channel_id)
+
+    def compact(self):
+        if self._file is None or self._snapshot_source is None:
+            return
+        state = self._snapshot_source()
+        snapshot = {
+            'seq': self._seq,
+            'queues': {str(gid): [track_record(song) for song in songs] for gid, songs in state['queues'].items() if songs},
+            'now': {str(gid): track_record(song) for gid, song in state['now'].items() if song},
+            'last': {str(gid): track_record(song) for gid, song in state['last'].items() if song},
+            'voice': {str(gid): voice for gid, voice in self.voice.items()},
+        }
+        # Records made after this point are queued behind the snapshot and land in the new journal
+        self._writes.put(('snapshot', snapshot))
+        self._records = 0
+
+    # --- writer thread ---
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            # Everything queued meanwhile goes out with one flush
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    self._file.flush()
+                    return
+                kind, payload = item
+                try:
+                    if kind == 'record':
+                        self._file.write(json.dumps(payload, separators=(',', ':')) + '\n')
+                    else:
+                        self._write_snapshot(payload)
+                except (OSError, ValueError, TypeError) as e:
+                    logging.getLogger("sonix_playback").error(f"[Sonix] Could not write the queue journal: {e}")
+            try:
+                # Flushed to the OS per batch, so a process crash loses at most what was still queued
+                self._file.flush()
+            except OSError as e:
+                logging.getLogger("sonix_playback").error(f"[Sonix] Could not write the queue journal: {e}")
+
+    def _write_snapshot(self, snapshot):
+        self._file.flush()
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # The snapshot is durable; the journal can start over
+        self._file.close()
+        self._file = open(self.journal_path, 'w', encoding='utf-8')
+
+    @staticmethod
+    def _apply_voice(voice, guild_id, entry):
+        if entry.get('c'):
+            voice[guild_id] = {'channel': entry['c'], 'text': entry.get('x')}
+        else:
+            voice.pop(guild_id, None)
+
+    def load(self):
+        """
+        Rebuild state from the snapshot plus the journal tail. Returns
+        {'queues', 'now', 'last', 'voice'} keyed by int guild id.
+        """
+        state = {'queues': {}, 'now': {}, 'last': {}, 'voice': {}}
+        seq = 0
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                seq = snapshot.get('seq', 0)
+                for key in ('queues', 'now', 'last', 'voice'):
+                    state[key] = {int(gid): value for gid, value in snapshot.get(key, {}).items()}
+            except (OSError, ValueError) as e:
+                logging.getLogger("sonix_playback").error(f"[Sonix] Could not read queue snapshot: {e}")
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn final write from a crash
+                        break
+                    if entry['n'] <= seq:
+                        continue
+                    seq = entry['n']
+                    self._replay(state, entry)
+                    replayed += 1
+        self._seq = seq
+        self._records = replayed
+        self.voice = dict(state['voice'])
+        return state
+
+    def _replay(self, state, entry):
+        op, gid = entry['op'], entry['g']
+        queue = state['queues'].setdefault(gid, [])
+        if op == 'append':
+            queue.append(entry['t'])
+        elif op == 'extend':
+            queue.extend(entry['ts'])
+        elif op == 'insert':
+            queue.insert(entry['i'], entry['t'])
+        elif op == 'pop':
+            if -len(queue) <= entry['i'] < len(queue):
+                queue.pop(entry['i'])
+        elif op == 'clear':
+            queue.clear()
+        elif op == 'remove':
+            # Indexes are recorded in descending order
+            for i in entry['is']:
+                if 0 <= i < len(queue):
+                    queue.pop(i)
+        elif op == 'move':
+            if 0 <= entry['i'] < len(queue) and 0 <= entry['j'] < len(queue):
+                queue.insert(entry['j'], queue.pop(entry['i']))
+        elif op == 'shuffle':
+            if len(entry['p']) == len(queue):
+                queue[:] = [queue[i] for i in entry['p']]
+        elif op == 'now':
+            state['now'][gid] = entry.get('t')
+            state['last'][gid] = entry.get('l')
+        elif op == 'voice':
+            self._apply_voice(state['voice'], gid, entry)
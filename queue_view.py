@@ -0,0 +1,101 @@
+import discord
+
+QUEUE_PAGE_SIZE = 10
+API_QUEUE_MAX_LIMIT = 100
+
+
+def page_count(total, page_size=QUEUE_PAGE_SIZE):
+    return max(1, (total + page_size - 1) // page_size)
+
+
+def clamp_page(page, total, page_size=QUEUE_PAGE_SIZE):
+    return min(max(1, page), page_count(total, page_size))
+
+
+def song_summary(song):
+    """
+    Return (title, url, thumbnail) from stored queue metadata only. Queue entries
+    are Track records, or plain query strings (e.g. from !replay).
+    """
+    if isinstance(song, str):
+        return song, '', ''
+    title = song.title or song.query or 'Unknown title'
+    return title, song.webpage_url or '', song.thumbnail or ''
+
+
+def queue_slice(queue, offset, limit):
+    """
+    Return queue[offset:offset + limit] without touching the rest of the queue.
+    """
+    offset = max(0, offset)
+    return queue[offset:offset + max(0, limit)]
+
+
+def build_queue_embed(queue, page, now_song=None, page_size=QUEUE_PAGE_SIZE):
+    """
+    Render one page of the queue. Cost is O(page_size): no network calls and no
+    iteration over entries outside the page.
+    """
+    total = len(queue)
+    page = clamp_page(page, total, page_size)
+    embed = discord.Embed(title="🎶 Song Queue", color=discord.Color.blurple())
+    if now_song:
+        title, url, _ = song_summary(now_song)
+        embed.description = f"**Now playing:** [{title}]({url})" if url else f"**Now playing:** {title}"
+    if not total:
+        embed.description = (embed.description + "\n\n" if embed.description else "") + "The queue is empty."
+        return embed
+    start = (page - 1) * page_size
+    for i, song in enumerate(queue_slice(queue, start, page_size), start=start + 1):
+        title, url, thumbnail = song_summary(song)
+        # Embed field values are capped at 1024 characters
+        title = title if len(title) <= 200 else title[:197] + "..."
+        embed.add_field(name=f"{i}.", value=f"[{title}]({url})" if url else title, inline=False)
+        if i == start + 1 and thumbnail:
+            embed.set_thumbnail(url=thumbnail)
+    embed.set_footer(text=f"Page {page}/{page_count(total, page_size)} • Total songs in queue: {total}")
+    return embed
+
+
+class QueuePaginator(discord.ui.View):
+    """
+    Previous/next buttons under a !queue message. Each click re-renders the
+    requested page from the live queue.
+    """
+
+    def __init__(self, get_queue, get_now_playing, page, timeout=120):
+        super().__init__(timeout=timeout)
+        self.get_queue = get_queue
+        self.get_now_playing = get_now_playing
+        self.page = page
+        self.message = None
+        self._update_buttons()
+
+    def _update_buttons(self):
+        pages = page_count(len(self.get_queue()))
+        self.previous_page.disabled = self.page <= 1
+        self.next_page.disabled = self.page >= pages
+
+    async def _show(self, interaction):
+        queue = self.get_queue()
+        self.page = clamp_page(self.page, len(queue))
+        self._update_buttons()
+        embed = build_queue_embed(queue, self.page, self.get_now_playing())
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.page -= 1
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        self.page += 1
+        await self._show(interaction)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
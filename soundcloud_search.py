@@ -0,0 +1,268 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import aiohttp
+
+from track import Track
+
+SOUNDCLOUD_API = "https://api-v2.soundcloud.com"
+# Reuse a scraped client_id until the API rejects it; SOUNDCLOUD_CLIENT_ID skips the scrape
+SOUNDCLOUD_CLIENT_ID = os.getenv('SOUNDCLOUD_CLIENT_ID')
+SOUNDCLOUD_TIMEOUT = float(os.getenv('SOUNDCLOUD_TIMEOUT', '8'))
+SOUNDCLOUD_MAX_CONNECTIONS = int(os.getenv('SOUNDCLOUD_MAX_CONNECTIONS', '16'))
+# Search results and resolved track/set JSON change rarely; signed stream URLs expire quickly
+SOUNDCLOUD_SEARCH_TTL = float(os.getenv('SOUNDCLOUD_SEARCH_TTL', '600'))
+SOUNDCLOUD_RESOLVE_TTL = float(os.getenv('SOUNDCLOUD_RESOLVE_TTL', '1800'))
+SOUNDCLOUD_STREAM_TTL = float(os.getenv('SOUNDCLOUD_STREAM_TTL', '300'))
+SOUNDCLOUD_CACHE_SIZE = 512
+# /tracks?ids= accepts up to 50 IDs per call
+SOUNDCLOUD_SET_PAGE = 50
+
+# Prefix for `!play sc: <query>` searches
+SEARCH_PREFIX_RE = re.compile(r'^(?:sc|scsearch):\s*', re.IGNORECASE)
+_URL_RE = re.compile(r'https?://(?:(?:www\.|m\.)?soundcloud\.com/[\w-]+/[\w.-]+|on\.soundcloud\.com/\w+)')
+_SET_RE = re.compile(r'https?://(?:www\.|m\.)?soundcloud\.com/[\w-]+/sets/[\w.-]+')
+_SCRIPT_RE = re.compile(r'<script[^>]+src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"')
+_CLIENT_ID_RE = re.compile(r'client_id\s*[:=]\s*"(\w{32})"')
+_EXPIRES_RE = re.compile(r'[?&]Expires=(\d+)')
+
+logger = logging.getLogger("sonix_debug")
+
+
+class SoundCloudUnavailable(Exception):
+    """SoundCloud could not be reached or no working client_id was found."""
+
+
+def is_soundcloud_url(url):
+    return bool(url and _URL_RE.match(url))
+
+
+def is_soundcloud_set(url):
+    return bool(url and _SET_RE.match(url))
+
+
+def search_query(query):
+    """The search terms of an `sc: <query>` request, or None for anything else."""
+    if not isinstance(query, str) or not SEARCH_PREFIX_RE.match(query):
+        return None
+    return SEARCH_PREFIX_RE.sub('', query, count=1).strip() or None
+
+
+class TTLCache:
+    """Size-capped LRU whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, ttl, maxsize=SOUNDCLOUD_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SoundCloudClient:
+    """
+    SoundCloud API v2 over one pooled aiohttp session. The public web client's
+    client_id is scraped once and reused until the API answers 401/403, then
+    scraped again. Resolves, searches and stream URLs are cached with TTLs.
+    Must be used from the bot's event loop.
+    """
+
+    def __init__(self, client_id=SOUNDCLOUD_CLIENT_ID):
+        self._client_id = client_id
+        self._client_id_lock = asyncio.Lock()
+        self._session = None
+        self.resolve_cache = TTLCache(SOUNDCLOUD_RESOLVE_TTL)
+        self.search_cache = TTLCache(SOUNDCLOUD_SEARCH_TTL)
+        self.stream_cache = TTLCache(SOUNDCLOUD_STREAM_TTL)
+        self.client_id_scrapes = 0
+
+    def _http(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=SOUNDCLOUD_MAX_CONNECTIONS, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=SOUNDCLOUD_TIMEOUT),
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _scrape_client_id(self):
+        """The client_id is embedded in one of the web app's script bundles, usually a late one."""
+        session = self._http()
+        async with session.get("https://soundcloud.com/") as resp:
+            html = await resp.text()
+        for script in reversed(_SCRIPT_RE.findall(html)):
+            async with session.get(script) as resp:
+                m = _CLIENT_ID_RE.search(await resp.text())
+            if m:
+                self.client_id_scrapes += 1
+                return m.group(1)
+        raise SoundCloudUnavailable("no client_id found in SoundCloud's web app")
+
+    async def client_id(self, rejected=None):
+        """Cached client_id; passing the one that was just `rejected` forces a fresh scrape."""
+        async with self._client_id_lock:
+            if self._client_id is None or self._client_id == rejected:
+                try:
+                    self._client_id = await self._scrape_client_id()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise SoundCloudUnavailable(f"client_id scrape failed: {e}") from e
+                logger.info("[SoundCloud] Scraped a new client_id")
+            return self._client_id
+
+    async def _get(self, url, params=None):
+        """GET an API URL with the client_id, scraping a new one once if it was rejected. None on 404."""
+        client_id = await self.client_id()
+        for attempt in range(2):
+            try:
+                async with self._http().get(url, params={**(params or {}), 'client_id': client_id}) as resp:
+                    if resp.status in (401, 403) and attempt == 0:
+                        client_id = await self.client_id(rejected=client_id)
+                        continue
+                    if resp.status == 404:
+                        return None
+                    if resp.status != 200:
+                        raise SoundCloudUnavailable(f"{url} answered {resp.status}")
+                    return await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise SoundCloudUnavailable(f"{url} failed: {e}") from e
+        raise SoundCloudUnavailable("client_id rejected after a fresh scrape")
+
+    async def resolve(self, url):
+        """Track or playlist JSON for a soundcloud.com URL, or None if it does not exist."""
+        data = self.resolve_cache.get(url)
+        if data is None:
+            data = await self._get(f"{SOUNDCLOUD_API}/resolve", {'url': url})
+            if data is not None:
+                self.resolve_cache.set(url, data)
+        return data
+
+    async def search(self, query, limit=1):
+        """Tracks matching `query`, without stream URLs."""
+        key = (query.lower(), limit)
+        tracks = self.search_cache.get(key)
+        if tracks is None:
+            data = await self._get(f"{SOUNDCLOUD_API}/search/tracks", {'q': query, 'limit': limit})
+            tracks = [Track.from_soundcloud(item, query) for item in (data or {}).get('collection', []) if item.get('kind') == 'track']
+            self.search_cache.set(key, tracks)
+        return [track.copy() for track in tracks]
+
+    async def _stream(self, data):
+        """(stream_url, codec, expires) for track JSON, preferring opus, then progressive MP3."""
+        cached = self.stream_cache.get(data['id'])
+        if cached is not None:
+            return cached
+        transcodings = [t for t in (data.get('media') or {}).get('transcodings', []) if not t.get('snipped')]
+        if not transcodings:
+            return None
+        def rank(t):
+            fmt = t.get('format') or {}
+            return ('opus' in fmt.get('mime_type', ''), fmt.get('protocol') == 'progressive')
+        best = max(transcodings, key=rank)
+        params = {'track_authorization': data['track_authorization']} if data.get('track_authorization') else None
+        located = await self._get(best['url'], params)
+        if not located or not located.get('url'):
+            return None
+        url = located['url']
+        m = _EXPIRES_RE.search(url)
+        expires = int(m.group(1)) if m else int(time.time() + SOUNDCLOUD_STREAM_TTL)
+        codec = 'opus' if 'opus' in (best.get('format') or {}).get('mime_type', '') else 'mp3'
+        result = (url, codec, expires)
+        self.stream_cache.set(data['id'], result, ttl=max(0.0, min(SOUNDCLOUD_STREAM_TTL, expires - time.time())))
+        return result
+
+    async def track(self, url_or_query):
+        """
+        A playable Track for a SoundCloud track URL or `sc:` search, or None
+        if nothing matched.
+        """
+        terms = search_query(url_or_query)
+        if terms is not None:
+            found = await self.search(terms)
+            if not found:
+                return None
+            song = found[0]
+            song.query = url_or_query
+            return song if await self.fill_stream(song) else None
+        data = await self.resolve(url_or_query)
+        if not data or data.get('kind') != 'track':
+            return None
+        song = Track.from_soundcloud(data, url_or_query)
+        return song if await self._set_stream(song, data) else None
+
+    async def _set_stream(self, song, data):
+        stream = await self._stream(data)
+        if stream is None:
+            return False
+        song.stream_url, song.codec, song.stream_expires = stream
+        return True
+
+    async def fill_stream(self, song):
+        """Give a SoundCloud Track (e.g. a queued set entry) a live stream URL. False if it is gone."""
+        data = await self.resolve(song.webpage_url)
+        if not data or data.get('kind') != 'track':
+            return False
+        return await self._set_stream(song, data)
+
+    async def iter_set(self, url, page_size=SOUNDCLOUD_SET_PAGE):
+        """
+        Yield lists of Tracks (without stream URLs) for a set, in order. The
+        resolve answer only has full data for the first few tracks; the rest
+        are ID stubs, fetched here in pages of up to 50. The first track is
+        yielded on its own so it can start playing at once.
+        """
+        data = await self.resolve(url)
+        if not data or data.get('kind') != 'playlist':
+            return
+        entries = data.get('tracks') or []
+        start = 0
+        while start < len(entries):
+            chunk = entries[start:start + (1 if start == 0 else page_size)]
+            start += len(chunk)
+            missing = [str(t['id']) for t in chunk if 'title' not in t]
+            if missing:
+                full = await self._get(f"{SOUNDCLOUD_API}/tracks", {'ids': ','.join(missing)}) or []
+                by_id = {t['id']: t for t in full}
+                chunk = [by_id.get(t['id'], t) for t in chunk]
+            tracks = [Track.from_soundcloud(t, url) for t in chunk if t.get('permalink_url') and t.get('streamable', True)]
+            if tracks:
+                yield tracks
+
+    def stats(self):
+        return {
+            'client_id_scrapes': self.client_id_scrapes,
+            'caches': {
+                name: {'entries': len(cache), 'hits': cache.hits, 'misses': cache.misses}
+                for name, cache in (('resolve', self.resolve_cache), ('search', self.search_cache), ('stream', self.stream_cache))
+            },
+        }
+
+
+# Shared client; one connection pool for every guild
+soundcloud = SoundCloudClient()
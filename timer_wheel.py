@@ -0,0 +1,153 @@
+import os
+import math
+import asyncio
+import logging
+
+TIMER_TICK_SECONDS = float(os.getenv('SONIX_TIMER_TICK_SECONDS', '1'))
+WHEEL_SLOTS = 64
+WHEEL_LEVELS = 4  # 64**4 ticks: about 194 days at one-second ticks
+
+logger = logging.getLogger("sonix_playback")
+
+
+class _Timer:
+    __slots__ = ('key', 'expires', 'callback', 'bucket')
+
+    def __init__(self, key, expires, callback):
+        self.key = key
+        self.expires = expires  # absolute tick
+        self.callback = callback
+        self.bucket = None
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel for coarse per-guild deadlines (idle disconnects,
+    fallback music). schedule() and cancel() are O(1) dict operations; a single
+    driver task advances the wheel once per tick and fires due callbacks, so
+    thousands of idle guilds cost one coroutine instead of one sleeper each.
+
+    Timers are keyed, e.g. (guild_id, 'idle'): scheduling a key that already
+    exists replaces it. Callbacks run on the event loop; a returned coroutine
+    is started as a task. Must be used from the event loop thread.
+    """
+
+    def __init__(self, tick_seconds=TIMER_TICK_SECONDS, slots=WHEEL_SLOTS, levels=WHEEL_LEVELS):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._timers = {}
+        self._tick = 0
+        self._origin = None
+        self._driver = None
+        self._wakeup = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _clock_tick(self, loop):
+        return int((loop.time() - self._origin) / self.tick_seconds)
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = loop.time()
+            self._wakeup = asyncio.Event()
+        if self._driver is None or self._driver.done():
+            self._driver = loop.create_task(self._run())
+        return loop
+
+    def schedule(self, key, delay, callback):
+        """Run callback() after `delay` seconds (rounded up to a tick), replacing any timer for `key`."""
+        loop = self._start()
+        self.cancel(key)
+        if not self._timers:
+            # Nothing pending, so the wheel can jump straight to the current time
+            self._tick = self._clock_tick(loop)
+        ticks = max(1, math.ceil(delay / self.tick_seconds))
+        timer = _Timer(key, self._clock_tick(loop) + ticks, callback)
+        self._timers[key] = timer
+        self._place(timer)
+        self._wakeup.set()
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del timer.bucket[key]
+        return True
+
+    def remaining(self, key):
+        """Seconds until `key` fires, or None if it is not scheduled."""
+        timer = self._timers.get(key)
+        if timer is None:
+            return None
+        return max(0.0, self._origin + timer.expires * self.tick_seconds - asyncio.get_running_loop().time())
+
+    def _place(self, timer, cascading=False):
+        delta = timer.expires - self._tick
+        # A timer cascading down at the tick it expires goes into the level-0 slot drained right after
+        if delta < 0 or (delta == 0 and not cascading):
+            # Overdue (the loop stalled): fire on the next tick
+            timer.expires = self._tick + 1
+            delta = 1
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        # Past the top level's range: park in the furthest slot and re-place when it cascades
+        block = min(timer.expires // self.slots ** level, self._tick // self.slots ** level + self.slots)
+        timer.bucket = self._wheels[level][block % self.slots]
+        timer.bucket[timer.key] = timer
+
+    def _advance(self):
+        self._tick += 1
+        tick = self._tick
+        # Cascade higher levels whose block starts at this tick down towards level 0
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if tick % span:
+                continue
+            bucket = self._wheels[level][(tick // span) % self.slots]
+            timers = list(bucket.values())
+            bucket.clear()
+            for timer in timers:
+                self._place(timer, cascading=True)
+        bucket = self._wheels[0][tick % self.slots]
+        due = list(bucket.values())
+        bucket.clear()
+        for timer in due:
+            del self._timers[timer.key]
+            self._fire(timer)
+
+    def _fire(self, timer):
+        self.fired += 1
+        try:
+            result = timer.callback()
+            if asyncio.iscoroutine(result):
+                asyncio.get_running_loop().create_task(result)
+        except Exception:
+            logger.exception(f"[Sonix] Timer {timer.key!r} failed")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._timers:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = self._clock_tick(loop)
+            while self._tick < now and self._timers:
+                self._advance()
+            if not self._timers:
+                continue
+            next_tick_at = self._origin + (self._tick + 1) * self.tick_seconds
+            await asyncio.sleep(max(0.0, next_tick_at - loop.time()))
+
+
+# One wheel for every guild's idle and fallback deadlines
+timer_wheel = TimerWheel()
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import queue
+import threading
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv('SONIX_TRACING', '1') != '0'
+# Chrome trace-event format (JSON array); open in chrome://tracing or ui.perfetto.dev
+TRACE_FILE = os.getenv('SONIX_TRACE_FILE', os.path.join('sonix_state', 'traces.json'))
+TRACE_FILE_MAX_BYTES = int(os.getenv('SONIX_TRACE_FILE_MAX_BYTES', str(50 * 2 ** 20)))
+# Finished traces kept in memory per guild for !trace
+RECENT_TRACES = 5
+
+_current = contextvars.ContextVar('sonix_span', default=None)
+_trace_ids = itertools.count(1)
+
+
+def now_us():
+    """Monotonic clock in microseconds, the unit of the trace format."""
+    return time.perf_counter_ns() // 1000
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'parent', 'start', 'end', 'attrs', 'thread')
+
+    def __init__(self, trace, name, parent, start, attrs):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end = None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def depth(self):
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+    def to_event(self):
+        return {
+            'name': self.name,
+            'cat': 'sonix',
+            'ph': 'X',
+            'ts': self.start,
+            'dur': self.duration,
+            'pid': os.getpid(),
+            # One row per request in the trace viewer
+            'tid': self.trace.id,
+            'args': dict(self.attrs, thread=self.thread),
+        }
+
+
+class Trace:
+    """All spans recorded for one request (a command or an API call)."""
+
+    def __init__(self, name, guild_id=None, attrs=None):
+        self.id = next(_trace_ids)
+        self.guild_id = guild_id
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = self._open(name, None, attrs or {})
+
+    def _open(self, name, parent, attrs, start=None):
+        span = Span(self, name, parent, now_us() if start is None else start, attrs)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def _close(self, span, end=None):
+        span.end = now_us() if end is None else end
+        _exporter.export(span.to_event())
+
+    @property
+    def finished(self):
+        return self.root.end is not None
+
+    def breakdown(self):
+        """Spans as (depth, offset_ms, duration_ms or None, name, attrs), in start order."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        origin = self.root.start
+        return [
+            (s.depth(), (s.start - origin) / 1000, None if s.end is None else s.duration / 1000, s.name, s.attrs)
+            for s in spans
+        ]
+
+
+class _Exporter:
+    """
+    Appends finished spans to TRACE_FILE from a background thread, so the event
+    loop and the voice thread never block on file I/O. Spans that end after
+    their request (e.g. the first audio frame) are exported the same way.
+    """
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def export(self, event):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sonix-trace-export', daemon=True)
+                    self._thread.start()
+        self._queue.put(event)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > TRACE_FILE_MAX_BYTES:
+            os.replace(self.path, self.path + '.1')
+        f = open(self.path, 'a', encoding='utf-8')
+        if f.tell() == 0:
+            # The array format allows a missing closing bracket, so events can just be appended
+            f.write('[\n')
+        return f
+
+    def _run(self):
+        f = None
+        while True:
+            event = self._queue.get()
+            try:
+                if f is None:
+                    f = self._open()
+                f.write(json.dumps(event, default=str) + ',\n')
+                if self._queue.empty():
+                    f.flush()
+                    if f.tell() > TRACE_FILE_MAX_BYTES:
+                        f.close()
+                        f = None
+            except OSError:
+                f = None
+
+
+_exporter = _Exporter()
+# {guild_id: deque[Trace]}, most recent last
+recent_traces = {}
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def start_trace(name, guild_id=None, **attrs):
+    """
+    Open a new trace whose root span covers the with-block. Context is carried
+    into asyncio tasks created inside the block (and into coroutines handed to
+    another loop with run_coroutine_threadsafe); use bind() for thread pools.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    trace = Trace(name, guild_id, attrs)
+    token = _current.set(trace.root)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        trace._close(trace.root)
+        recent_traces.setdefault(guild_id, deque(maxlen=RECENT_TRACES)).append(trace)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Record a child span of the current one. A no-op outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace._open(name, parent, attrs)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        _current.reset(token)
+        parent.trace._close(child)
+
+
+def record(name, parent, start, end, **attrs):
+    """Record an already-measured span (times from now_us()) under `parent`."""
+    if parent is None:
+        return
+    parent.trace._close(parent.trace._open(name, parent, attrs, start=start), end=end)
+
+
+def bind(fn):
+    """Run `fn` in the caller's context, e.g. when handing it to a thread pool."""
+    if _current.get() is None:
+        return fn
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def trace_first_read(source, name='first_frame'):
+    """
+    Record the time from now until the player thread first reads audio from
+    `source`. Patches the instance once and removes the patch on first use, so
+    later frames pay nothing.
+    """
+    parent = _current.get()
+    if parent is None:
+        return source
+    start = now_us()
+    read = source.read
+
+    def first_read():
+        del source.read
+        data = read()
+        record(name, parent, start, now_us(), bytes=len(data))
+        return data
+
+    source.read = first_read
+    return source
+
+
+def instrument_discord_http(http):
+    """Wrap discord.py's HTTPClient.request so every REST call is a span."""
+    request = http.request
+
+    async def traced_request(route, *args, **kwargs):
+        if _current.get() is None:
+            return await request(route, *args, **kwargs)
+        with span(f"discord {route.method} {route.path}"):
+            return await request(route, *args, **kwargs)
+
+    http.request = traced_request
+
+
+def last_trace(guild_id):
+    traces = recent_traces.get(guild_id)
+    return traces[-1] if traces else None
@@ -0,0 +1,142 @@
+import re
+import time
+
+# YouTube stream URLs carry their expiry time as `expire=<unix time>` (or `/expire/<t>/`)
+_EXPIRE_RE = re.compile(r'[?&/]expire[=/](\d+)')
+# Re-resolve a little before the URL actually expires so ffmpeg never opens a dead link
+STREAM_EXPIRY_MARGIN = 60
+
+
+def stream_expiry(stream_url):
+    if not stream_url:
+        return None
+    m = _EXPIRE_RE.search(stream_url)
+    return int(m.group(1)) if m else None
+
+
+class Track:
+    """
+    Compact record for a queued or cached song. Holds only what playback and
+    the API need instead of yt-dlp's full info dict (formats, thumbnails,
+    captions, headers), which is often hundreds of KB per track.
+    """
+
+    __slots__ = (
+        'id', 'title', 'webpage_url', 'thumbnail', 'duration',
+        'stream_url', 'stream_expires', 'codec',
+        'query', 'is_ytmusic', 'is_search', 'gain_db',
+    )
+
+    # Stable identity and display fields; stream fields are never persisted
+    RECORD_FIELDS = ('id', 'title', 'webpage_url', 'thumbnail', 'duration', 'query', 'is_ytmusic', 'is_search', 'gain_db')
+
+    def __init__(self, id=None, title='', webpage_url='', thumbnail='', duration=None,
+                 stream_url=None, stream_expires=None, codec=None,
+                 query=None, is_ytmusic=False, is_search=False, gain_db=None):
+        self.id = id
+        self.title = title
+        self.webpage_url = webpage_url
+        self.thumbnail = thumbnail
+        self.duration = duration
+        self.stream_url = stream_url
+        self.stream_expires = stream_expires
+        self.codec = codec
+        self.query = query
+        self.is_ytmusic = is_ytmusic
+        self.is_search = is_search
+        # Loudness normalization gain from analysis; None until measured
+        self.gain_db = gain_db
+
+    @classmethod
+    def from_info(cls, info, query=None, is_ytmusic=False, is_search=False):
+        """Build a Track from a yt-dlp info dict (the dict itself is not kept)."""
+        stream_url = info.get('url')
+        webpage_url = info.get('webpage_url') or ''
+        if info.get('_type') == 'url':
+            # Flat playlist/search entry: `url` is the watch page, not a stream
+            webpage_url = webpage_url or stream_url or ''
+            stream_url = None
+        return cls(
+            id=info.get('id'),
+            title=info.get('title') or query or '',
+            webpage_url=webpage_url,
+            # Flat entries only carry the thumbnails list, smallest first
+            thumbnail=info.get('thumbnail') or ((info.get('thumbnails') or [{}])[-1].get('url') or ''),
+            duration=info.get('duration'),
+            stream_url=stream_url,
+            stream_expires=stream_expiry(stream_url),
+            codec=info.get('acodec'),
+            query=query,
+            is_ytmusic=is_ytmusic,
+            is_search=is_search,
+        )
+
+    @classmethod
+    def from_invidious(cls, info, query=None, is_ytmusic=False, is_search=False):
+        """Build a Track from invidious_helper.get_invidious_audio_url()'s result."""
+        return cls(
+            id=info.get('id'),
+            title=info.get('title') or query or '',
+            webpage_url=info.get('webpage_url') or '',
+            thumbnail=info.get('thumbnail') or '',
+            duration=info.get('duration'),
+            stream_url=info.get('audio_url'),
+            stream_expires=stream_expiry(info.get('audio_url')),
+            codec=info.get('codec'),
+            query=query,
+            is_ytmusic=is_ytmusic,
+            is_search=is_search,
+        )
+
+    @classmethod
+    def from_soundcloud(cls, data, query=None):
+        """Build a Track from SoundCloud API track JSON; the stream URL is filled in separately."""
+        user = data.get('user') or {}
+        return cls(
+            id=f"soundcloud:{data.get('id')}",
+            title=data.get('title') or query or '',
+            webpage_url=data.get('permalink_url') or '',
+            thumbnail=data.get('artwork_url') or user.get('avatar_url') or '',
+            duration=(data.get('full_duration') or data.get('duration') or 0) // 1000 or None,
+            query=query,
+        )
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(**{key: record[key] for key in cls.RECORD_FIELDS if key in record})
+
+    def to_record(self):
+        record = {}
+        for key in self.RECORD_FIELDS:
+            value = getattr(self, key)
+            if value:
+                record[key] = value
+        return record
+
+    def copy(self, **changes):
+        fields = {key: getattr(self, key) for key in self.__slots__}
+        fields.update(changes)
+        return Track(**fields)
+
+    def has_stream(self, now=None):
+        if not self.stream_url:
+            return False
+        if self.stream_expires is None:
+            return True
+        return self.stream_expires - STREAM_EXPIRY_MARGIN > (now or time.time())
+
+    def update_stream(self, resolved):
+        """Copy stream fields (and any missing display fields) from a freshly resolved Track."""
+        self.stream_url = resolved.stream_url
+        self.stream_expires = resolved.stream_expires
+        self.codec = resolved.codec
+        self.id = self.id or resolved.id
+        self.title = self.title or resolved.title
+        self.webpage_url = self.webpage_url or resolved.webpage_url
+        self.thumbnail = self.thumbnail or resolved.thumbnail
+        self.duration = self.duration or resolved.duration
+        if self.gain_db is None:
+            self.gain_db = resolved.gain_db
+
+    def __repr__(self):
+        return f"Track(id={self.id!r}, title={self.title!r})"
@@ -0,0 +1,167 @@
+import os
+import asyncio
+import logging
+
+import discord
+from tracing import span
+from timer_wheel import timer_wheel
+
+# How long an idle connection stays warm after the queue empties or !stop
+VOICE_GRACE_SECONDS = float(os.getenv('SONIX_VOICE_GRACE_SECONDS', '300'))
+VOICE_CONNECT_TIMEOUT = float(os.getenv('SONIX_VOICE_CONNECT_TIMEOUT', '30'))
+# Background reconnects after an unexpected drop: attempts and first backoff (doubles each time)
+VOICE_RECONNECT_ATTEMPTS = int(os.getenv('SONIX_VOICE_RECONNECT_ATTEMPTS', '4'))
+VOICE_RECONNECT_BACKOFF = float(os.getenv('SONIX_VOICE_RECONNECT_BACKOFF', '1'))
+# A voice client that is not connected is given this long to finish discord.py's own reconnect
+VOICE_SETTLE_SECONDS = 5
+
+logger = logging.getLogger("sonix_playback")
+
+
+class VoiceSessionManager:
+    """
+    Owns every voice connection so they are reused instead of re-established:
+    a guild that is already connected is moved with move_to (one voice state
+    update, no new handshake), idle connections stay warm for a grace period,
+    and unexpected drops are reconnected in the background while the queue is
+    left alone. Must be used from the bot's event loop.
+    """
+
+    def __init__(self, grace_seconds=VOICE_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        # Called with the guild after a background reconnect succeeds
+        self.on_reconnected = None
+        self._locks = {}
+        self._reconnects = {}  # guild_id -> asyncio.Task
+        self._leaving = set()  # guilds we disconnected on purpose
+        self.stats = {'connects': 0, 'moves': 0, 'reused': 0, 'reconnects': 0, 'idle_disconnects': 0}
+
+    def _lock(self, guild_id):
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    async def ensure(self, channel):
+        """
+        Return a connected VoiceClient in `channel`, reusing or moving the
+        guild's existing connection when there is one.
+        """
+        # An explicit join wins over a pending rejoin of the old channel
+        task = self._reconnects.pop(channel.guild.id, None)
+        if task:
+            task.cancel()
+        return await self._connect(channel)
+
+    async def _connect(self, channel):
+        guild = channel.guild
+        async with self._lock(guild.id):
+            self.cancel_idle(guild.id)
+            voice = guild.voice_client
+            if voice and not voice.is_connected():
+                # discord.py may be mid-reconnect; give it a moment before starting over
+                voice = await self._settle(voice)
+            if voice:
+                if voice.channel == channel:
+                    self.stats['reused'] += 1
+                    return voice
+                with span('voice move'):
+                    await voice.move_to(channel)
+                self.stats['moves'] += 1
+                return voice
+            with span('voice connect'):
+                voice = await channel.connect(timeout=VOICE_CONNECT_TIMEOUT, reconnect=True)
+            self.stats['connects'] += 1
+            return voice
+
+    async def _settle(self, voice):
+        deadline = asyncio.get_running_loop().time() + VOICE_SETTLE_SECONDS
+        while not voice.is_connected() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.25)
+        if voice.is_connected():
+            return voice
+        self._leaving.add(voice.guild.id)
+        await voice.disconnect(force=True)
+        return None
+
+    def release(self, guild, grace_seconds=None):
+        """
+        Nothing left to play: keep the connection warm and disconnect only if
+        it is still idle when the grace period ends.
+        """
+        self.cancel_idle(guild.id)
+        if guild.voice_client is None:
+            return
+        grace = self.grace_seconds if grace_seconds is None else grace_seconds
+        timer_wheel.schedule((guild.id, 'idle'), grace, lambda: self._expire(guild))
+
+    def cancel_idle(self, guild_id):
+        timer_wheel.cancel((guild_id, 'idle'))
+
+    def is_idle(self, guild_id):
+        return (guild_id, 'idle') in timer_wheel
+
+    async def _expire(self, guild):
+        voice = guild.voice_client
+        if voice and not (voice.is_playing() or voice.is_paused()):
+            await self.disconnect(guild)
+            self.stats['idle_disconnects'] += 1
+            logger.info(f"[Sonix] Disconnected from {guild.name} after {self.grace_seconds:.0f}s of inactivity.")
+
+    async def disconnect(self, guild):
+        """Leave voice on purpose (no background reconnect)."""
+        self.cancel_idle(guild.id)
+        task = self._reconnects.pop(guild.id, None)
+        if task:
+            task.cancel()
+        voice = guild.voice_client
+        if voice:
+            self._leaving.add(guild.id)
+            await voice.disconnect()
+
+    def left_on_purpose(self, guild_id):
+        """True (once) if the last disconnect in this guild was requested by us."""
+        if guild_id in self._leaving:
+            self._leaving.discard(guild_id)
+            return True
+        return False
+
+    def is_reconnecting(self, guild_id):
+        return guild_id in self._reconnects
+
+    def reconnect_later(self, channel):
+        """Rejoin `channel` in the background after an unexpected drop."""
+        gid = channel.guild.id
+        self.cancel_idle(gid)
+        if gid not in self._reconnects:
+            self._reconnects[gid] = asyncio.get_running_loop().create_task(self._reconnect(channel))
+
+    async def _reconnect(self, channel):
+        guild = channel.guild
+        delay = VOICE_RECONNECT_BACKOFF
+        try:
+            for attempt in range(1, VOICE_RECONNECT_ATTEMPTS + 1):
+                await asyncio.sleep(delay)
+                delay *= 2
+                # The channel may have been deleted while we were gone
+                if guild.get_channel(channel.id) is None:
+                    break
+                try:
+                    await self._connect(channel)
+                except (asyncio.TimeoutError, discord.ClientException, discord.HTTPException) as e:
+                    logger.warning(f"[Sonix] Voice reconnect {attempt}/{VOICE_RECONNECT_ATTEMPTS} to {channel} in {guild.name} failed: {e}")
+                    continue
+                self.stats['reconnects'] += 1
+                logger.info(f"[Sonix] Reconnected to {channel} in {guild.name} after {attempt} attempt(s).")
+                self._reconnects.pop(guild.id, None)
+                if self.on_reconnected:
+                    await self.on_reconnected(guild)
+                return
+            logger.error(f"[Sonix] Giving up on reconnecting to {channel} in {guild.name}.")
+        finally:
+            if self._reconnects.get(guild.id) is asyncio.current_task():
+                del self._reconnects[guild.id]
+
+
+# Shared by the Discord commands and the web API
+voice_sessions = VoiceSessionManager()